@@ -1,33 +1,44 @@
 import os
+import sys
 import threading
 import time
 import schedule
 import base64
 import uuid
 import json
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, send_file
 from dotenv import load_dotenv
 
 # Load environment variables FIRST
 load_dotenv()
 
-from googleapiclient.discovery import build
-from etl_pipeline import load_to_calendar, get_credentials, CALENDAR_ID
-from state_manager import load_config, save_config, get_last_successful_run
+# NOTE: etl_pipeline (and with it the Google SDKs) is imported lazily inside the
+# handlers that need it, so worker boot and /healthz don't pay for it.
+from state_manager import load_config, save_config, get_last_successful_run, load_run_history, set_active_tenant
+from tenants import load_tenants, run_all_tenants, tenant_report
+import metrics
+from calendar_client import event_lock, upsert_event
+from pending_store import PendingStore
+import ics_feed
+import profiling
+import run_log
+import push_sync
+from config_engine import validate_config, diff_config, build_config_plan, set_config_plan
 
 app = Flask(__name__)
 app.config['PROPAGATE_EXCEPTIONS'] = True
 app.config['TRAP_HTTP_EXCEPTIONS'] = True
 
 # ETL Status Global State
+# (the log lines come from run_log's recent-records cache)
 etl_status = {
     "status": "IDLE",
-    "last_run": None,
-    "logs": [],
-    "events": [], # Accepted/History events
-    "pending_events": [] # Queue for approval
+    "last_run": None
 }
 
+# Approval queue plus status-tagged history of recent events (see pending_store.py)
+pending_store = PendingStore()
+
 # Add 'last_run_timestamp' to etl_status dynamically on request, 
 # or just serve it via the settings API.
 
@@ -48,57 +59,94 @@ def setup_credentials():
         except Exception as e:
             print(f"Error decoding credentials: {e}")
 
-# Run setup on import
-setup_credentials()
+_credentials_ready = False
+_credentials_lock = threading.Lock()
+
+def ensure_credentials():
+    """Runs setup_credentials once, on the first request/job that needs Google access."""
+    global _credentials_ready
+    with _credentials_lock:
+        if not _credentials_ready:
+            setup_credentials()
+            _credentials_ready = True
 
-def log_message(message):
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"[{timestamp}] {message}"
-    print(log_entry)
-    etl_status["logs"].insert(0, log_entry)
-    # Keep only last 50 logs
-    if len(etl_status["logs"]) > 50:
-        etl_status["logs"].pop()
+def log_message(message, level=None, **fields):
+    """Prints the line and queues it as a structured record (run_log.py) - never waits on the disk."""
+    record = run_log.log(message, level, **fields)
+    print(run_log.format_line(record))
 
 def event_callback(event_data):
-    """Callback to store found events in the global state."""
+    """Callback to store found events (records.PendingEvent) in the global state."""
     # Add timestamp and ID
-    event_data['_discovered_at'] = time.strftime("%Y-%m-%d %H:%M:%S")
-    if 'id' not in event_data:
-        event_data['id'] = str(uuid.uuid4())
-    
-    # Add to pending queue uniquely
-    # Check if duplicate by ID (or Summary+Start?)
-    # Simple ID check:
-    if not any(e['id'] == event_data['id'] for e in etl_status["pending_events"]):
-        etl_status["pending_events"].insert(0, event_data)
-    
-    # Also keep a history log in "events" but mark as "Pending"
-    etl_status["events"].insert(0, {**event_data, "status_tag": "PENDING"})
+    event_data.discovered_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    if not event_data.id:
+        event_data.id = str(uuid.uuid4())
     
-    # Keep only last 50 events
-    if len(etl_status["events"]) > 50:
-        etl_status["events"].pop()
+    # Add to pending queue uniquely by ID; it also goes into the history marked "Pending"
+    pending_store.add(event_data)
 
-def run_etl_job(is_manual=False):
-    log_message("Starting ETL Job...")
+# One sync at a time: full runs and push batches read and rewrite the same
+# state files (deferred emails, near-duplicates, Gmail historyId)
+_sync_lock = threading.Lock()
+
+def run_etl_job(is_manual=False, profile=None):
+    """`profile` runs the job under a profiler (profiling.PROFILE_MODES); None runs it as is."""
+    log_message("Starting ETL Job..." + (f" (profiling: {profile})" if profile else ""))
+    # A push batch in progress finishes first
+    with _sync_lock:
+        etl_status["status"] = "RUNNING"
+
+        try:
+            ensure_credentials()
+            # Import and call actual ETL pipeline here
+            from etl_pipeline import run_pipeline
+            with profiling.profile_run(profile, "manual" if is_manual else "scheduled", log_callback=log_message):
+                tenants = load_tenants()
+                if tenants:
+                    # Multi-household deployment: fan out over the worker pool
+                    run_all_tenants(tenants, log_callback=log_message, event_callback=event_callback)
+                else:
+                    run_pipeline(log_callback=log_message, event_callback=event_callback, is_manual=is_manual)
+            # time.sleep(2) # Simulating work - Removed
+            # log_message("ETL Job Completed Successfully.") - Logic handled in pipeline or can add here
+        except Exception as e:
+            log_message(f"ETL Job Failed: {str(e)}")
+        finally:
+            etl_status["status"] = "IDLE"
+            etl_status["last_run"] = time.strftime("%Y-%m-%d %H:%M:%S")
+
+def run_push_sync(batch):
+    """Debounced Gmail push batch -> incremental sync (see push_sync.py)."""
+    if not _sync_lock.acquire(blocking=False):
+        # The running sweep covers these messages, and the stored historyId
+        # isn't advanced, so the next push batch picks up from there anyway
+        log_message("Push sync: full sync already running, skipping this batch")
+        return
     etl_status["status"] = "RUNNING"
-    
     try:
-        # Import and call actual ETL pipeline here
-        from etl_pipeline import run_pipeline
-        run_pipeline(log_callback=log_message, event_callback=event_callback, is_manual=is_manual)
-        # time.sleep(2) # Simulating work - Removed
-        # log_message("ETL Job Completed Successfully.") - Logic handled in pipeline or can add here
-    except Exception as e:
-        log_message(f"ETL Job Failed: {str(e)}")
+        ensure_credentials()
+        report = push_sync.run_push_batch(batch, log_callback=log_message, event_callback=event_callback)
+        log_message(f"Push sync: {report['notices']} notification(s) -> {report['outcome']}")
     finally:
         etl_status["status"] = "IDLE"
-        etl_status["last_run"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        _sync_lock.release()
+
+push_debouncer = push_sync.Debouncer(run_push_sync)
+
+def renew_gmail_watch():
+    try:
+        ensure_credentials()
+        push_sync.renew_watch(log_callback=log_message)
+    except Exception as e:
+        log_message(f"Gmail watch renewal failed: {e}")
 
 def scheduler_loop():
-    # Run once a day at 18:00 PM as requested
-    schedule.every().day.at("18:00").do(run_etl_job)
+    # Run once a day at 18:00 PM as requested - with push notifications on, this is the safety net
+    schedule.every().day.at("18:00").do(run_etl_job, profile=profiling.PROFILE_SCHEDULED_RUNS or None)
+    # Gmail watches expire after 7 days; renew daily (no-op unless GMAIL_PUSH_TOPIC and PUSH_VERIFICATION_TOKEN are set)
+    schedule.every().day.at("06:00").do(renew_gmail_watch)
+    if push_sync.GMAIL_PUSH_TOPIC:
+        threading.Thread(target=renew_gmail_watch, daemon=True).start()
     
     # Also run once heavily at startup? Or wait for manual trigger?
     # schedule.run_all()
@@ -119,68 +167,188 @@ def dashboard():
 def debug():
     return render_template('debug.html')
 
+@app.route('/healthz')
+def healthz():
+    """Liveness check - answers without loading the pipeline or any Google SDK."""
+    return jsonify({
+        "status": "ok",
+        "etl_status": etl_status["status"],
+        "pipeline_loaded": "etl_pipeline" in sys.modules
+    }), 200
+
 @app.route('/api/status')
 def get_status():
-    return jsonify(etl_status)
+    return jsonify({**etl_status,
+                    "logs": run_log.recent_lines(),
+                    "events": [e.to_dict(with_status=True) for e in pending_store.history()],
+                    "pending_events": [e.to_dict() for e in pending_store.pending()]})
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Prometheus text format by default; ?format=json returns the persisted run records."""
+    if request.args.get('format') == 'json':
+        return jsonify({"current_run": metrics.current_run_id(), "runs": load_run_history(),
+                        "unscoped": metrics.unscoped()})
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/logs')
+def get_logs():
+    """
+    Structured run log records, newest first. Filters: run, msg (Gmail message
+    id), level (minimum), stage, tenant, q (text), since/until (epoch or ISO), limit.
+    """
+    try:
+        limit = min(int(request.args.get('limit', 200)), 1000)
+        result = run_log.query(run=request.args.get('run'), msg=request.args.get('msg'),
+                               level=request.args.get('level'), stage=request.args.get('stage'),
+                               tenant=request.args.get('tenant'), text=request.args.get('q'),
+                               since=request.args.get('since'), until=request.args.get('until'), limit=limit)
+    except ValueError as e:
+        return jsonify({"message": f"Bad filter: {e}"}), 400
+    return jsonify(result)
+
+@app.route('/api/tenants')
+def get_tenants():
+    """Per-tenant queue lag, run duration and quota wait from the latest fan-out."""
+    return jsonify(tenant_report)
 
 @app.route('/api/trigger', methods=['POST'])
 def trigger_etl():
+    """?profile=cprofile|sampling (or {"profile": ...} in the body) runs the job under a profiler."""
+    profile = request.args.get('profile') or (request.get_json(silent=True) or {}).get('profile')
+    if profile and profile not in profiling.PROFILE_MODES:
+        return jsonify({"message": f"Unknown profile mode: {profile}", "modes": list(profiling.PROFILE_MODES)}), 400
     if etl_status["status"] == "IDLE":
-        threading.Thread(target=run_etl_job, kwargs={"is_manual": True}).start()
+        threading.Thread(target=run_etl_job, kwargs={"is_manual": True, "profile": profile}).start()
         return jsonify({"message": "ETL Job Triggered"}), 200
     else:
         return jsonify({"message": "ETL Job already running"}), 409
 
+@app.route('/api/profiles')
+def get_profiles():
+    """Saved run profiles (newest first) with their hot-function summaries."""
+    return jsonify(profiling.list_profiles())
+
+@app.route('/api/profiles/<name>')
+def download_profile(name):
+    path = profiling.profile_path(name)
+    if path is None:
+        return jsonify({"message": "Profile not found"}), 404
+    return send_file(path, as_attachment=True, download_name=name)
+
+@app.route('/api/gmail/push', methods=['POST'])
+def gmail_push():
+    """Pub/Sub push endpoint for Gmail watch notifications. Acks at once; the sync runs debounced in the background."""
+    # No token configured means push is off - never accept unauthenticated notifications
+    if not push_sync.push_authorized(request.args.get('token')):
+        return jsonify({"message": "Forbidden"}), 403
+    try:
+        push_sync.handle_push(request.get_json(silent=True) or {}, push_debouncer)
+    except ValueError as e:
+        # Malformed body: Pub/Sub will retry it until the message expires, so log it for debugging
+        log_message(f"Push rejected: {e}")
+        return jsonify({"message": str(e)}), 400
+    return '', 204
+
+@app.route('/api/gmail/push', methods=['GET'])
+def gmail_push_status():
+    """The most recent push-triggered sync: notifications coalesced, outcome and timings."""
+    return jsonify(push_sync.last_push_report)
+
 @app.route('/api/events/pending', methods=['GET'])
 def get_pending():
-    return jsonify(etl_status["pending_events"])
+    """Newest first; with ?from=/&to= (ISO datetimes), the events starting in that range in date order."""
+    start, end = request.args.get('from'), request.args.get('to')
+    if start or end:
+        return jsonify([e.to_dict() for e in pending_store.between(start, end)])
+    return jsonify([e.to_dict() for e in pending_store.pending()])
 
 @app.route('/api/events/approve', methods=['POST'])
 def approve_event():
     event_id = request.json.get('id')
-    event_to_approve = next((e for e in etl_status["pending_events"] if e['id'] == event_id), None)
-    
-    if not event_to_approve:
-        return jsonify({"message": "Event not found"}), 404
-        
-    # Valid Event found in Pending. Now Execute Real Load.
-    try:
-        # Re-construct service here (or keep a global singleton if thread-safe)
-        creds = get_credentials()
-        calendar_service = build('calendar', 'v3', credentials=creds)
-        
-        # We need to transform the event dict back to what load_to_calendar expects IF it expects the *source* JSON. 
-        # But wait, load_to_calendar constructs the event body.
-        # Actually our `pending_event` IS the Google Calendar body structure (mostly) plus metadata!
-        # Because we modified `load_to_calendar` to return the `event` dict.
-        # So we can just insert it directly.
-        
-        # Clean metadata - Exclude internal and non-standard fields
-        body = {k:v for k,v in event_to_approve.items() if k not in ['id', 'source', '_discovered_at', 'status_tag', 'source_url', 'gmail_url']}
-        
+
+    # One approval per event at a time: a double click waits here, then finds the event already approved
+    with event_lock(event_id):
+        event_to_approve = pending_store.get(event_id)
+
+        if not event_to_approve:
+            if pending_store.status(event_id) == "APPROVED":
+                return jsonify({"message": "Event already approved"}), 200
+            return jsonify({"message": "Event not found"}), 404
+
+        # Valid Event found in Pending. Now Execute Real Load.
+        # Events from a multi-household run go to that tenant's calendar with its credentials
+        tenant = next((t for t in load_tenants() if t.id == event_to_approve.tenant_id), None)
+        set_active_tenant(tenant)
         try:
-            log_message(f"Attempting to insert into Calendar ID: {CALENDAR_ID}")
-            log_message(f"Event Body: {json.dumps(body)}")
-            result = calendar_service.events().insert(calendarId=CALENDAR_ID, body=body).execute()
-        except Exception as api_err:
-            log_message(f"API Error during insert: {str(api_err)}")
-            raise api_err
-            
-        log_message(f"APPROVED & CREATED: {result.get('htmlLink')}")
-        
-        # Remove from Pending
-        etl_status["pending_events"] = [e for e in etl_status["pending_events"] if e['id'] != event_id]
-        
-        # Update History Status
-        for e in etl_status["events"]:
-            if e.get('id') == event_id:
-                e['status_tag'] = "APPROVED"
-                
-        return jsonify({"message": "Event Approved", "link": result.get('htmlLink')}), 200
-        
-    except Exception as e:
-        log_message(f"Approval Failed: {e}")
-        return jsonify({"message": f"Error: {e}"}), 500
+            ensure_credentials()
+            from etl_pipeline import build, get_credentials, get_calendar_id
+
+            # Re-construct service here (or keep a global singleton if thread-safe)
+            creds = get_credentials()
+            calendar_service = build('calendar', 'v3', credentials=creds)
+
+            # The pending event carries the Google Calendar body, including its
+            # deterministic id - so the write is an upsert and retrying it is safe.
+            body = event_to_approve.calendar_body()
+
+            try:
+                calendar_id = get_calendar_id()
+                log_message(f"Attempting to upsert into Calendar ID: {calendar_id}")
+                log_message(f"Event Body: {json.dumps(body)}")
+                action, result = upsert_event(calendar_service, calendar_id, body)
+            except Exception as api_err:
+                log_message(f"API Error during upsert: {str(api_err)}")
+                raise api_err
+
+            log_message(f"APPROVED & {action.upper()}: {result.get('htmlLink')}")
+
+            # Remove from Pending and mark APPROVED in the history
+            pending_store.resolve(event_id, "APPROVED")
+            # ... and publish it on the subscription feed (/feed.ics). The event is approved
+            # by now either way, so a feed problem is logged rather than reported as a failure
+            try:
+                ics_feed.get_feed(tenant).add(event_to_approve)
+            except Exception as feed_err:
+                log_message(f"Feed update failed for approved event {event_id}: {feed_err}")
+
+            return jsonify({"message": "Event Approved", "link": result.get('htmlLink')}), 200
+
+        except Exception as e:
+            log_message(f"Approval Failed: {e}")
+            return jsonify({"message": f"Error: {e}"}), 500
+        finally:
+            set_active_tenant(None)
+
+@app.route('/feed.ics')
+def approved_events_feed():
+    """
+    Approved events as an iCalendar subscription. ?child=<label> keeps the
+    events tagged for one child, ?tenant=<id> picks a household. Conditional
+    requests (If-None-Match / If-Modified-Since) get a 304 until the next approval.
+    """
+    # No FEED_TOKEN configured means no feed - it lists the children's names and whereabouts
+    if not ics_feed.feed_authorized(request.args.get('token')):
+        return jsonify({"message": "Forbidden"}), 403
+    tenant = None
+    if request.args.get('tenant'):
+        tenant = next((t for t in load_tenants() if t.id == request.args.get('tenant')), None)
+        if tenant is None:
+            return jsonify({"message": "Unknown tenant"}), 404
+    feed = ics_feed.get_feed(tenant)
+    child = request.args.get('child')
+
+    etag, last_modified = feed.validators(child)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = request.if_modified_since is not None and request.if_modified_since >= last_modified
+    response = Response(status=304) if not_modified else Response(feed.render(child), mimetype='text/calendar')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.max_age = ics_feed.FEED_MAX_AGE
+    return response
 
 @app.route('/settings')
 def settings():
@@ -192,8 +360,8 @@ def get_settings():
     last_run_ts = get_last_successful_run()
     
     # Calculate stats for display
-    total_events = len(etl_status["events"])
-    pending_count = len(etl_status["pending_events"])
+    total_events = len(pending_store.history())
+    pending_count = len(pending_store)
     
     response = {
         "config": config,
@@ -209,21 +377,33 @@ def get_settings():
 @app.route('/api/settings', methods=['POST'])
 def update_settings():
     new_config = request.json
+    errors, warnings = validate_config(new_config)
+    if errors:
+        return jsonify({"message": "Invalid settings", "errors": errors, "warnings": warnings}), 400
+
+    # Diff against the Gist as it is now, not a cached copy - an edit made
+    # elsewhere since then would otherwise look unchanged (or changed) here
+    changes = diff_config(load_config(max_age=0), new_config)
+    if not changes:
+        # Nothing changed - skip the Gist write
+        return jsonify({"message": "No changes", "changes": [], "warnings": warnings}), 200
+
     if save_config(new_config):
-        return jsonify({"message": "Settings saved successfully"}), 200
+        # Prebuild matchers, Gmail query and prompt context so the next run starts ready
+        set_config_plan(build_config_plan(new_config))
+        log_message(f"Settings saved ({len(changes)} change(s): {', '.join(changes[:5])})")
+        return jsonify({"message": "Settings saved successfully", "changes": changes, "warnings": warnings}), 200
     else:
         return jsonify({"message": "Failed to save settings"}), 500
 
 @app.route('/api/events/reject', methods=['POST'])
 def reject_event():
     event_id = request.json.get('id')
-    etl_status["pending_events"] = [e for e in etl_status["pending_events"] if e['id'] != event_id]
-    log_message(f"Event ID {event_id} REJECTED.")
-     # Update History Status
-    for e in etl_status["events"]:
-        if e.get('id') == event_id:
-            e['status_tag'] = "REJECTED"
-            
+    # Don't reject an event while an approval of it is in flight
+    with event_lock(event_id):
+        if pending_store.resolve(event_id, "REJECTED"):
+            log_message(f"Event ID {event_id} REJECTED.")
+
     return jsonify({"message": "Event Rejected"}), 200
 
 # Start Scheduler in a separate thread (Works for Gunicorn worker too)
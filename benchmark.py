@@ -0,0 +1,383 @@
+"""
+Offline benchmark for run_pipeline.
+
+Runs the whole pipeline against the stand-in services in fake_services.py
+on synthetic mailboxes and writes throughput, per-stage latency percentiles,
+API call counts and peak memory per stage to a JSON file.
+
+    python benchmark.py --sizes 100,1000,10000
+    python benchmark.py --sizes 1000 --gmail-latency 0.02 --gmail-429-rpm 250
+    python benchmark.py --sizes 1000 --fetch-profile raw
+    python benchmark.py --sizes 2000 --subquery-chars 120 --query-workers 4
+    EMAIL_CAPTURE_PATH=/tmp/news.jsonl.gz python benchmark.py --sizes 500 --newsletter-ratio 0.3
+    python benchmark.py --sizes 200 --tenants 16 --tenant-workers 4
+    python benchmark.py --sizes 10000 --heuristic-workers 1,2,4,8 --no-memory
+    python benchmark.py --sizes 500 --exactly-once --calendar-timeout-rate 0.3
+    python benchmark.py --sizes 1000 --ambiguous-ratio 0.2 --llm-budget 25
+    python benchmark.py --sizes 1000 --ics-ratio 0.2 --ics-fixtures 5000
+    python benchmark.py --sizes 1000 --compare bench_results/bench_old.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from fake_services import (FakeCalendarService, FakeGenAI, FakeGistServer, FakeGmailService,
+                           FaultProfile, generate_ics_fixtures, generate_mailbox)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, text=True).strip()
+    except Exception:
+        return None
+
+def _load_benchmark_config():
+    with open(os.path.join(BASE_DIR, "config.template.json")) as f:
+        return json.load(f)
+
+def prepare_environment(gist_url, data_dir):
+    """Points state_manager/etl_pipeline at the stand-ins. Must run before they are imported."""
+    os.environ["GITHUB_TOKEN"] = "offline-benchmark"
+    os.environ["CONFIG_GIST_ID"] = "fakegist"
+    os.environ["GITHUB_API_URL"] = gist_url
+    os.environ["ETL_DATA_DIR"] = data_dir
+    os.environ["GEMINI_API_KEY"] = "offline-benchmark"
+    os.environ["GEMINI_RATE_LIMIT_SECONDS"] = "0"
+    # Each size is a fresh run against the same Gist - don't serve a cached config
+    os.environ["CONFIG_CACHE_SECONDS"] = "0"
+
+def _run_pipeline(etl_pipeline, args, **kwargs):
+    # Route the chosen fetch profile through to extract_emails
+    original = etl_pipeline.extract_emails
+    if args.fetch_profile:
+        etl_pipeline.extract_emails = lambda service, **kw: original(service, fetch_profile=args.fetch_profile, **kw)
+    try:
+        etl_pipeline.run_pipeline(**kwargs)
+    finally:
+        etl_pipeline.extract_emails = original
+
+def run_once(size, args, gist, data_dir):
+    import etl_pipeline
+    import metrics
+    import profiling
+
+    gmail = FakeGmailService(generate_mailbox(size, seed=args.seed, newsletter_ratio=args.newsletter_ratio,
+                                              ambiguous_ratio=args.ambiguous_ratio, ics_ratio=args.ics_ratio,
+                                              duplicate_ratio=args.duplicate_ratio),
+                             FaultProfile(args.gmail_latency, args.jitter, args.error_rate, args.gmail_429_rpm, seed=args.seed))
+    calendar = FakeCalendarService(FaultProfile(args.calendar_latency, args.jitter, args.error_rate, seed=args.seed))
+    gemini = FakeGenAI(FaultProfile(args.gemini_latency, args.jitter, args.error_rate, args.gemini_429_rpm, seed=args.seed))
+    etl_pipeline.genai = gemini
+
+    # Each size runs as a fresh backfill
+    for name in ("pipeline_state.json", "near_duplicates.json", "deferred_emails.json"):
+        if os.path.exists(os.path.join(data_dir, name)):
+            os.remove(os.path.join(data_dir, name))
+    gist.stats.clear()
+
+    queued = []
+    status = "success"
+    if args.memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with profiling.profile_run(args.profile, f"bench{size}"):
+            _run_pipeline(etl_pipeline, args, log_callback=lambda msg: None, event_callback=queued.append,
+                          services={"gmail": gmail, "calendar": calendar})
+    except Exception as e:
+        status = f"failed: {e}"
+    duration = time.perf_counter() - start
+    if args.memory:
+        tracemalloc.stop()
+
+    # run_pipeline closes its scope even when it fails; last_run() has the snapshot
+    snapshot = metrics.finish_run() or metrics.last_run() or {}
+    timers = snapshot.get("timers", {})
+    return {
+        "size": size,
+        "status": status,
+        "duration_seconds": round(duration, 4),
+        "throughput_msgs_per_second": round(size / duration, 2) if duration else None,
+        "events_queued": len(queued),
+        "stages": {name: {k: t[k] for k in ("count", "sum", "p50", "p95", "p99", "max")} for name, t in timers.items()},
+        "api_calls": snapshot.get("counters", {}),
+        "service_stats": {"gmail": gmail.stats, "calendar": calendar.stats, "gist": dict(gist.stats), "gemini": gemini.stats},
+        "peak_memory_bytes": snapshot.get("peak_memory_bytes", {}),
+        "gmail_query_plan": snapshot.get("reports", {}).get("gmail_query_plan"),
+        "extraction_router": snapshot.get("reports", {}).get("extraction_router"),
+        "near_duplicates": snapshot.get("reports", {}).get("near_duplicates"),
+        "priority": snapshot.get("reports", {}).get("priority"),
+    }
+
+def run_tenants_once(size, args, data_dir):
+    """Fans `args.tenants` households of `size` messages each over the tenant worker pool."""
+    import tenants as tenants_module
+
+    config = _load_benchmark_config()
+    households = []
+    for i in range(args.tenants):
+        tenant = tenants_module.Tenant(f"bench{i}", data_dir=os.path.join(data_dir, f"bench{i}"),
+                                       calendar_id=f"bench{i}@calendar", calls_per_minute=args.tenant_rpm)
+        tenant.config = config
+        households.append(tenant)
+
+    def build_services(tenant):
+        profile = FaultProfile(args.gmail_latency, args.jitter, args.error_rate, seed=args.seed)
+        return {"gmail": FakeGmailService(generate_mailbox(size, seed=args.seed), profile),
+                "calendar": FakeCalendarService(FaultProfile(args.calendar_latency, args.jitter, args.error_rate))}
+
+    start = time.perf_counter()
+    report = tenants_module.run_all_tenants(households, log_callback=lambda msg: None,
+                                            max_workers=args.tenant_workers, build_services=build_services)
+    duration = time.perf_counter() - start
+    return {
+        "size": size,
+        "tenants": args.tenants,
+        "workers": args.tenant_workers,
+        "duration_seconds": round(duration, 4),
+        "tenants_per_minute": round(args.tenants / duration * 60, 2) if duration else None,
+        "per_tenant": report,
+    }
+
+def heuristic_scaling(size, args):
+    """Times the parse/heuristic stage alone at each worker count on the same synthetic corpus."""
+    from gmail_client import _bodies_from_payload
+    from heuristic_pool import run_heuristic_stage
+    from records import Message
+
+    config = _load_benchmark_config()
+    emails = []
+    for message in generate_mailbox(size, seed=args.seed):
+        headers = message["payload"]["headers"]
+        emails.append(Message(message["id"], next(h["value"] for h in headers if h["name"] == "Subject"),
+                              body=_bodies_from_payload(message["payload"])))
+
+    results = []
+    baseline = None
+    for workers in [int(w) for w in args.heuristic_workers.split(",")]:
+        start = time.perf_counter()
+        run_heuristic_stage(emails, config, workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        results.append({"workers": workers, "seconds": round(elapsed, 4),
+                        "msgs_per_second": round(size / elapsed, 2), "speedup": round(baseline / elapsed, 2)})
+        print(f"  heuristic stage, {workers} worker(s): {elapsed:.2f}s ({baseline / elapsed:.2f}x)")
+    return {"size": size, "cpu_count": os.cpu_count(), "results": results}
+
+def ics_parse(count, args):
+    """Parse throughput on a fixture set of `count` calendars in the ICS_SHAPES mix."""
+    from ics_parser import parse_vevents
+
+    fixtures = generate_ics_fixtures(count, seed=args.seed)
+    total_bytes = sum(len(text.encode("utf-8")) for text in fixtures)
+    start = time.perf_counter()
+    events = sum(len(parse_vevents(text, "fixture")) for text in fixtures)
+    elapsed = time.perf_counter() - start
+    result = {"calendars": count, "events": events, "bytes": total_bytes, "seconds": round(elapsed, 4),
+              "calendars_per_second": round(count / elapsed, 1), "us_per_calendar": round(elapsed / count * 1e6, 1),
+              "mb_per_second": round(total_bytes / elapsed / 1e6, 2)}
+    print(f"  ics: {count} calendars -> {events} events in {elapsed:.3f}s "
+          f"({result['calendars_per_second']}/s, {result['us_per_calendar']} us each)")
+    return result
+
+def _pending_events(size, args):
+    """Runs a synthetic mailbox through extraction/labelling into the pending queue, deduplicated by id like the app."""
+    from etl_pipeline import load_to_calendar
+    from gmail_client import _bodies_from_payload
+    from heuristics import heuristic_extraction, quick_screen_subject
+
+    config = _load_benchmark_config()
+    scratch = FakeCalendarService()
+    pending = {}
+    for message in generate_mailbox(size, seed=args.seed):
+        subject = next(h["value"] for h in message["payload"]["headers"] if h["name"] == "Subject")
+        if quick_screen_subject(subject, config) == "IGNORE":
+            continue
+        body = _bodies_from_payload(message["payload"])
+        event_data = heuristic_extraction(body, subject, message["id"], config)
+        if not event_data:
+            continue
+        event_data.source = "email"
+        _, event = load_to_calendar(scratch, event_data, approval_mode=True, raw_body=body, config=config)
+        if event:
+            pending.setdefault(event.id, event)
+    return list(pending.values())
+
+def exactly_once(size, args):
+    """
+    Approves every pending event twice concurrently, then re-runs the whole
+    batch, against a calendar that loses `--calendar-timeout-rate` of its
+    responses after applying the write. With upserts the calendar must end up
+    with exactly one entry per event; the naive insert-and-retry is shown for contrast.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from calendar_client import event_lock, upsert_event
+
+    pending = _pending_events(size, args)
+
+    def faulty_calendar():
+        return FakeCalendarService(FaultProfile(args.calendar_latency, args.jitter, args.error_rate,
+                                                seed=args.seed, timeout_rate=args.calendar_timeout_rate))
+
+    calendar = faulty_calendar()
+    outcomes = {"created": 0, "updated": 0, "failed": 0}
+
+    def approve(event):
+        try:
+            with event_lock(event.id):
+                action, _ = upsert_event(calendar, "bench", event.calendar_body(), retries=5, backoff=0)
+            outcomes[action] += 1
+        except Exception:
+            outcomes["failed"] += 1
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(approve, pending + pending))  # double-click every approval
+        list(pool.map(approve, pending))            # then retry the whole batch
+
+    naive = faulty_calendar()
+    for event in pending:
+        body = {k: v for k, v in event.calendar_body().items() if k != "id"}
+        for _ in range(6):
+            try:
+                naive.events().insert(calendarId="bench", body=body).execute()
+                break
+            except Exception:
+                continue
+
+    result = {
+        "size": size,
+        "pending_events": len(pending),
+        "timeout_rate": args.calendar_timeout_rate,
+        "calendar_entries": len(calendar.store),
+        "duplicates": len(calendar.store) - len(pending),
+        "missing": len(set(e.id for e in pending) - set(calendar.store)),
+        "outcomes": outcomes,
+        "calendar_stats": calendar.stats,
+        "naive_insert_entries": len(naive.store),
+        "naive_duplicates": len(naive.store) - len(pending),
+    }
+    print(f"  exactly-once: {len(pending)} events -> {result['calendar_entries']} entries "
+          f"({result['duplicates']} duplicates, {result['missing']} missing, {outcomes['failed']} failed); "
+          f"naive insert+retry: {result['naive_insert_entries']} entries")
+    return result
+
+def compare(current, baseline_path):
+    """Prints throughput and per-stage p95 deltas against an earlier results file."""
+    with open(baseline_path) as f:
+        baseline = {r["size"]: r for r in json.load(f)["runs"]}
+    for run in current["runs"]:
+        old = baseline.get(run["size"])
+        if not old:
+            continue
+        old_tp, new_tp = old["throughput_msgs_per_second"] or 0, run["throughput_msgs_per_second"] or 0
+        change = ((new_tp - old_tp) / old_tp * 100) if old_tp else 0
+        print(f"[{run['size']} msgs] throughput {old_tp} -> {new_tp} msg/s ({change:+.1f}%)")
+        for name, stage in sorted(run["stages"].items()):
+            before = old["stages"].get(name)
+            if before:
+                print(f"    {name:28s} p95 {before['p95'] * 1000:9.2f}ms -> {stage['p95'] * 1000:9.2f}ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline run_pipeline benchmark")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma separated mailbox sizes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--gmail-latency", type=float, default=0.0)
+    parser.add_argument("--calendar-latency", type=float, default=0.0)
+    parser.add_argument("--gist-latency", type=float, default=0.0)
+    parser.add_argument("--gemini-latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--gmail-429-rpm", type=int, default=0, help="Gmail calls per minute before 429s")
+    parser.add_argument("--gemini-429-rpm", type=int, default=0, help="Gemini calls per minute before 429s")
+    parser.add_argument("--fetch-profile", default=None, help="Gmail fetch profile: full, partial, raw or screened")
+    parser.add_argument("--newsletter-ratio", type=float, default=0.0, help="Share of long newsletters in the mailbox")
+    parser.add_argument("--ambiguous-ratio", type=float, default=0.0, help="Share of notices the heuristics can only half read")
+    parser.add_argument("--ics-ratio", type=float, default=0.0, help="Share of notices that are calendar invites")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="Share of notices re-sent with small edits")
+    parser.add_argument("--ics-fixtures", type=int, default=0, help="Also time parsing N fixture calendars")
+    parser.add_argument("--llm-budget", type=int, default=None, help="Gemini escalations per run (LLM_ESCALATION_BUDGET)")
+    parser.add_argument("--subquery-chars", type=int, default=None, help="Max OR-clause length per Gmail sub-query")
+    parser.add_argument("--query-workers", type=int, default=None, help="Gmail sub-queries listed in parallel")
+    parser.add_argument("--exactly-once", action="store_true", help="Also run the concurrent approve/retry scenario")
+    parser.add_argument("--calendar-timeout-rate", type=float, default=0.2, help="Calendar responses lost after the write applied")
+    parser.add_argument("--tenants", type=int, default=0, help="Also run N households through the tenant worker pool")
+    parser.add_argument("--tenant-workers", type=int, default=4)
+    parser.add_argument("--tenant-rpm", type=int, default=6000, help="Per-tenant API calls per minute")
+    parser.add_argument("--heuristic-workers", default=None, help="e.g. 1,2,4,8: also time the heuristic stage per process count")
+    parser.add_argument("--profile", default=None, choices=("cprofile", "sampling"),
+                        help="Run the pipeline under a profiler (artifacts in <data dir>/profiles)")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Skip tracemalloc (it slows runs down)")
+    parser.add_argument("--out", default=None, help="Results file (default bench_results/bench_<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier results file to diff against")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    data_dir = tempfile.mkdtemp(prefix="etl_bench_")
+    gist = FakeGistServer(_load_benchmark_config(), profile=FaultProfile(args.gist_latency, args.jitter, args.error_rate))
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "settings": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "runs": [],
+        "tenant_runs": [],
+        "heuristic_scaling": [],
+        "exactly_once": [],
+        "ics_parse": None
+    }
+
+    with gist:
+        prepare_environment(gist.url, data_dir)
+        if args.subquery_chars:
+            os.environ["GMAIL_SUBQUERY_CHARS"] = str(args.subquery_chars)
+        if args.query_workers:
+            os.environ["GMAIL_QUERY_WORKERS"] = str(args.query_workers)
+        if args.llm_budget is not None:
+            os.environ["LLM_ESCALATION_BUDGET"] = str(args.llm_budget)
+        try:
+            for size in sizes:
+                print(f"Benchmarking {size} messages...")
+                run = run_once(size, args, gist, data_dir)
+                results["runs"].append(run)
+                print(f"  {run['status']}: {run['duration_seconds']}s, {run['throughput_msgs_per_second']} msg/s, "
+                      f"{run['events_queued']} events queued")
+                router = run["extraction_router"]
+                if router:
+                    print(f"  router: {router['decisions']['escalated']}/{router['emails']} escalated "
+                          f"({router['escalation_rate']:.1%}), {router['decisions']['over_budget']} over budget, "
+                          f"{router['decisions']['deferred']} deferred, "
+                          f"LLM changed {router['llm']['changed_outcome']} outcomes")
+                if args.exactly_once:
+                    results["exactly_once"].append(exactly_once(size, args))
+                if args.heuristic_workers:
+                    results["heuristic_scaling"].append(heuristic_scaling(size, args))
+                if args.tenants:
+                    fanout = run_tenants_once(size, args, data_dir)
+                    results["tenant_runs"].append(fanout)
+                    print(f"  {args.tenants} tenants on {args.tenant_workers} workers: {fanout['duration_seconds']}s "
+                          f"({fanout['tenants_per_minute']} tenants/min)")
+            if args.ics_fixtures:
+                results["ics_parse"] = ics_parse(args.ics_fixtures, args)
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    out = args.out or os.path.join(BASE_DIR, "bench_results", f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {out}")
+
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Idempotent Calendar writes.
+
+Every event gets a deterministic id derived from its source (Gmail message id
+or portal URL) and a fingerprint of the event within that source, so the same
+notice always maps to the same calendar entry. Writes are upserts: insert with
+that id, and on 409 (already exists) patch it instead. A retry after a lost
+response, a re-run of a failed batch or a second approval click therefore
+updates the one entry rather than creating another.
+"""
+import hashlib
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+UPSERT_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+
+def event_fingerprint(event):
+    """
+    Identifies a CandidateEvent within its source. An invite UID ("ics:...")
+    names one event across updates and cancellations, so only the title goes
+    in. A message or portal page can list the same title on several dates -
+    two "Swimming" sessions in one email, a weekly club on the calendar page -
+    so there the start date goes in too. A re-sent notice is a new message
+    and gets new ids either way; collapsing re-sends is near_duplicates.py's job.
+    """
+    title = re.sub(r'\s+', ' ', event.event_title or '').strip().lower()
+    if (event.source_id or '').startswith('ics:'):
+        return title
+    return f"{title}\n{(event.start_time or '')[:10]}"
+
+def calendar_event_id(source_key, fingerprint):
+    """
+    sha1 hex of source + fingerprint. Hex digits are a subset of the base32hex
+    alphabet (0-9, a-v) Calendar requires for client-supplied ids, and 40
+    characters is within its 5-1024 length limit.
+    """
+    return hashlib.sha1(f"{source_key}\n{fingerprint}".encode("utf-8")).hexdigest()
+
+def event_id_for(event):
+    source_key = event.source_id or event.gmail_url or event.source_url or ''
+    return calendar_event_id(source_key, event_fingerprint(event))
+
+def _status(error):
+    resp = getattr(error, 'resp', None)
+    return getattr(resp, 'status', None) or getattr(error, 'status_code', None)
+
+def _is_transient(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = _status(error)
+    try:
+        return int(status) == 429 or int(status) >= 500
+    except (TypeError, ValueError):
+        return False
+
+# Per-event locks so two approvals of the same event can't race each other:
+# event id -> [lock, holders and waiters]. An entry goes once nobody uses it.
+_locks = {}
+_locks_guard = threading.Lock()
+
+@contextmanager
+def event_lock(event_id):
+    with _locks_guard:
+        entry = _locks.get(event_id)
+        if entry is None:
+            entry = _locks[event_id] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _locks[event_id]
+
+def upsert_event(service, calendar_id, body, retries=UPSERT_RETRIES, backoff=RETRY_BACKOFF_SECONDS):
+    """
+    Inserts `body` (which must carry its deterministic 'id') or, if the id
+    already exists, patches it. Transient failures - timeouts, 429s, 5xx - are
+    retried; a write whose response was lost comes back as a 409 and is patched.
+    Returns ("created" | "updated", event).
+    """
+    event_id = body['id']
+    for attempt in range(retries + 1):
+        try:
+            try:
+                metrics.inc("calendar.events.insert")
+                with metrics.stage("calendar_insert"):
+                    return "created", service.events().insert(calendarId=calendar_id, body=body).execute()
+            except Exception as e:
+                if str(_status(e)) != "409":
+                    raise
+            metrics.inc("calendar.events.patch")
+            with metrics.stage("calendar_patch"):
+                return "updated", service.events().patch(calendarId=calendar_id, eventId=event_id, body=body).execute()
+        except Exception as e:
+            if attempt >= retries or not _is_transient(e):
+                raise
+            metrics.inc("calendar.upsert_retries")
+            time.sleep(backoff * (2 ** attempt))
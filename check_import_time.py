@@ -0,0 +1,81 @@
+"""
+Import-time budget check for the entry points.
+
+Imports each module in a fresh interpreter with `-X importtime`, fails if it
+exceeds its budget or drags in one of the heavy SDKs that must stay lazy.
+
+    python check_import_time.py            # exit code 1 on any violation
+"""
+import json
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Cumulative import time budgets in milliseconds
+BUDGETS_MS = {
+    "app": int(os.getenv("IMPORT_BUDGET_APP_MS", "1500")),
+    "etl_pipeline": int(os.getenv("IMPORT_BUDGET_PIPELINE_MS", "400")),
+    "heuristics": 150,
+    "state_manager": 100,
+}
+
+# Must not be imported just by importing an entry point
+HEAVY_MODULES = [
+    "googleapiclient",
+    "google.generativeai",
+    "google_auth_oauthlib",
+    "google.oauth2",
+    "browser_use",
+    "langchain_google_genai",
+    "playwright",
+    "requests",
+]
+
+def measure(module):
+    """Returns (cumulative_ms, heavy modules loaded, slowest imports) for `import module`."""
+    code = (
+        "import json, sys\n"
+        f"import {module}\n"
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))\n"
+    )
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=BASE_DIR,
+                          capture_output=True, text=True, env=dict(os.environ, WERKZEUG_RUN_MAIN="true"))
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "import failed")
+
+    timings = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:       123 |        456 |   package.module"
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append((name.rstrip(), int(cumulative_us)))
+
+    total_us = next((us for name, us in timings if name.strip() == module), 0)
+    # Shallow entries (importtime indents nested imports further) - the biggest contributors
+    slowest = sorted(((name.strip(), us) for name, us in timings if name.startswith("   ") and not name.startswith("    ")),
+                     key=lambda item: item[1], reverse=True)[:8]
+    loaded = json.loads(proc.stdout.strip().splitlines()[-1])
+    return total_us / 1000.0, loaded, slowest
+
+def main():
+    failures = 0
+    for module, budget in BUDGETS_MS.items():
+        try:
+            total_ms, heavy, slowest = measure(module)
+        except Exception as e:
+            print(f"[SKIP] {module}: {e}")
+            continue
+        ok = total_ms <= budget and not heavy
+        failures += 0 if ok else 1
+        print(f"[{'PASS' if ok else 'FAIL'}] {module}: {total_ms:.1f}ms (budget {budget}ms)")
+        if heavy:
+            print(f"       heavy modules imported eagerly: {', '.join(heavy)}")
+        for name, us in slowest:
+            print(f"       {us / 1000.0:8.1f}ms  {name}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
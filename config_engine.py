@@ -0,0 +1,223 @@
+"""
+Config schema, validation, change detection and the precompiled "config plan".
+
+Settings saves are validated against CONFIG_SCHEMA and diffed against the
+cached current config, so bad configs are rejected at save time and no-op
+saves never reach the Gist. A successful save builds a config plan - the
+compiled matchers, the Gmail query terms and the prompt context - which
+runs then start from instead of rebuilding it per email.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+# Used when the config has no search terms at all
+DEFAULT_SEARCH_TERMS = [
+    "School Trip", "Assembly", "Sports Day", "Parent Evening", "PTA", "Costume Day",
+    "Year 3", "Year 5", "Year 6", "Reception Year", "Wednesday Notice",
+    "Benjamin Dewsbery", "Benji Dewsbery", "Tristan Dewsbery",
+    "Benjamin", "Benji", "Tristan",  # Added standalone first names
+    "Bishop Gilpin", "Dees Days", "FOBG", "Friends of Bishop Gilpin",
+    "Krispy Kreme", "donut", "fundraiser"
+]
+DEFAULT_EXCLUSIONS = ["MARC", "SADIQ", "ENERGY"]
+
+# section -> field -> kind. "terms" is a list of non-empty strings.
+CONFIG_SCHEMA = {
+    "search_settings": {
+        "children": "terms",
+        "year_groups": "terms",
+        "schools": "terms",
+        "clubs": "terms",
+        "general_keywords": "terms",
+    },
+    "filtering_logic": {
+        "exclude_keywords": "terms",
+        "strict_override_keywords": "terms",
+    },
+    "child_mappings": "mapping",
+}
+
+# Upper bound on the '("a" OR "b" ...)' clause of one Gmail sub-query. Long OR
+# chains are slow for Gmail to evaluate and hit its query length limit.
+MAX_SUBQUERY_CHARS = int(os.getenv("GMAIL_SUBQUERY_CHARS", "400"))
+
+def _check_terms(path, value, errors):
+    if not isinstance(value, list):
+        errors.append(f"{path} must be a list of strings")
+        return
+    for i, term in enumerate(value):
+        if not isinstance(term, str) or not term.strip():
+            errors.append(f"{path}[{i}] must be a non-empty string")
+        elif '"' in term:
+            errors.append(f"{path}[{i}] must not contain double quotes ({term})")
+
+def validate_config(config):
+    """Returns (errors, warnings). A config with errors must not be saved."""
+    errors = []
+    warnings = []
+    if not isinstance(config, dict):
+        return ["Config must be a JSON object"], warnings
+
+    for section, spec in CONFIG_SCHEMA.items():
+        value = config.get(section)
+        if value is None:
+            errors.append(f"Missing section: {section}")
+            continue
+        if spec == "mapping":
+            if not isinstance(value, dict):
+                errors.append(f"{section} must be an object of label -> list of terms")
+                continue
+            for label, terms in value.items():
+                _check_terms(f"{section}.{label}", terms, errors)
+            continue
+        if not isinstance(value, dict):
+            errors.append(f"{section} must be an object")
+            continue
+        for field, kind in spec.items():
+            if field in value:
+                _check_terms(f"{section}.{field}", value[field], errors)
+        for field in value:
+            if field not in spec:
+                warnings.append(f"Unknown setting {section}.{field} is ignored")
+
+    if errors:
+        return errors, warnings
+
+    search = config["search_settings"]
+    if not search.get("children"):
+        errors.append("search_settings.children must list at least one child")
+    for yg in search.get("year_groups", []):
+        if not re.search(r'\d', yg):
+            warnings.append(f"Year group '{yg}' has no year number; it is searched for but not used to match year mentions")
+
+    # A term that is both searched for and excluded silently drops every match
+    excluded = {e.lower() for e in config["filtering_logic"].get("exclude_keywords", [])}
+    for field in CONFIG_SCHEMA["search_settings"]:
+        for term in search.get(field, []):
+            if term.lower() in excluded:
+                errors.append(f"'{term}' is both a search term ({field}) and an exclude keyword")
+
+    first_names = {c.split()[0].lower() for c in search.get("children", []) if c.split()}
+    for label in config["child_mappings"]:
+        if label.lower() not in first_names:
+            warnings.append(f"child_mappings label '{label}' doesn't match any configured child's first name")
+
+    for term in search_terms(config):
+        if len(term) + 2 > MAX_SUBQUERY_CHARS:
+            warnings.append(f"Search term '{term[:40]}...' is longer than a whole Gmail sub-query")
+
+    return errors, warnings
+
+def diff_config(old, new, path=""):
+    """Lists the dotted paths that differ between two configs."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in sorted(set(old) | set(new)):
+            changes.extend(diff_config(old.get(key), new.get(key), f"{path}.{key}" if path else key))
+        return changes
+    return [] if old == new else [path or "(root)"]
+
+def config_version(config):
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def search_terms(config):
+    search_settings = config.get("search_settings", {})
+    all_terms = []
+    seen = set()
+    for field in ("children", "schools", "clubs", "general_keywords"):
+        for term in search_settings.get(field, []):
+            # Gmail search is case-insensitive - the same term twice only lengthens the query
+            if term.lower() not in seen:
+                seen.add(term.lower())
+                all_terms.append(term)
+    # Fallback to hardcoded defaults if config is broken
+    return all_terms or list(DEFAULT_SEARCH_TERMS)
+
+def exclusion_terms(config):
+    # Removed "NEWSLETTER" to allow AI to parse newsletters for dates
+    return config.get("filtering_logic", {}).get("exclude_keywords", DEFAULT_EXCLUSIONS)
+
+def build_query_terms(config):
+    """The '("a" OR "b") -X -Y' part of the Gmail search; date and label filters are added per run."""
+    terms_query = " OR ".join([f'"{t}"' for t in search_terms(config)])
+    exclusion_query = " ".join([f"-{e}" for e in exclusion_terms(config)])
+    return f"({terms_query}) {exclusion_query}"
+
+def split_query_terms(terms, max_chars=None):
+    """Packs terms, in order, into groups whose quoted OR clause stays within max_chars."""
+    max_chars = max_chars or MAX_SUBQUERY_CHARS
+    groups = []
+    current = []
+    length = 2  # the surrounding parentheses
+    for term in terms:
+        cost = len(term) + 2 + (4 if current else 0)  # quotes, plus " OR " between terms
+        if current and length + cost > max_chars:
+            groups.append(current)
+            current = []
+            length = 2
+            cost = len(term) + 2
+        current.append(term)
+        length += cost
+    if current:
+        groups.append(current)
+    return groups
+
+def build_gmail_queries(config, max_chars=None):
+    """
+    The Gmail search split into bounded sub-queries: [{"terms": [...], "q": '("a" OR "b") -X'}].
+    Exclusions go on every sub-query. Date and label filters are added per run.
+    """
+    exclusion_query = " ".join([f"-{e}" for e in exclusion_terms(config)])
+    queries = []
+    for group in split_query_terms(search_terms(config), max_chars):
+        terms_query = " OR ".join([f'"{t}"' for t in group])
+        queries.append({"terms": group, "q": f"({terms_query}) {exclusion_query}".strip()})
+    return queries
+
+def build_config_plan(config):
+    """Everything a run derives from the config, built once."""
+    from heuristics import get_matchers
+
+    search_settings = config.get("search_settings", {})
+    return {
+        "version": config_version(config),
+        "config": config,
+        "matchers": get_matchers(config),
+        "search_terms": search_terms(config),
+        "exclusions": exclusion_terms(config),
+        "gmail_query_terms": build_query_terms(config),
+        "gmail_queries": build_gmail_queries(config),
+        "prompt_context": {
+            "children": search_settings.get("children", ["Benjamin Dewsbery", "Tristan Dewsbery"]),
+            "keywords": search_settings.get("general_keywords", []),
+            "year_groups": search_settings.get("year_groups", []),
+            "clubs": search_settings.get("clubs", []),
+        },
+    }
+
+_plan_lock = threading.Lock()
+_plan = None
+
+def set_config_plan(plan):
+    global _plan
+    with _plan_lock:
+        _plan = plan
+
+def get_config_plan(config=None):
+    """
+    The plan for `config` (default: load_config()). Reuses the plan built at
+    save time (or by an earlier run) while the config version is unchanged.
+    """
+    from state_manager import load_config
+
+    config = config if config is not None else load_config()
+    version = config_version(config)
+    with _plan_lock:
+        if _plan is not None and _plan["version"] == version:
+            return _plan
+    plan = build_config_plan(config)
+    set_config_plan(plan)
+    return plan
@@ -0,0 +1,167 @@
+"""
+Pre-LLM context selection.
+
+Instead of the first 4000 characters of the body, the Gemini prompt gets the
+windows of text around date mentions and child/club/keyword mentions, ranked
+by how much they look like an event, within a per-email token budget. Short
+emails go through whole; long newsletters keep the paragraphs that matter
+wherever they sit.
+"""
+import os
+import re
+
+# Rough chars-per-token ratio for Gemini-style tokenizers
+CHARS_PER_TOKEN = 4
+
+# Body tokens sent per email (1000 tokens ~ the old 4000-character cut)
+EMAIL_TOKEN_BUDGET = int(os.getenv("EMAIL_TOKEN_BUDGET", "1000"))
+
+# Characters kept either side of an anchor
+WINDOW_RADIUS = int(os.getenv("CONTEXT_WINDOW_RADIUS", "240"))
+
+# The opening of an email usually says what it's about
+LEAD_CHARS = 200
+
+MONTHS = "january|february|march|april|may|june|july|august|september|october|november|december|jan|feb|mar|apr|jun|jul|aug|sep|sept|oct|nov|dec"
+WEEKDAYS = "monday|tuesday|wednesday|thursday|friday|saturday|sunday"
+
+# Date-like mentions, including those heuristic_extraction would parse
+DATE_PATTERN = re.compile(
+    fr'\b\d{{1,2}}(?:st|nd|rd|th)?[.\s]+(?:of\s+)?(?:{MONTHS})\b'
+    fr'|\b(?:{MONTHS})\s+\d{{1,2}}(?:st|nd|rd|th)?\b'
+    r'|\b\d{1,2}[/.-]\d{1,2}(?:[/.-]\d{2,4})?\b'
+    fr'|\b(?:{WEEKDAYS})\b'
+    r'|\b(?:today|tomorrow|tonight|next week|this week)\b',
+    re.IGNORECASE)
+
+DEADLINE_PATTERN = re.compile(r'\b(?:deadline|before|due|closes?|reply|book(?:ing)?s?|sign up|register)\b', re.IGNORECASE)
+
+# Compiled keyword patterns for the most recent config plan: (version, pattern)
+_keyword_cache = (None, None)
+
+def _keyword_pattern(prompt_context, version=None):
+    global _keyword_cache
+    if version is not None and _keyword_cache[0] == version:
+        return _keyword_cache[1]
+    terms = set()
+    for name in prompt_context.get("children", []):
+        terms.add(name)
+        terms.update(part for part in name.split() if len(part) > 2)
+    terms.update(prompt_context.get("keywords", []))
+    terms.update(prompt_context.get("year_groups", []))
+    terms.update(prompt_context.get("clubs", []))
+    terms = sorted((t for t in terms if t.strip()), key=len, reverse=True)
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(t) for t in terms) + r')\b', re.IGNORECASE) if terms else None
+    _keyword_cache = (version, pattern)
+    return pattern
+
+def find_anchors(text, prompt_context, version=None):
+    """Returns ([(offset, kind, matched text)], matched keyword set). kind is 'date' or 'keyword'."""
+    anchors = [(m.start(), "date", m.group(0)) for m in DATE_PATTERN.finditer(text)]
+    matched = set()
+    pattern = _keyword_pattern(prompt_context, version)
+    if pattern:
+        for m in pattern.finditer(text):
+            anchors.append((m.start(), "keyword", m.group(0)))
+            matched.add(m.group(0).lower())
+    anchors.sort()
+    return anchors, matched
+
+def _snap(text, start, end):
+    """Widens a window to the nearest whitespace so words aren't cut in half."""
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    while end < len(text) and not text[end].isspace():
+        end += 1
+    return start, end
+
+def select_context(text, prompt_context, token_budget=None, version=None):
+    """
+    Cuts `text` down to the windows around its date and keyword anchors.
+    Returns (selected text, stats). Text that fits the budget is returned whole.
+    stats["matched"] lists the keywords the email mentions (see prompt_targets).
+    """
+    token_budget = token_budget or EMAIL_TOKEN_BUDGET
+    char_budget = token_budget * CHARS_PER_TOKEN
+    text = re.sub(r'\s+', ' ', text or "").strip()
+    anchors, matched = find_anchors(text, prompt_context, version)
+    stats = {"input_chars": len(text), "windows": 0, "anchors": len(anchors), "matched": sorted(matched)}
+    if len(text) <= char_budget:
+        stats["output_chars"] = len(text)
+        return text, stats
+
+    if not anchors:
+        # Nothing to aim at - fall back to the opening of the email
+        selected = text[:char_budget]
+        stats["output_chars"] = len(selected)
+        return selected, stats
+
+    # Merge overlapping anchor windows, then score them: a date near a
+    # keyword or a deadline word is what an event looks like
+    windows = []
+    for offset, kind, _ in anchors:
+        start, end = max(0, offset - WINDOW_RADIUS), min(len(text), offset + WINDOW_RADIUS)
+        if windows and start <= windows[-1]["end"]:
+            window = windows[-1]
+            window["end"] = max(window["end"], end)
+        else:
+            window = {"start": start, "end": end, "dates": 0, "keywords": 0}
+            windows.append(window)
+        window["dates" if kind == "date" else "keywords"] += 1
+
+    for window in windows:
+        deadlines = len(DEADLINE_PATTERN.findall(text, window["start"], window["end"]))
+        both = 2 if window["dates"] and window["keywords"] else 0
+        window["score"] = (min(window["dates"], 4) * 2 + min(window["keywords"], 4) + min(deadlines, 2) + both) \
+            / max(1.0, (window["end"] - window["start"]) / (2 * WINDOW_RADIUS))
+
+    chosen = [{"start": 0, "end": min(LEAD_CHARS, len(text))}]
+    used = chosen[0]["end"]
+    for window in sorted(windows, key=lambda w: (-w["score"], w["start"])):
+        size = window["end"] - window["start"]
+        if used + size > char_budget:
+            # Trim the last window to what's left of the budget, centred on its anchors
+            remaining = char_budget - used
+            if remaining < WINDOW_RADIUS:
+                continue
+            middle = (window["start"] + window["end"]) // 2
+            window = {"start": max(0, middle - remaining // 2), "end": min(len(text), middle + remaining // 2)}
+            size = window["end"] - window["start"]
+        chosen.append(window)
+        used += size
+        if used >= char_budget:
+            break
+
+    # Back in document order, overlaps merged, gaps marked
+    chosen.sort(key=lambda w: w["start"])
+    parts = []
+    last_end = 0
+    for window in chosen:
+        start, end = _snap(text, max(window["start"], last_end), window["end"])
+        start = max(start, last_end)
+        if end <= last_end:
+            continue
+        if parts and start > last_end:
+            parts.append("[...]")
+        parts.append(text[start:end].strip())
+        last_end = end
+    selected = " ".join(parts)
+    if last_end < len(text):
+        selected += " [...]"
+
+    stats["windows"] = len(chosen)
+    stats["output_chars"] = len(selected)
+    return selected, stats
+
+def prompt_targets(prompt_context, matched):
+    """
+    The 'Contextual Targets' for one email: the children always (the model
+    has to tell them apart), keywords and year groups only if this email
+    mentions them (`matched`, from select_context's stats).
+    """
+    matched = set(matched)
+    return {
+        "children": prompt_context.get("children", []),
+        "keywords": [k for k in prompt_context.get("keywords", []) if k.lower() in matched],
+        "year_groups": [y for y in prompt_context.get("year_groups", []) if y.lower() in matched],
+    }
@@ -0,0 +1,258 @@
+"""
+Record-and-replay email corpus.
+
+Capture: set EMAIL_CAPTURE_PATH (or pass capture_path to extract_emails) and
+every fetched message is appended to a gzip'd JSON-lines corpus.
+
+Replay: run the corpus through screening, date extraction and the load-stage
+labelling without touching the network, then diff two replays:
+
+    python corpus.py replay corpus.jsonl.gz --out before.json
+    python corpus.py replay corpus.jsonl.gz --out after.json
+    python corpus.py diff before.json after.json
+
+Measure what the Gemini prompt would carry per message (see context_selector.py):
+
+    python corpus.py context corpus.jsonl.gz
+
+Profile the CPU-bound parts with e.g. `python -m cProfile -s cumtime corpus.py replay ...`.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+
+class CorpusWriter:
+    """Appends message records to a gzip'd JSON-lines file. Safe to share between threads."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Appending gzip members keeps earlier captures readable as one stream
+        self.file = gzip.open(path, "at", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def read_corpus(path):
+    """Yields the message records stored in a corpus file."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def _event_summary(event):
+    """The fields of a PendingEvent that define 'which event was produced' - used for diffs."""
+    return {
+        "summary": event.summary,
+        "start": event.start_time,
+        "end": event.end_time,
+        "location": event.location,
+        "colorId": event.color_id,
+    }
+
+def replay_corpus(path, config=None, repeat=1):
+    """
+    Feeds a corpus through quick_screen_subject -> heuristic_extraction ->
+    load_to_calendar (approval mode, in-memory calendar) and returns a report
+    with the produced events per message id and per-stage timings.
+    """
+    import metrics
+    import state_manager
+    from etl_pipeline import load_to_calendar
+    from fake_services import FakeCalendarService
+    from heuristics import heuristic_extraction, quick_screen_subject
+    from ics_parser import calendar_candidates
+    from records import Message
+
+    state_manager.pin_config(config if config is not None else state_manager.load_template_config())
+    config = state_manager.load_config()
+    emails = [Message.from_dict(email) for email in read_corpus(path)]
+    outcomes = {}
+
+    metrics.start_run()
+    start = time.perf_counter()
+    try:
+        for _ in range(repeat):
+            calendar = FakeCalendarService()
+            for email in emails:
+                if quick_screen_subject(email.subject, config) == "IGNORE":
+                    outcomes[email.id] = {"outcome": "screened_out"}
+                    continue
+                invites = calendar_candidates(email) if email.calendar else []
+                if invites:
+                    loaded = [load_to_calendar(calendar, event, approval_mode=True, config=config)[1] for event in invites]
+                    events = [_event_summary(event) for event in loaded if event]
+                    if events:
+                        outcomes[email.id] = {"outcome": "event", "event": events[0], "calendar_events": events}
+                    else:
+                        outcomes[email.id] = {"outcome": "skipped", "reason": "calendar events not labelled"}
+                    continue
+                event_data = heuristic_extraction(email.body, email.subject, email.id, config)
+                if not event_data:
+                    outcomes[email.id] = {"outcome": "no_date"}
+                    continue
+                event_data.source = "email"
+                event_data.message = email
+                result_msg, pending_event = load_to_calendar(calendar, event_data, approval_mode=True, config=config)
+                if pending_event:
+                    outcomes[email.id] = {"outcome": "event", "event": _event_summary(pending_event)}
+                else:
+                    outcomes[email.id] = {"outcome": "skipped", "reason": result_msg}
+    finally:
+        elapsed = time.perf_counter() - start
+        snapshot = metrics.finish_run()
+        state_manager.pin_config(None)
+
+    return {
+        "corpus": os.path.abspath(path),
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "messages": len(emails),
+        "repeat": repeat,
+        "elapsed_seconds": round(elapsed, 4),
+        "messages_per_second": round(len(emails) * repeat / elapsed, 2) if elapsed else None,
+        "events": sum(1 for o in outcomes.values() if o["outcome"] == "event"),
+        "stages": snapshot["timers"] if snapshot else {},
+        "outcomes": outcomes,
+    }
+
+def context_report(path, config=None, token_budget=None):
+    """
+    Compares the old prompt body (first 4000 characters) with the selected
+    context for every message: body tokens sent, and recall of the specific
+    dates the full text mentions - overall and for long emails, where the
+    old cut loses the most.
+    """
+    import re
+    import state_manager
+    from config_engine import build_config_plan
+    from context_selector import CHARS_PER_TOKEN, select_context
+    from etl_pipeline import strip_html
+
+    config = config if config is not None else state_manager.load_template_config()
+    plan = build_config_plan(config)
+    date_pattern = re.compile(r'\b\d{1,2}(?:st|nd|rd|th)?\s+(?:january|february|march|april|may|june|july|august|'
+                              r'september|october|november|december)\b|\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b', re.IGNORECASE)
+
+    totals = {"all": {}, "long": {}}
+    for email in read_corpus(path):
+        text = re.sub(r'\s+', ' ', strip_html(email.get("body", ""))).strip()
+        old = text[:4000]
+        new, _ = select_context(text, plan["prompt_context"], token_budget, plan["version"])
+        dates = set(m.group(0).lower() for m in date_pattern.finditer(text))
+        groups = ["all", "long"] if len(text) > 4000 else ["all"]
+        for group in groups:
+            t = totals[group]
+            t["messages"] = t.get("messages", 0) + 1
+            t["old_tokens"] = t.get("old_tokens", 0) + len(old) // CHARS_PER_TOKEN
+            t["new_tokens"] = t.get("new_tokens", 0) + len(new) // CHARS_PER_TOKEN
+            t["dates"] = t.get("dates", 0) + len(dates)
+            t["old_dates_kept"] = t.get("old_dates_kept", 0) + sum(1 for d in dates if d in old.lower())
+            t["new_dates_kept"] = t.get("new_dates_kept", 0) + sum(1 for d in dates if d in new.lower())
+
+    report = {}
+    for group, t in totals.items():
+        if not t:
+            continue
+        report[group] = {
+            "messages": t["messages"],
+            "avg_body_tokens": {"before": round(t["old_tokens"] / t["messages"], 1), "after": round(t["new_tokens"] / t["messages"], 1)},
+            "date_recall": {"before": round(t["old_dates_kept"] / t["dates"], 3) if t["dates"] else None,
+                            "after": round(t["new_dates_kept"] / t["dates"], 3) if t["dates"] else None},
+        }
+    return report
+
+def diff_reports(before, after):
+    """Compares two replay reports: which events appeared, vanished or changed, plus speed."""
+    added, removed, changed = [], [], []
+    for msg_id in sorted(set(before["outcomes"]) | set(after["outcomes"])):
+        old = before["outcomes"].get(msg_id, {})
+        new = after["outcomes"].get(msg_id, {})
+        if old.get("outcome") != "event" and new.get("outcome") == "event":
+            added.append({"id": msg_id, "was": old.get("outcome"), "event": new["event"]})
+        elif old.get("outcome") == "event" and new.get("outcome") != "event":
+            removed.append({"id": msg_id, "now": new.get("outcome"), "event": old["event"]})
+        elif old.get("outcome") == "event" and old.get("event") != new.get("event"):
+            changed.append({"id": msg_id, "before": old["event"], "after": new["event"]})
+
+    stages = {}
+    for name in sorted(set(before.get("stages", {})) | set(after.get("stages", {}))):
+        old = before.get("stages", {}).get(name, {})
+        new = after.get("stages", {}).get(name, {})
+        stages[name] = {"before_sum": old.get("sum"), "after_sum": new.get("sum")}
+
+    return {
+        "identical_events": not (added or removed or changed),
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+        "messages_per_second": {"before": before.get("messages_per_second"), "after": after.get("messages_per_second")},
+        "stages": stages,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay and diff captured email corpora")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    replay = sub.add_parser("replay", help="Run a corpus through the offline extraction stages")
+    replay.add_argument("corpus")
+    replay.add_argument("--config", help="Config JSON to use (default: config.template.json)")
+    replay.add_argument("--repeat", type=int, default=1, help="Replay the corpus N times for steadier timings")
+    replay.add_argument("--out", help="Write the report here (default: stdout summary only)")
+
+    context = sub.add_parser("context", help="Prompt body size and date recall: first-4000-chars vs selected windows")
+    context.add_argument("corpus")
+    context.add_argument("--config", help="Config JSON to use (default: config.template.json)")
+    context.add_argument("--token-budget", type=int, default=None)
+
+    diff = sub.add_parser("diff", help="Compare two replay reports")
+    diff.add_argument("before")
+    diff.add_argument("after")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "replay":
+        config = None
+        if args.config:
+            with open(args.config) as f:
+                config = json.load(f)
+        report = replay_corpus(args.corpus, config=config, repeat=args.repeat)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(report, f, indent=2)
+        print(f"{report['messages']} messages x{report['repeat']} in {report['elapsed_seconds']}s "
+              f"({report['messages_per_second']} msg/s), {report['events']} events")
+        return 0
+
+    if args.command == "context":
+        config = None
+        if args.config:
+            with open(args.config) as f:
+                config = json.load(f)
+        print(json.dumps(context_report(args.corpus, config=config, token_budget=args.token_budget), indent=2))
+        return 0
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    result = diff_reports(before, after)
+    print(json.dumps(result, indent=2))
+    # Non-zero exit when the produced events differ, so this can gate a change
+    return 0 if result["identical_events"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,23 @@
 import os
 import datetime
-import base64
 import json
 import time
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-import google.generativeai as genai
-from heuristics import identify_child, check_gift_heuristic, check_costume_heuristic, heuristic_extraction
+from heuristics import identify_child, check_gift_heuristic, check_costume_heuristic, heuristic_extraction, quick_screen_subject
 from portal_scanner import scan_school_portal
-from state_manager import get_last_successful_run, update_last_successful_run, load_config
+from state_manager import get_last_successful_run, update_last_successful_run, record_run, get_active_tenant
+from config_engine import get_config_plan
+import metrics
+import run_log
+from corpus import CorpusWriter
+from context_selector import select_context, prompt_targets
+from calendar_client import event_id_for, event_lock, upsert_event
+from records import CandidateEvent, Message, PendingEvent
+from gmail_client import fetch_email, list_message_ids, term_report
+from heuristic_pool import HEURISTIC_WORKERS, run_heuristic_stage
+from extraction_router import ExtractionRouter
+from ics_parser import calendar_cancellations, calendar_candidates
+from near_duplicates import collapse_near_duplicates, remember_near_duplicates
+from priority import NEAR_TERM_DAYS, RUN_EMAIL_QUOTA, can_defer, load_carry_over, prioritize, update_carry_over
 import asyncio
 from datetime import datetime
 import math
@@ -25,121 +32,110 @@ SCOPES = [
 # Configuration
 CALENDAR_ID = os.getenv('GOOGLE_CALENDAR_ID', '9k5kqvc6322s3ro121soijjc6g@group.calendar.google.com')
 
-def get_credentials():
+# Pause after each Gemini call to stay under the free tier (15 RPM)
+RATE_LIMIT_SECONDS = float(os.getenv('GEMINI_RATE_LIMIT_SECONDS', '10'))
+
+# The Google SDKs are slow to import - load them on first use so web workers
+# and scripts that never call Google don't pay for them at startup.
+genai = None
+
+def get_genai():
+    """google.generativeai, imported on first use (or a stand-in assigned to `genai`)."""
+    global genai
+    if genai is None:
+        import google.generativeai
+        genai = google.generativeai
+    return genai
+
+def build(service_name, version, credentials=None):
+    """Lazy wrapper around googleapiclient.discovery.build."""
+    from googleapiclient.discovery import build as discovery_build
+    return discovery_build(service_name, version, credentials=credentials)
+
+def get_calendar_id():
+    """Target calendar for the active tenant (see tenants.py), else GOOGLE_CALENDAR_ID."""
+    tenant = get_active_tenant()
+    return tenant.calendar_id if tenant is not None and tenant.calendar_id else CALENDAR_ID
+
+def get_credentials(token_path=None, credentials_path=None):
     """Gets valid user credentials from storage or initiates OAuth flow."""
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    tenant = get_active_tenant()
+    token_path = token_path or (tenant.token_path if tenant is not None else 'token.json')
+    credentials_path = credentials_path or (tenant.credentials_path if tenant is not None else 'credentials.json')
+
     creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+    if os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
     
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
-            if not os.path.exists('credentials.json'):
-                raise FileNotFoundError("credentials.json not found. Please add GCP credentials.")
+            if not os.path.exists(credentials_path):
+                raise FileNotFoundError(f"{credentials_path} not found. Please add GCP credentials.")
                 
             flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
+                credentials_path, SCOPES)
             creds = flow.run_local_server(port=0)
         
         # Save the credentials for the next run
-        with open('token.json', 'w') as token:
+        with open(token_path, 'w') as token:
             token.write(creds.to_json())
             
     return creds
 
-def extract_emails(service, query="label:inbox", date_filter="newer_than:1d"):
+@metrics.timed("extract_emails")
+def extract_emails(service, query="label:inbox", date_filter="newer_than:1d", capture_path=None, fetch_profile=None, plan=None,
+                   service_factory=None, only_ids=None, extra_ids=None):
     """
     Phase 1: EXTRACT
+    `plan` is the run's config plan (see config_engine.py); the search terms come prebuilt from it.
+    `service_factory` builds one Gmail client per listing thread (see gmail_client.list_message_ids).
+    `fetch_profile` selects how messages are downloaded (see gmail_client.py).
+    If `capture_path` (or EMAIL_CAPTURE_PATH) is set, every fetched message is
+    also appended to that compressed corpus file for offline replay (see corpus.py).
+    With `only_ids`, only those of the matching messages are fetched (push-triggered syncs).
+    `extra_ids` are fetched as well even if the search no longer lists them
+    (emails deferred by an earlier run); ones that can't be fetched are skipped.
     """
-    config = load_config()
-    search_settings = config.get("search_settings", {})
-    filtering_logic = config.get("filtering_logic", {})
-    
-    # Flatten all search terms
-    all_terms = []
-    all_terms.extend(search_settings.get("children", []))
-    all_terms.extend(search_settings.get("schools", []))
-    all_terms.extend(search_settings.get("clubs", []))
-    all_terms.extend(search_settings.get("general_keywords", []))
-    
-    # Deduplicate and quote
-    if not all_terms:
-         # Fallback to hardcoded defaults if config is broken
-         all_terms = [
-            "School Trip", "Assembly", "Sports Day", "Parent Evening", "PTA", "Costume Day", 
-            "Year 3", "Year 5", "Year 6", "Reception Year", "Wednesday Notice",
-            "Benjamin Dewsbery", "Benji Dewsbery", "Tristan Dewsbery",
-            "Benjamin", "Benji", "Tristan",  # Added standalone first names
-            "Bishop Gilpin", "Dees Days", "FOBG", "Friends of Bishop Gilpin",
-            "Krispy Kreme", "donut", "fundraiser"
-        ]
-    
-    # Construct OR query for terms
-    terms_query = " OR ".join([f'"{t}"' for t in all_terms])
-    
-    # Exclusions
-    exclusions = filtering_logic.get("exclude_keywords", ["MARC", "SADIQ", "ENERGY"])
-    # Removed "NEWSLETTER" to allow AI to parse newsletters for dates
-    exclusion_query = " ".join([f"-{e}" for e in exclusions])
+    capture_path = capture_path or os.getenv("EMAIL_CAPTURE_PATH")
+    capture = CorpusWriter(capture_path) if capture_path else None
+    plan = plan or get_config_plan()
+    config = plan["config"]
     
     # Filter for emails based on dynamic date filter
     # ULTRA-STRICT: Only precise school entities + Exclude Noise
-    full_query = f"{query} ({terms_query}) {date_filter} {exclusion_query}"
-    
-    # Increased to 500 for historical backfill
-    results = service.users().messages().list(userId='me', q=full_query, maxResults=500).execute()
-    messages = results.get('messages', [])
+    # The terms are split into bounded sub-queries, listed concurrently and paginated fully
+    msg_ids, query_results = list_message_ids(service, plan["gmail_queries"], prefix=query, suffix=date_filter,
+                                              service_factory=service_factory)
+    if only_ids is not None:
+        msg_ids = [msg_id for msg_id in msg_ids if msg_id in only_ids]
+    listed = set(msg_ids)
+    extra = [msg_id for msg_id in extra_ids or [] if msg_id not in listed]
     
     email_data_list = []
     
-    for msg in messages:
-        txt = service.users().messages().get(userId='me', id=msg['id']).execute()
-        payload = txt['payload']
-        headers = payload['headers']
-        
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown")
-        
-        # Body extraction - handle both plain text and HTML
-        plain_text = ""
-        html_content = ""
-        
-        def walk_parts(parts):
-            nonlocal plain_text, html_content
-            for part in parts:
-                mime = part.get('mimeType')
-                data = part.get('body', {}).get('data')
-                
-                if mime == 'text/plain' and data:
-                    plain_text += base64.urlsafe_b64decode(data).decode()
-                elif mime == 'text/html' and data:
-                    html_content += base64.urlsafe_b64decode(data).decode()
-                elif 'parts' in part:
-                    walk_parts(part['parts'])
-
-        if 'parts' in payload:
-            walk_parts(payload['parts'])
-        elif 'body' in payload:
-            data = payload['body'].get('data')
-            if data:
-                body_str = base64.urlsafe_b64decode(data).decode()
-                if payload.get('mimeType') == 'text/html':
-                    html_content = body_str
-                else:
-                    plain_text = body_str
+    for msg_id in msg_ids + extra:
+        try:
+            email = fetch_email(service, msg_id, profile=fetch_profile, screen=lambda subject: quick_screen_subject(subject, config))
+        except Exception as e:
+            if msg_id in listed:
+                raise
+            print(f"Deferred message {msg_id} could not be fetched, dropped: {e}")
+            continue
+        email_data_list.append(Message(email['id'], email['subject'], email['sender'], email['body'], tuple(email['calendar'])))
 
-        # Decision: If HTML is present, it's usually the "richer" source for school notices
-        # We append both to be safe, or just use the largest one
-        body = html_content if len(html_content) > len(plain_text) else plain_text
-                
-        email_data_list.append({
-            "id": msg['id'],
-            "subject": subject,
-            "sender": sender,
-            "body": body
-        })
-        
+        if capture:
+            capture.write(email)
+
+    if capture:
+        capture.close()
+
+    metrics.attach("gmail_query_plan", term_report(query_results, email_data_list))
     return email_data_list
 
 import re
@@ -150,33 +146,43 @@ def strip_html(html_str):
     clean = re.compile('<.*?>')
     return re.sub(clean, ' ', html_str)
 
-def transform_email_content(email_data, log_callback=print):
+@metrics.timed("transform_email_content")
+def transform_email_content(email_data, log_callback=print, plan=None):
     """
     Phase 2: TRANSFORM with Gemini 1.5 Pro
+    `email_data` is a Message; returns (CandidateEvent or None, analysis).
+    Raises RuntimeError if Gemini gave no usable answer, so callers can tell
+    "not an event" from "couldn't ask".
     """
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
-        log_callback("Error: GEMINI_API_KEY not set.")
-        return None
+        raise RuntimeError("GEMINI_API_KEY not set")
         
+    genai = get_genai()
     genai.configure(api_key=api_key)
     
     # Strip HTML for cleaner extraction
-    body_clean = strip_html(email_data.get('body', ''))
+    body_clean = strip_html(email_data.body)
     
-    # Load configuration for dynamic prompting
-    config = load_config()
-    search_settings = config.get("search_settings", {})
-    children = search_settings.get("children", ["Benjamin Dewsbery", "Tristan Dewsbery"])
-    keywords = search_settings.get("general_keywords", [])
-    years = search_settings.get("year_groups", [])
+    # Only the windows around dates and child/club/keyword mentions, within the token budget
+    plan = plan or get_config_plan()
+    prompt_context = plan["prompt_context"]
+    body_context, context_stats = select_context(body_clean, prompt_context, version=plan["version"])
+    metrics.inc("gemini.body_chars_in", context_stats["input_chars"])
+    metrics.inc("gemini.body_chars_sent", context_stats["output_chars"])
+
+    # Contextual targets for dynamic prompting: what this email actually mentions
+    targets = prompt_targets(prompt_context, context_stats["matched"])
+    children = targets["children"]
+    keywords = targets["keywords"] or ["(none mentioned)"]
+    years = targets["year_groups"] or ["(none mentioned)"]
 
     prompt = f"""
     You are a Logistics Officer. Your goal is to extract calendar events/deadlines from school emails.
     
-    Email Subject: {email_data.get('subject', 'No Subject')}
+    Email Subject: {email_data.subject}
     Email Body:
-    {body_clean[:4000]}
+    {body_context}
     
     Contextual Targets:
     - Children: {', '.join(children)}
@@ -210,12 +216,16 @@ def transform_email_content(email_data, log_callback=print):
     
     # Try multiple model names for better compatibility
     response = None
+    last_err = None
     # Verified options in this environment: models/gemini-2.5-flash, models/gemini-2.0-flash, models/gemini-flash-latest
     for model_name in ['models/gemini-2.5-flash', 'models/gemini-2.0-flash', 'models/gemini-flash-latest', 'models/gemini-pro-latest']:
         try:
             print(f"Logistics Brain: Attempting analysis with {model_name}...")
             model = genai.GenerativeModel(model_name)
-            response = model.generate_content(prompt)
+            metrics.inc("gemini.generate_content")
+            metrics.inc("gemini.prompt_chars", len(prompt))
+            with metrics.stage("gemini_call"):
+                response = model.generate_content(prompt)
             if response:
                 # Store which model succeeded in the return message
                 used_model = model_name
@@ -225,7 +235,7 @@ def transform_email_content(email_data, log_callback=print):
             print(f"Logistics Brain: {model_name} failed: {last_err}")
             continue
     else:
-        return None, f"All Gemini models failed. Last Error: {last_err}"
+        raise RuntimeError(f"All Gemini models failed. Last Error: {last_err}")
     
     try:
         text = response.text.strip()
@@ -239,22 +249,28 @@ def transform_email_content(email_data, log_callback=print):
         analysis = res_json.get("analysis", "No analysis provided.")
         
         if res_json.get("found") and res_json.get("event"):
-            return res_json["event"], analysis
+            event = CandidateEvent.from_dict(res_json["event"])
+            event.source_id = email_data.id
+            event.gmail_url = f"https://mail.google.com/mail/u/0/#inbox/{email_data.id}"
+            event.message = email_data
+            return event, analysis
         else:
             return None, analysis
             
     except Exception as e:
         print(f"Transformation failed: {e}")
-        return None, f"Analysis Failed: {e}"
+        raise RuntimeError(f"Analysis Failed: {e}")
 
+@metrics.timed("check_calendar_conflicts")
 def check_calendar_conflicts(service, start_time, end_time):
     """
     Checks for existing events in the given time range.
     Returns list of conflicting event summaries.
     """
     try:
+        metrics.inc("calendar.events.list")
         events_result = service.events().list(
-            calendarId=CALENDAR_ID, 
+            calendarId=get_calendar_id(), 
             timeMin=start_time, 
             timeMax=end_time,
             singleEvents=True,
@@ -266,15 +282,23 @@ def check_calendar_conflicts(service, start_time, end_time):
         print(f"Conflict check failed: {e}")
         return []
 
-def load_to_calendar(service, event_json, dry_run=False, approval_mode=False, raw_body=None):
+@metrics.timed("load_to_calendar")
+def load_to_calendar(service, event_json, dry_run=False, approval_mode=False, raw_body=None, config=None):
     """
     Phase 3: LOAD
+    `event_json` is a CandidateEvent (or the equivalent dict, e.g. from the portal
+    scanner). In approval mode returns (message, PendingEvent).
     """
+    if isinstance(event_json, dict):
+        event_json = CandidateEvent.from_dict(event_json)
+    if raw_body is None and event_json.message is not None:
+        raw_body = event_json.message.body
+
     # Post-LLM Refinement: Apply the User's strict labeling heuristics
     # We combine Subject (Event Title) and Body for the most accurate labeling
-    title = event_json.get('event_title', '')
-    matching_text = f"{title} {raw_body}" if raw_body else f"{title} {event_json.get('description', '')}"
-    subjects = identify_child(matching_text)
+    title = event_json.event_title
+    matching_text = f"{title} {raw_body}" if raw_body else f"{title} {event_json.description}"
+    subjects = identify_child(matching_text, config)
     
     if subjects == "IGNORE":
         return "Skipped: Irrelevant Year Group", None
@@ -284,11 +308,11 @@ def load_to_calendar(service, event_json, dry_run=False, approval_mode=False, ra
     else:
         title_tag = f"[{', '.join(subjects)}]"
 
-    final_title = f"{title_tag} {event_json.get('event_title', 'School Event')}"
+    final_title = f"{title_tag} {event_json.event_title}"
     
     # Rule 2: Gift Heuristic
-    description = event_json.get("description", "")
-    if check_gift_heuristic(event_json.get("event_title", ""), description):
+    description = event_json.description
+    if check_gift_heuristic(event_json.event_title, description):
         description = "🎁 REMINDER: BUY GIFT! \n\n" + description
         
     # Rule 3: Costume Protocol
@@ -297,8 +321,8 @@ def load_to_calendar(service, event_json, dry_run=False, approval_mode=False, ra
         final_title = "⚠️ COSTUME: " + final_title
         color_id = "11" # Red
         
-    start_time = event_json.get('start_time')
-    end_time = event_json.get('end_time')
+    start_time = event_json.start_time
+    end_time = event_json.end_time
 
     # Conflict Check
     conflicts = check_calendar_conflicts(service, start_time, end_time)
@@ -308,151 +332,356 @@ def load_to_calendar(service, event_json, dry_run=False, approval_mode=False, ra
         final_title = "⚠️ CONFLICT: " + final_title
         # color_id = "11" # Optional: Make red on conflict
 
-    event = {
-        'summary': final_title,
-        'location': event_json.get('location', ''),
-        'description': description,
-        'start': {
-            'dateTime': start_time, 
-            'timeZone': 'Europe/London', 
-        },
-        'end': {
-            'dateTime': end_time,
-            'timeZone': 'Europe/London',
-        },
-        'colorId': color_id,
-        'status': 'tentative',
-        'source_url': event_json.get('gmail_url') or event_json.get('source_url')
-    }
+    # Deterministic id: the same notice always maps to the same calendar entry
+    event = PendingEvent(
+        event_id_for(event_json), final_title, start_time, end_time,
+        location=event_json.location, description=description, color_id=color_id,
+        time_zone=event_json.time_zone or "Europe/London", recurrence=event_json.recurrence,
+        source=event_json.source, source_url=event_json.gmail_url or event_json.source_url,
+        labels=list(subjects) or ["Bishop Gilpin"])
     
     # Logic:
-    # If approval_mode is True: DO NOT insert. Return the event dict for the pending queue.
+    # If approval_mode is True: DO NOT insert. Return the PendingEvent for the pending queue.
     # If dry_run is True: Print what would happen.
-    
+
     if approval_mode:
-        # Return the event object intended for the "Pending" queue
-        # We add metadata for the UI
-        event['id'] = event_json.get('id', 'generated_' + datetime.now().strftime("%Y%m%d%H%M%S")) # Generate a temp ID if missing
-        event['source'] = event_json.get('source', 'email')
         return "Queued for Approval", event
 
     if dry_run:
         return f"[DRY RUN] Would create: {final_title} at {start_time}", None
         
     try:
-        event_result = service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
-        return f"Event created: {event_result.get('htmlLink')}", None
+        with event_lock(event.id):
+            action, event_result = upsert_event(service, get_calendar_id(), event.calendar_body())
+        return f"Event {action}: {event_result.get('htmlLink')}", None
     except Exception as e:
-        return f"Calendar Insert Failed: {e}", None
+        return f"Calendar Upsert Failed: {e}", None
 
-def run_pipeline(log_callback=print, event_callback=None, is_manual=False):
-    log_callback("Initializing ETL Pipeline...")
-    
-    try:
-        creds = get_credentials()
-        gmail_service = build('gmail', 'v1', credentials=creds)
-        calendar_service = build('calendar', 'v3', credentials=creds)
-        
-        log_callback("Authenticating: SUCCESS")
-    except Exception as e:
-        log_callback(f"Authentication Failed: {e}")
-        return
+def finish_run_record(status, log_callback=print, error=None):
+    """Closes the metrics scope for this run and persists it with the run record (and `error`, for a failed run)."""
+    snapshot = metrics.finish_run()
+    if snapshot:
+        record_run({"status": status, **({"error": error} if error else {}), **snapshot})
+        slowest = sorted(snapshot["timers"].items(), key=lambda kv: kv[1]["sum"], reverse=True)[:5]
+        summary = ", ".join(f"{name} {t['sum']:.1f}s" for name, t in slowest)
+        log_callback(f"Run {snapshot['run_id']} took {snapshot['duration']:.1f}s ({summary})")
+    return snapshot
 
-    log_callback("Phase 1: Scanning Inbox...")
-    
-    # Determine lookback period
-    if is_manual:
-        # Manual sync: Always use last 24 hours
-        date_filter = "newer_than:1d"
-        log_callback(" > Manual sync requested. Scanning last 24 hours.")
-    else:
-        # Scheduled sync: Use timestamp-based lookback
-        last_run_ts = get_last_successful_run()
-        if last_run_ts:
-            days_since = (time.time() - last_run_ts) / (24 * 3600)
-            # Add 1 day buffer to be safe
-            lookback_days = math.ceil(days_since) + 1
-            date_filter = f"newer_than:{lookback_days}d"
-            log_callback(f" > Last success: {datetime.fromtimestamp(last_run_ts).strftime('%Y-%m-%d %H:%M')}. Scanning last {lookback_days} days.")
-        else:
-            # Initial run / fallback
-            date_filter = "newer_than:6m"
-            log_callback(" > No previous state found. Running INITIAL 6-MONTH BACKFILL.")
-        
-    emails = extract_emails(gmail_service, date_filter=date_filter)
-    
-    # Phase 1b: Portal Scanning (Disabled - requires browser on Render)
-    log_callback("Phase 1b: Portal scanning disabled (browser not available on Render)")
-    portal_events = []
-    # try:
-    #      portal_events = asyncio.run(scan_school_portal())
-    #      if portal_events:
-    #          log_callback(f" > Found {len(portal_events)} portal events")
-    #      else:
-    #          log_callback(" > No portal events detected")
-    # except Exception as e:
-    #      log_callback(f"Portal scan failed (non-critical): {e}")
-    #      portal_events = []
-
-    # Combined Processing
-    # We treat extracted emails as 'raw sources' that need transform
-    # We treat portal events as 'already transformed' (mostly) but needing calendar loading
-    
-    # 1. Process Emails
-    log_callback(f"Phase 2+3: Processing {len(emails)} emails...")
+@metrics.timed("authenticate")
+def connect_services(services=None):
+    """(gmail, calendar, gmail_factory) - the injected `services` or freshly authenticated clients."""
+    if services:
+        return services["gmail"], services["calendar"], services.get("gmail_factory")
+    creds = get_credentials()
+    gmail_service = build('gmail', 'v1', credentials=creds)
+    calendar_service = build('calendar', 'v3', credentials=creds)
+    return gmail_service, calendar_service, lambda: build('gmail', 'v1', credentials=creds)
+
+def process_emails(emails, config, calendar_service, log_callback=print, event_callback=None):
+    """
+    Phase 2+3 for extracted emails: screen, extract, label and queue each one for approval.
+    Calendar invites are read straight from their VEVENTs (ics_parser.py). Other
+    extraction is tiered (see extraction_router.py): heuristics for every email,
+    Gemini only for the ambiguous ones, within the run's escalation budget.
+    Near-duplicate notices are processed once per cluster (near_duplicates.py).
+    Emails go most urgent first (priority.py); those without anything due soon
+    may be deferred to the next run when the run's quota or budget is spent.
+    """
+    duplicate_ids = {}
+    dedupe_state = None
     if emails:
-        for email in emails:
+        with metrics.stage("near_duplicates"):
+            emails, duplicate_ids, dedupe, dedupe_state = collapse_near_duplicates(emails)
+        metrics.attach("near_duplicates", dedupe)
+        metrics.inc("dedupe.skipped", dedupe["collapsed"] + dedupe["cross_run"])
+        if dedupe["collapsed"] or dedupe["cross_run"]:
+            log_callback(f" > Near-duplicates: {dedupe['emails']} emails in {dedupe['clusters']} clusters, "
+                         f"{dedupe['cross_run']} already handled in earlier runs ({dedupe['dedupe_ratio']:.0%} skipped)")
+
+    # Optional: parse/heuristic stage on a process pool for big backfills
+    parsed = None
+    if HEURISTIC_WORKERS > 1 and emails:
+        with metrics.stage("heuristic_pool"):
+            parsed = run_heuristic_stage(emails, config, HEURISTIC_WORKERS)
+        log_callback(f" > Heuristic stage ran on {HEURISTIC_WORKERS} worker processes")
+
+    plan = get_config_plan(config)
+    router = ExtractionRouter(lambda email: transform_email_content(email, log_callback, plan), config)
+
+    if emails:
+        # Screen and extract everything first: the heuristic results decide the order (priority.py)
+        prepared = []
+        cancellations = {}
+        for index, email in enumerate(emails):
             # Quick pre-screening: Use STRICT subject-based heuristics to filter out junk
-            pre_subjects = quick_screen_subject(email.get('subject', ''))
-            
+            if parsed:
+                pre_subjects, event_data = parsed[index]
+            else:
+                pre_subjects, event_data = quick_screen_subject(email.subject, config), None
+            candidates = []
+            if pre_subjects != "IGNORE":
+                # Fast path: an invite says exactly when, no extraction needed
+                candidates = calendar_candidates(email) if email.calendar else []
+                cancelled = calendar_cancellations(email) if email.calendar and not candidates else []
+                if cancelled:
+                    # A cancelled invite is handled too - its text still reads like the event
+                    cancellations[index] = cancelled
+                    event_data = None
+                elif not candidates and not parsed:
+                    event_data = heuristic_extraction(email.body, email.subject, email.id, config)
+            prepared.append((pre_subjects, event_data, candidates))
+
+        carried = load_carry_over()
+        with metrics.stage("prioritize"):
+            order = prioritize(emails, prepared, config, carried)
+
+        processed = set()
+        deferred = {}
+        counted = 0
+        for index, score, near_term in order:
+            email = emails[index]
+            pre_subjects, event_data, candidates = prepared[index]
+            # Log lines from here on are tagged with this message (run_log.py)
+            run_log.bind_message(email.id)
+            email_start = time.perf_counter()
+        
             if pre_subjects == "IGNORE":
-                log_callback(f"Skipping (Heuristic Ignore): {email['subject']}...")
+                log_callback(f"Skipping (Heuristic Ignore): {email.subject}...")
+                processed.add(email.id)
                 continue
-                
-            log_callback(f"Processing: {email['subject']}... <a href='https://mail.google.com/mail/u/0/#inbox/{email['id']}' target='_blank' style='color:#00ffff; text-decoration:none;'>[ SOURCE ]</a>")
-            event_data = heuristic_extraction(email.get('body', ''), email.get('subject', ''), email['id'])
-            if event_data:
-                event_data['source'] = 'email' # Tag source
-                log_callback(f"   > Date Extracted: {event_data['start_time'][:10]}")
-                
+
+            deferrable = can_defer(email.id, near_term, carried)
+            if RUN_EMAIL_QUOTA and not near_term and counted >= RUN_EMAIL_QUOTA and deferrable:
+                deferred[email.id] = ("quota", score)
+                continue
+            
+            log_callback(f"Processing: {email.subject}... <a href='https://mail.google.com/mail/u/0/#inbox/{email.id}' target='_blank' style='color:#00ffff; text-decoration:none;'>[ SOURCE ]</a>")
+            if candidates:
+                decision = "calendar"
+                metrics.inc("extraction.calendar_events", len(candidates))
+                log_callback(f"   > Calendar invite: {len(candidates)} event(s)")
+            elif index in cancellations:
+                decision = "calendar_cancelled"
+                metrics.inc("extraction.calendar_cancellations", len(cancellations[index]))
+                for cancelled in cancellations[index]:
+                    log_callback(f"   > Calendar invite cancelled: {cancelled.event_title} "
+                                 f"({cancelled.start_time[:10]}), nothing queued")
+            else:
+                event_data, decision, reasons = router.route(email, event_data, can_defer=deferrable)
+                if reasons:
+                    log_callback(f"   > Router: {decision} ({', '.join(reasons)})")
+                if decision == "deferred":
+                    deferred[email.id] = ("llm_budget", score)
+                    continue
+                if event_data:
+                    event_data.source_id = email.id
+                    event_data.message = email  # reference, not a copy of the body
+                    candidates = [event_data]
+
+            processed.add(email.id)
+            if not near_term:
+                counted += 1
+
+            for event_data in candidates:
+                event_data.source = 'email' # Tag source
+                log_callback(f"   > Date Extracted: {event_data.start_time[:10]}")
+            
                 # Load (Approval Mode = True for Vibe Lab Logistics)
-                result_msg, pending_event = load_to_calendar(calendar_service, event_data, approval_mode=True, raw_body=email.get('body'))
+                result_msg, pending_event = load_to_calendar(calendar_service, event_data, approval_mode=True, config=config)
                 log_callback(f" > {result_msg}")
-                
+            
                 # If approval_mode is True, send to Logistics Module via callback
                 if pending_event and event_callback:
+                    if duplicate_ids.get(email.id):
+                        pending_event.duplicate_ids = duplicate_ids[email.id]
                     event_callback(pending_event)
-            
-            # Rate limit to avoid 429 quota errors on free tier (15 RPM)
-            # Increased to 10s for absolute safety
-            time.sleep(10)
+        
+            run_log.log("Email processed", "DEBUG", duration=time.perf_counter() - email_start,
+                        decision=decision, events=len(candidates), score=score, near_term=near_term)
+
+            # Rate limit to avoid 429 quota errors on free tier (15 RPM) - only Gemini calls count
+            if decision == "escalated" and RATE_LIMIT_SECONDS:
+                with metrics.stage("rate_limit_sleep"):
+                    time.sleep(RATE_LIMIT_SECONDS)
+
+        run_log.bind_message(None)
+
+        store = update_carry_over(carried, processed, deferred)
+        # Only notices actually handled make their later copies redundant
+        remember_near_duplicates(dedupe_state, processed)
+        reasons = {}
+        for reason, _ in deferred.values():
+            reasons[reason] = reasons.get(reason, 0) + 1
+        metrics.attach("priority", {
+            "emails": len(order),
+            "near_term": sum(1 for _, _, near_term in order if near_term),
+            "carried_in": sum(1 for email in emails if email.id in carried),
+            "deferred": len(deferred),
+            "deferred_reasons": reasons,
+            "carry_over": len(store),
+            "quota": RUN_EMAIL_QUOTA,
+            "near_term_days": NEAR_TERM_DAYS,
+        })
+        metrics.inc("priority.deferred", len(deferred))
+        if deferred:
+            log_callback(f" > Priority: {len(deferred)} emails with nothing due within {NEAR_TERM_DAYS} days "
+                         f"deferred to the next run ({len(store)} waiting in total)")
+
+        report = router.report()
+        metrics.attach("extraction_router", report)
+        log_callback(f" > Router: {report['decisions']['escalated']} of {report['emails']} emails sent to Gemini "
+                     f"({report['escalation_rate']:.0%}), {report['decisions']['over_budget']} over budget")
     else:
         log_callback("No relevant recent emails found.")
 
-    # 2. Process Portal Events
-    if portal_events:
-        for p_event in portal_events:
-            log_callback(f"Processing Portal Event: {p_event.get('event_title')}...")
-            # Portal events are already JSON, proceed to Load
-            # Ensure they have required fields
-            if 'start_time' in p_event:
-                 # Load (Approval Mode = True for Portal Events)
-                 result_msg, pending_event = load_to_calendar(calendar_service, p_event, approval_mode=True)
-                 log_callback(f" > {result_msg}")
-                 
-                 # If approval_mode is True, send to Logistics Module via callback
-                 if pending_event and event_callback:
-                     event_callback(pending_event)
+def run_pipeline(log_callback=print, event_callback=None, is_manual=False, services=None, update_state=True):
+    """
+    Runs Extract -> Transform -> Load.
+    `services` optionally supplies pre-built {"gmail": ..., "calendar": ...} clients
+    (e.g. the offline stand-ins in fake_services.py) instead of authenticating,
+    plus an optional "gmail_factory" for per-thread Gmail clients.
+    With `update_state=False` the last-successful-run marker the scheduled
+    sweep's lookback starts from is left alone (for narrower scans, e.g. the
+    push fallback, that don't cover everything since then).
+    """
+    run_id = metrics.start_run()
+    log_callback(f"Initializing ETL Pipeline (run {run_id})...")
+    
+    try:
+        gmail_service, calendar_service, gmail_factory = connect_services(services)
+        log_callback("Authenticating: SUCCESS")
+    except Exception as e:
+        log_callback(f"Authentication Failed: {e}")
+        finish_run_record("auth_failed", log_callback)
+        return
+
+    # Any failure past this point still closes the run and records why
+    status, error = "failed", None
+    try:
+        log_callback("Phase 1: Scanning Inbox...")
+    
+        # Determine lookback period
+        if is_manual:
+            # Manual sync: Always use last 24 hours
+            date_filter = "newer_than:1d"
+            log_callback(" > Manual sync requested. Scanning last 24 hours.")
+        else:
+            # Scheduled sync: Use timestamp-based lookback
+            last_run_ts = get_last_successful_run()
+            if last_run_ts:
+                days_since = (time.time() - last_run_ts) / (24 * 3600)
+                # Add 1 day buffer to be safe
+                lookback_days = math.ceil(days_since) + 1
+                date_filter = f"newer_than:{lookback_days}d"
+                log_callback(f" > Last success: {datetime.fromtimestamp(last_run_ts).strftime('%Y-%m-%d %H:%M')}. Scanning last {lookback_days} days.")
             else:
-                log_callback("Skipping invalid portal event data.")
+                # Initial run / fallback
+                date_filter = "newer_than:6m"
+                log_callback(" > No previous state found. Running INITIAL 6-MONTH BACKFILL.")
+        
+        # Matchers, Gmail query and prompt context are prebuilt once per config version
+        plan = get_config_plan()
+        # Emails an earlier run deferred are fetched again even if they're older than the lookback
+        carried = load_carry_over()
+        if carried:
+            log_callback(f" > {len(carried)} emails deferred by earlier runs")
+        emails = extract_emails(gmail_service, date_filter=date_filter, plan=plan, service_factory=gmail_factory,
+                                extra_ids=list(carried))
+        query_report = metrics.current_run().reports.get("gmail_query_plan", {})
+        if query_report:
+            log_callback(f" > {len(emails)} messages from {len(query_report['sub_queries'])} sub-queries")
+            if query_report["zero_hit_terms"]:
+                log_callback(f" > Terms with no matches this run: {', '.join(query_report['zero_hit_terms'])}")
+    
+        # Phase 1b: Portal Scanning (Disabled - requires browser on Render)
+        log_callback("Phase 1b: Portal scanning disabled (browser not available on Render)")
+        portal_events = []
+        # try:
+        #      portal_events = asyncio.run(scan_school_portal())
+        #      if portal_events:
+        #          log_callback(f" > Found {len(portal_events)} portal events")
+        #      else:
+        #          log_callback(" > No portal events detected")
+        # except Exception as e:
+        #      log_callback(f"Portal scan failed (non-critical): {e}")
+        #      portal_events = []
+
+        # Combined Processing
+        # We treat extracted emails as 'raw sources' that need transform
+        # We treat portal events as 'already transformed' (mostly) but needing calendar loading
+    
+        # 1. Process Emails
+        log_callback(f"Phase 2+3: Processing {len(emails)} emails...")
+        # One config per run - screening, heuristics and labelling all share its compiled matchers
+        config = plan["config"]
+
+        process_emails(emails, config, calendar_service, log_callback, event_callback)
+
+        # 2. Process Portal Events
+        if portal_events:
+            for p_event in portal_events:
+                log_callback(f"Processing Portal Event: {p_event.get('event_title')}...")
+                # Portal events are already JSON, proceed to Load
+                # Ensure they have required fields
+                if 'start_time' in p_event:
+                     # Load (Approval Mode = True for Portal Events)
+                     result_msg, pending_event = load_to_calendar(calendar_service, p_event, approval_mode=True, config=config)
+                     log_callback(f" > {result_msg}")
+                 
+                     # If approval_mode is True, send to Logistics Module via callback
+                     if pending_event and event_callback:
+                         event_callback(pending_event)
+                else:
+                    log_callback("Skipping invalid portal event data.")
 
-    # Update state only if we reached the end successfully
-    update_last_successful_run()
-    log_callback("Pipeline Complete. State saved.")
+        # Update state only if we reached the end successfully
+        status = "success"
+        if update_state:
+            update_last_successful_run()
+            log_callback("Pipeline Complete. State saved.")
+        else:
+            log_callback("Pipeline Complete. Sweep lookback left unchanged.")
 
-    log_callback("ETL Job Finished.")
+        log_callback("ETL Job Finished.")
             
-    log_callback("ETL Job Finished.")
+        log_callback("ETL Job Finished.")
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        log_callback(f"Pipeline Failed: {error}")
+        raise
+    finally:
+        finish_run_record(status, log_callback, error=error)
+
+def run_incremental_sync(msg_ids, log_callback=print, event_callback=None, services=None):
+    """
+    Push-triggered sync of just the messages Gmail reported as new. The
+    configured search still decides which of them are relevant; only those
+    are fetched and processed. The daily sweep's state is left alone.
+    """
+    run_id = metrics.start_run()
+    log_callback(f"Incremental sync (run {run_id}) for {len(msg_ids)} new message(s)...")
+    try:
+        gmail_service, calendar_service, gmail_factory = connect_services(services)
+    except Exception as e:
+        log_callback(f"Authentication Failed: {e}")
+        finish_run_record("auth_failed", log_callback)
+        return
+
+    status, error = "failed", None
+    try:
+        plan = get_config_plan()
+        # New messages are at most a day old; the date filter keeps the sub-query listings short
+        emails = extract_emails(gmail_service, date_filter="newer_than:1d", plan=plan,
+                                service_factory=gmail_factory, only_ids=set(msg_ids))
+        log_callback(f" > {len(emails)} of them match the configured search")
+        process_emails(emails, plan["config"], calendar_service, log_callback, event_callback)
+        status = "incremental"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        log_callback(f"Incremental sync failed: {error}")
+        raise
+    finally:
+        finish_run_record(status, log_callback, error=error)
 
 if __name__ == "__main__":
     # Local test
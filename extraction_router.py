@@ -0,0 +1,147 @@
+"""
+Tiered extraction: heuristics first, Gemini only where it changes the outcome.
+
+Every screened email goes through heuristic_extraction, which scores its
+result (heuristics.CONFIDENCE_PENALTIES). The router then decides:
+
+    heuristic    confident enough - load the heuristic result as is
+    escalated    ambiguous (several dates, no time, ...) - ask Gemini, within
+                 the per-run LLM_ESCALATION_BUDGET calls and LLM_TOKEN_BUDGET
+                 estimated prompt tokens
+    deferred     ambiguous, the budget is spent and nothing is due soon - left
+                 for a later run (see priority.py)
+    over_budget  ambiguous, but the budget is spent - load the heuristic result
+    no_date      nothing date-like to extract - dropped without an LLM call
+
+Emails the labelling rules would discard anyway (no child, club or keyword
+recognised) are never escalated: load_to_calendar would drop whatever Gemini
+found. The decisions, their reasons and the escalation rate are attached to
+the run record as the "extraction_router" report.
+"""
+import os
+import re
+
+import metrics
+from context_selector import CHARS_PER_TOKEN, EMAIL_TOKEN_BUDGET
+from heuristics import identify_child
+
+# Heuristic results scoring below this are escalated
+CONFIDENCE_THRESHOLD = float(os.getenv("EXTRACTION_CONFIDENCE_THRESHOLD", "0.7"))
+
+# Gemini calls allowed per run (0 disables escalation)
+LLM_ESCALATION_BUDGET = int(os.getenv("LLM_ESCALATION_BUDGET", "10"))
+
+# Estimated prompt tokens allowed per run (0 = only the call budget applies)
+LLM_TOKEN_BUDGET = int(os.getenv("LLM_TOKEN_BUDGET", "0"))
+
+# The extraction prompt's instructions and template, without subject and body
+PROMPT_OVERHEAD_TOKENS = 500
+
+# Date mentions heuristic_extraction can't turn into a date ("next Friday", "the 3rd")
+RELATIVE_DATE_PATTERN = re.compile(
+    r'\b(?:(?:this|next)\s+)?(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b'
+    r'|\b(?:tomorrow|tonight)\b|\b\d{1,2}(?:st|nd|rd|th)\b',
+    re.IGNORECASE)
+
+def estimate_tokens(email):
+    """Prompt tokens an escalation of `email` costs, before select_context has run (an upper bound for the body)."""
+    body = min(len(email.body) // CHARS_PER_TOKEN, EMAIL_TOKEN_BUDGET)
+    return PROMPT_OVERHEAD_TOKENS + len(email.subject) // CHARS_PER_TOKEN + body
+
+class ExtractionRouter:
+    """
+    One per run. `transform` is the LLM tier: Message -> (CandidateEvent or
+    None, analysis), raising if Gemini couldn't answer.
+    """
+
+    def __init__(self, transform, config=None, budget=None, threshold=None, token_budget=None):
+        self.transform = transform
+        self.config = config
+        self.budget = LLM_ESCALATION_BUDGET if budget is None else budget
+        self.token_budget = LLM_TOKEN_BUDGET if token_budget is None else token_budget
+        self.tokens = 0
+        self.threshold = CONFIDENCE_THRESHOLD if threshold is None else threshold
+        self.emails = 0
+        self.decisions = {"heuristic": 0, "escalated": 0, "deferred": 0, "over_budget": 0, "no_date": 0}
+        self.reasons = {}
+        self.llm = {"event": 0, "rejected": 0, "failed": 0, "changed_outcome": 0}
+
+    def _ambiguity(self, email, event_data):
+        """Reasons to ask Gemini about this email, or None if it isn't worth asking."""
+        if event_data is not None:
+            if event_data.confidence is None or event_data.confidence >= self.threshold:
+                return None
+            if "no_child" in event_data.reasons:
+                return None
+            return event_data.reasons
+        # No parseable date - worth asking only about a relative one in an email we'd keep
+        if not RELATIVE_DATE_PATTERN.search(email.subject) and not RELATIVE_DATE_PATTERN.search(email.body):
+            return None
+        if identify_child(f"{email.subject} {email.body}", self.config) == "IGNORE":
+            return None
+        return ["relative_date"]
+
+    def _affordable(self, email):
+        if self.decisions["escalated"] >= self.budget:
+            return False
+        return not self.token_budget or self.tokens + estimate_tokens(email) <= self.token_budget
+
+    def route(self, email, event_data, can_defer=False):
+        """
+        Decides what to load for `email` given the heuristic result `event_data`.
+        Returns (CandidateEvent or None, decision, reasons). With `can_defer`,
+        an ambiguous email over budget comes back "deferred" (and None) instead
+        of with its heuristic result.
+        """
+        self.emails += 1
+        reasons = self._ambiguity(email, event_data)
+        if reasons is None:
+            decision = "heuristic" if event_data is not None else "no_date"
+        elif not self._affordable(email):
+            decision = "deferred" if can_defer else "over_budget"
+        else:
+            decision = "escalated"
+            self.tokens += estimate_tokens(email)
+
+        self.decisions[decision] += 1
+        metrics.inc(f"router.{decision}")
+        for reason in reasons or []:
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+        if decision == "escalated":
+            event_data = self._escalate(email, event_data)
+        elif decision == "deferred":
+            event_data = None
+        return event_data, decision, reasons or []
+
+    def _escalate(self, email, fallback):
+        try:
+            event, _ = self.transform(email)
+        except Exception as e:
+            print(f"Router: Gemini failed for {email.id}, keeping the heuristic result: {e}")
+            self.llm["failed"] += 1
+            return fallback
+        if event is not None and not event.start_time:
+            self.llm["failed"] += 1
+            return fallback
+
+        self.llm["event" if event is not None else "rejected"] += 1
+        before = fallback.start_time if fallback is not None else None
+        after = event.start_time if event is not None else None
+        if before != after:
+            self.llm["changed_outcome"] += 1
+        return event
+
+    def report(self):
+        escalated = self.decisions["escalated"]
+        return {
+            "emails": self.emails,
+            "threshold": self.threshold,
+            "budget": self.budget,
+            "token_budget": self.token_budget,
+            "tokens": self.tokens,
+            "decisions": dict(self.decisions),
+            "reasons": dict(sorted(self.reasons.items(), key=lambda item: -item[1])),
+            "escalation_rate": round(escalated / self.emails, 4) if self.emails else 0.0,
+            "llm": dict(self.llm),
+        }
@@ -0,0 +1,636 @@
+"""
+Offline stand-ins for Gmail, Calendar, the config Gist and Gemini.
+
+They mimic the slice of the googleapiclient / requests / google.generativeai
+surface the pipeline uses, with configurable latency, error rate and 429
+behaviour, so run_pipeline can be benchmarked without live Google accounts.
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeHttpError(Exception):
+    """Shaped like googleapiclient.errors.HttpError: has .resp.status and .status_code."""
+
+    class _Resp:
+        def __init__(self, status):
+            self.status = status
+            self.reason = {404: "Not Found", 409: "Conflict", 429: "Too Many Requests"}.get(status, "Backend Error")
+
+    def __init__(self, status, message=""):
+        self.resp = self._Resp(status)
+        self.status_code = status
+        super().__init__(f"<HttpError {status}: {message or self.resp.reason}>")
+
+class FaultProfile:
+    """
+    Latency and failure behaviour for one stand-in service.
+    latency/jitter are seconds; error_rate is the chance of a 500;
+    rate_limit_per_minute > 0 makes calls beyond that rate fail with 429;
+    timeout_rate is the chance a call takes effect but its response is lost
+    (the client sees a TimeoutError) - the case idempotent writes must survive.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_per_minute=0, seed=None, timeout_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_per_minute = rate_limit_per_minute
+        self.timeout_rate = timeout_rate
+        self.random = random.Random(seed)
+        self.window = []
+        self.lock = threading.Lock()
+
+    def apply(self, stats, name):
+        with self.lock:
+            stats[name] = stats.get(name, 0) + 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            fail = self.error_rate and self.random.random() < self.error_rate
+            limited = False
+            if self.rate_limit_per_minute:
+                now = time.monotonic()
+                self.window = [t for t in self.window if now - t < 60]
+                limited = len(self.window) >= self.rate_limit_per_minute
+                if not limited:
+                    self.window.append(now)
+        if delay:
+            time.sleep(delay)
+        if limited:
+            stats["429"] = stats.get("429", 0) + 1
+            raise FakeHttpError(429, "Quota exceeded (429)")
+        if fail:
+            stats["errors"] = stats.get("errors", 0) + 1
+            raise FakeHttpError(500)
+
+    def lose_response(self, stats):
+        with self.lock:
+            lost = self.timeout_rate and self.random.random() < self.timeout_rate
+        if lost:
+            stats["timeouts"] = stats.get("timeouts", 0) + 1
+        return lost
+
+class _Request:
+    def __init__(self, profile, stats, name, func):
+        self.profile = profile
+        self.stats = stats
+        self.name = name
+        self.func = func
+
+    def execute(self):
+        self.profile.apply(self.stats, self.name)
+        result = self.func()
+        if self.profile.lose_response(self.stats):
+            raise TimeoutError(f"{self.name}: timed out waiting for response")
+        self.stats["bytes"] = self.stats.get("bytes", 0) + len(json.dumps(result))
+        return result
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+# --- Synthetic mailbox ---
+
+NOTICE_TEMPLATES = [
+    ("Year 3 School Trip to {place}", "Dear Parents, Year 3 will visit {place} on {day} {month}. Please arrive by {hour}:{minute}. Packed lunch required. Tristan Dewsbery's class."),
+    ("FOBG Krispy Kreme fundraiser", "Friends of Bishop Gilpin are selling donuts on {day}/{month_num}/2026 from {hour}.{minute}. All proceeds to the PTA."),
+    ("Wednesday Notice - {month}", "<html><body><h1>Wednesday Notice</h1><p>Sports Day is on {day} {month} at {hour}:{minute}.</p><p>Year 2 costume day follows - please wear a costume. Benji Dewsbery</p></body></html>"),
+    ("Training at Goals, {place} pitch", "Spond reminder. Training on Sunday {day}. {month} at {hour}:{minute}. Will Benji Dewsbery attend?"),
+    ("Parent Evening bookings", "Bishop Gilpin Parent Evening bookings open for Year 4 on {day} {month}. Appointments from {hour}:{minute}."),
+]
+
+NOISE_TEMPLATES = [
+    ("Your ENERGY bill is ready", "Your statement from ENERGY Co is available."),
+    ("Weekly newsletter", "<html><body><style>p{{color:red}}</style><p>News from around the school. Nothing dated this week.</p></body></html>"),
+    ("MARC update", "Internal update, no action required."),
+]
+
+# Long newsletters: the dated notice sits somewhere among paragraphs of undated school news
+NEWSLETTER_FILLER = [
+    "Our Reception children have been exploring the outdoor classroom and building bug hotels with great enthusiasm.",
+    "A huge thank you to all the families who donated books to the library appeal, the shelves are looking wonderful.",
+    "The eco council has been busy auditing lights and heating around school and will share their findings in assembly.",
+    "Please remember that the school is a nut free site and that water bottles should be named.",
+    "Lost property is overflowing again; anything unnamed will be donated to the uniform shop at the end of term.",
+    "The choir sounded fantastic at the local care home and the residents loved joining in with the songs.",
+    "Reading records should be signed weekly and brought into school every day in book bags.",
+    "We are delighted to welcome three new members of staff to the teaching team this half term.",
+]
+NEWSLETTER_NOTICE = ("Year 3 School Trip: the class will visit {place} on {day} {month}, leaving at {hour}:{minute}. "
+                     "Tristan Dewsbery's class should bring a packed lunch and waterproof coat. Reply slips are due before the trip.")
+
+# Notices the heuristics can only half read: several dates, no time, or only a relative day
+AMBIGUOUS_TEMPLATES = [
+    ("Sports Day moved", "Sports Day has moved from {day} {month} to {day2} {month}, starting at {hour}:{minute}. Benji Dewsbery, Year 2."),
+    ("Year 3 clubs timetable", "Year 3 clubs restart on {day} {month}. Swimming is on {day2} {month} and the concert on {day3} {month}. Tristan Dewsbery"),
+    ("Year 3 cake sale next Friday", "Year 3 are holding a cake sale next Friday after school. Tristan Dewsbery's class will bring cakes."),
+    ("Year 5 class photos", "Class photos for Year 5 on {day} {month}. Please send Tristan Dewsbery in full uniform."),
+]
+
+# How schools re-send a notice: to another class list, as a reminder, forwarded
+RESEND_EDITS = [
+    ("{subject}", "{body}\n\nSent to: Class {cls} parents"),
+    ("Reminder: {subject}", "{body}"),
+    ("Fwd: {subject}", "{body} Thank you."),
+]
+
+# Calendar invites (Spond, Outlook, Google): the body only says "this Sunday", the .ics says exactly when
+INVITE_TITLES = ["Training at Goals", "U7 rugby festival", "Year 3 swimming gala", "FOBG quiz night", "Parent Evening"]
+INVITE_BODY = "Spond: {title} at {place}. Can you make it this Sunday? Will Benji Dewsbery attend? Respond in the app."
+ICS_SHAPES = ("spond", "outlook", "google", "allday", "cancel")
+
+def _fold(line):
+    """RFC 5545 folding at 75 characters."""
+    parts = [line[:75]]
+    for i in range(75, len(line), 74):
+        parts.append(" " + line[i:i + 74])
+    return "\r\n".join(parts)
+
+def generate_ics(rnd, uid, title, start, shape="spond", place="Goals Wimbledon"):
+    """One calendar in the shape a given sender produces. `start` is a naive Europe/London datetime."""
+    end = start + timedelta(minutes=rnd.choice([45, 60, 90]))
+    stamp = "20260101T000000Z"
+    description = (f"{title} at {place}. Kids will need trainers or astro boots; studded boots are not allowed. "
+                   f"If you would like to make a voluntary contribution of £5 on the day, please speak to the coaches.")
+    description = description.replace(",", "\\,").replace(";", "\\;")
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Fake//Invites//EN",
+             f"METHOD:{'CANCEL' if shape == 'cancel' else 'REQUEST'}"]
+    if shape == "outlook":
+        lines += ["BEGIN:VTIMEZONE", "TZID:GMT Standard Time",
+                  "BEGIN:STANDARD", "DTSTART:16011028T020000", "TZOFFSETFROM:+0100", "TZOFFSETTO:-0000", "END:STANDARD",
+                  "BEGIN:DAYLIGHT", "DTSTART:16010325T010000", "TZOFFSETFROM:-0000", "TZOFFSETTO:+0100", "END:DAYLIGHT",
+                  "END:VTIMEZONE"]
+    lines += ["BEGIN:VEVENT", f"UID:{uid}", f"DTSTAMP:{stamp}", f"SUMMARY:{title}", f"LOCATION:{place}",
+              f"DESCRIPTION:{description}"]
+    if shape == "allday":
+        lines += [f"DTSTART;VALUE=DATE:{start:%Y%m%d}", f"DTEND;VALUE=DATE:{start + timedelta(days=1):%Y%m%d}"]
+    elif shape == "google":
+        # Stored in UTC (London is UTC+0 in winter - close enough for a fixture)
+        lines += [f"DTSTART:{start:%Y%m%dT%H%M%S}Z", f"DTEND:{end:%Y%m%dT%H%M%S}Z",
+                  "RRULE:FREQ=WEEKLY;COUNT=6;BYDAY=SU", f"EXDATE:{start + timedelta(weeks=2):%Y%m%dT%H%M%S}Z"]
+    elif shape == "outlook":
+        lines += [f'DTSTART;TZID="GMT Standard Time":{start:%Y%m%dT%H%M%S}',
+                  f"DURATION:PT{int((end - start).total_seconds() // 60)}M",
+                  "BEGIN:VALARM", "ACTION:DISPLAY", "TRIGGER:-PT15M", "END:VALARM"]
+    else:
+        lines += [f"DTSTART;TZID=Europe/London:{start:%Y%m%dT%H%M%S}", f"DTEND;TZID=Europe/London:{end:%Y%m%dT%H%M%S}"]
+    lines.append("END:VEVENT")
+    if shape == "google":
+        # One instance moved an hour later
+        moved = start + timedelta(weeks=1)
+        lines += ["BEGIN:VEVENT", f"UID:{uid}", f"DTSTAMP:{stamp}", f"RECURRENCE-ID:{moved:%Y%m%dT%H%M%S}Z",
+                  f"SUMMARY:{title} (moved)", f"DTSTART:{moved + timedelta(hours=1):%Y%m%dT%H%M%S}Z",
+                  f"DTEND:{moved + timedelta(hours=2):%Y%m%dT%H%M%S}Z", "END:VEVENT"]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
+
+def generate_ics_fixtures(count, seed=42):
+    """`count` calendars cycling through ICS_SHAPES - the fixture set for the ICS parse benchmark."""
+    rnd = random.Random(seed)
+    base = datetime(2026, 1, 4, 10, 0)
+    return [generate_ics(rnd, f"fixture-{i}@fake", rnd.choice(INVITE_TITLES), base + timedelta(days=rnd.randint(0, 200)),
+                         ICS_SHAPES[i % len(ICS_SHAPES)], rnd.choice(PLACES)) for i in range(count)]
+
+PLACES = ["Kew Gardens", "Science Museum", "Wisley", "Stade de France", "Goals Wimbledon"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "September", "October", "November", "December"]
+
+def generate_mailbox(size, seed=42, noise_ratio=0.2, quoted_thread_ratio=0.3, newsletter_ratio=0.0, ambiguous_ratio=0.0,
+                     ics_ratio=0.0, duplicate_ratio=0.0):
+    """
+    Builds `size` Gmail API 'full' format messages: a mix of dated school notices,
+    multipart/alternative bodies, long quoted threads and noise. A `newsletter_ratio`
+    share are long HTML newsletters with the one dated notice buried at a random depth,
+    an `ambiguous_ratio` share notices from AMBIGUOUS_TEMPLATES, an `ics_ratio` share
+    calendar invites (inline text/calendar, .ics attachment or both) and a
+    `duplicate_ratio` share re-sends of an earlier notice with small edits (RESEND_EDITS).
+    """
+    rnd = random.Random(seed)
+    base_time = datetime(2026, 1, 1)
+    messages = []
+    sent = []
+    for i in range(size):
+        templates = NOISE_TEMPLATES if rnd.random() < noise_ratio else NOTICE_TEMPLATES
+        if ambiguous_ratio and templates is NOTICE_TEMPLATES and rnd.random() < ambiguous_ratio:
+            templates = AMBIGUOUS_TEMPLATES
+        subject_t, body_t = rnd.choice(templates)
+        month_index = rnd.randrange(len(MONTHS))
+        values = {
+            "place": rnd.choice(PLACES),
+            "day": rnd.randint(1, 28),
+            "day2": rnd.randint(1, 28) if ambiguous_ratio else None,
+            "day3": rnd.randint(1, 28) if ambiguous_ratio else None,
+            "month": MONTHS[month_index],
+            "month_num": str(month_index + 1).zfill(2),
+            "hour": rnd.randint(8, 17),
+            "minute": rnd.choice(["00", "15", "30", "45"]),
+        }
+        subject = subject_t.format(**values)
+        body = body_t.format(**values)
+        resend = bool(duplicate_ratio and sent and templates is not NOISE_TEMPLATES and rnd.random() < duplicate_ratio)
+        if resend:
+            edit_subject, edit_body = rnd.choice(RESEND_EDITS)
+            original_subject, original_body = rnd.choice(sent)
+            subject = edit_subject.format(subject=original_subject)
+            body = edit_body.format(body=original_body, cls=f"{rnd.randint(1, 6)}{rnd.choice('ABC')}")
+        invite = None
+        if not resend and ics_ratio and templates is NOTICE_TEMPLATES and rnd.random() < ics_ratio:
+            title = rnd.choice(INVITE_TITLES)
+            start = datetime(2026, datetime.strptime(values["month"], "%B").month, values["day"], values["hour"], int(values["minute"]))
+            invite = generate_ics(rnd, f"{i:016x}@fake", title, start, rnd.choice(ICS_SHAPES[:4]), values["place"])
+            subject = f"Invitation: {title}"
+            body = INVITE_BODY.format(title=title, place=values["place"])
+        elif not resend and newsletter_ratio and rnd.random() < newsletter_ratio:
+            paragraphs = [rnd.choice(NEWSLETTER_FILLER) for _ in range(rnd.randint(40, 120))]
+            paragraphs.insert(rnd.randrange(len(paragraphs)), NEWSLETTER_NOTICE.format(**values))
+            subject = f"Wednesday Notice - Newsletter {values['month']}"
+            body = "<html><body>" + "".join(f"<p>{p}</p>" for p in paragraphs) + "</body></html>"
+        elif rnd.random() < quoted_thread_ratio:
+            # Long quoted reply chains are what make real bodies big
+            body += "\n\n" + "\n".join(f"> On a previous day someone wrote: {body_t[:80]}" for _ in range(rnd.randint(20, 200)))
+        if duplicate_ratio and not resend and not invite and templates is not NOISE_TEMPLATES:
+            sent.append((subject, body))
+
+        headers = [
+            {"name": "Subject", "value": subject},
+            {"name": "From", "value": rnd.choice(["office@bishopgilpin.org", "pta@fobg.org", "noreply@spond.com", "billing@energy.example"])},
+            {"name": "Date", "value": (base_time + timedelta(hours=i)).strftime("%a, %d %b %Y %H:%M:%S +0000")},
+        ]
+        if body.startswith("<html"):
+            plain = "Please view this email in HTML."
+            payload = {
+                "mimeType": "multipart/alternative",
+                "headers": headers,
+                "body": {"size": 0},
+                "parts": [
+                    {"partId": "0", "mimeType": "text/plain", "body": {"size": len(plain), "data": _b64(plain)}},
+                    {"partId": "1", "mimeType": "text/html", "body": {"size": len(body), "data": _b64(body)}},
+                ],
+            }
+        else:
+            payload = {"mimeType": "text/plain", "headers": headers, "body": {"size": len(body), "data": _b64(body)}}
+
+        msg_id = f"{i:016x}"
+        attachments = {}
+        if invite:
+            text_part = {"partId": "0", "mimeType": "text/plain", "body": {"size": len(body), "data": _b64(body)}}
+            inline = {"partId": "1", "mimeType": "text/calendar", "body": {"size": len(invite), "data": _b64(invite)}}
+            attached = {"partId": "2", "mimeType": "application/ics", "filename": "invite.ics",
+                        "body": {"size": len(invite), "attachmentId": f"att-{msg_id}"}}
+            delivery = rnd.choice(["inline", "attachment", "both"])
+            parts = [text_part] + ([inline] if delivery != "attachment" else []) + ([attached] if delivery != "inline" else [])
+            if delivery != "inline":
+                attachments[f"att-{msg_id}"] = _b64(invite)
+            payload = {"mimeType": "multipart/mixed", "headers": headers, "body": {"size": 0}, "parts": parts}
+        messages.append({
+            "id": msg_id,
+            "threadId": msg_id,
+            "labelIds": ["INBOX"],
+            "snippet": body[:100],
+            "internalDate": str(int((base_time + timedelta(hours=i)).timestamp() * 1000)),
+            "payload": payload,
+        })
+        if attachments:
+            messages[-1]["attachments"] = attachments
+    return messages
+
+# --- Gmail ---
+
+def _payload_to_mime(payload, boundary_seed="b", attachments=None):
+    """Renders a Gmail 'full' payload as RFC 822 text (for format=raw responses)."""
+    lines = [f"{h['name']}: {h['value']}" for h in payload.get("headers", [])]
+    mime = payload.get("mimeType", "text/plain")
+    if mime.startswith("multipart/"):
+        boundary = f"=_{boundary_seed}_{abs(hash(mime)) % 10000}"
+        lines += ["MIME-Version: 1.0", f'Content-Type: {mime}; boundary="{boundary}"', "", "This is a multi-part message."]
+        for i, part in enumerate(payload.get("parts", [])):
+            lines.append(f"--{boundary}")
+            lines.append(_payload_to_mime(part, f"{boundary_seed}{i}", attachments))
+        lines.append(f"--{boundary}--")
+        return "\r\n".join(lines)
+
+    body = payload.get("body", {})
+    data = body.get("data") or (attachments or {}).get(body.get("attachmentId"), "")
+    text = base64.urlsafe_b64decode(data).decode("utf-8") if data else ""
+    encoded = base64.encodebytes(text.encode("utf-8")).decode("ascii").replace("\n", "\r\n")
+    lines.append(f'Content-Type: {mime}; charset="utf-8"')
+    if payload.get("filename"):
+        lines.append(f'Content-Disposition: attachment; filename="{payload["filename"]}"')
+    lines += ["Content-Transfer-Encoding: base64", "", encoded]
+    return "\r\n".join(lines)
+
+def _strip_to_partial(payload):
+    """What a fields=payload(mimeType,headers(name,value),body/data,parts) mask leaves behind."""
+    trimmed = {"mimeType": payload.get("mimeType"), "headers": payload.get("headers", [])}
+    if payload.get("body", {}).get("data"):
+        trimmed["body"] = {"data": payload["body"]["data"]}
+    if "parts" in payload:
+        trimmed["parts"] = payload["parts"]
+    return trimmed
+
+def _message_text(message):
+    """Lower-cased subject, sender and decoded text parts - what the fake search matches against."""
+    payload = message["payload"]
+    chunks = [h["value"] for h in payload.get("headers", []) if h["name"] in ("Subject", "From")]
+    for part in payload.get("parts", [payload]):
+        data = part.get("body", {}).get("data")
+        if data:
+            chunks.append(base64.urlsafe_b64decode(data).decode("utf-8"))
+    return " ".join(chunks).lower()
+
+def _query_matcher(q):
+    """
+    Just enough of Gmail search for the pipeline's queries: any quoted phrase
+    must appear and no -EXCLUDED word may. Label and date operators are ignored.
+    """
+    phrases = [p.lower() for p in re.findall(r'"([^"]+)"', q or "")]
+    exclusions = [e.lower() for e in re.findall(r'(?:^|\s)-(\S+)', q or "")]
+
+    def matches(text):
+        if phrases and not any(p in text for p in phrases):
+            return False
+        return not any(e in text for e in exclusions)
+    return matches
+
+class FakeGmailService:
+    """`service.users().messages().list/get(...).execute()` over an in-memory mailbox."""
+
+    def __init__(self, messages, profile=None):
+        self.mailbox = {m["id"]: m for m in messages}
+        self.order = [m["id"] for m in reversed(messages)]  # Gmail lists newest first
+        self.profile = profile or FaultProfile()
+        self.stats = {}
+        self._texts = {}
+        self._results = {}
+        self._sizes = {}
+        self.lock = threading.Lock()
+        # Mailbox history for watch/history.list: [(history_id, message id)]
+        self.history_id = 1000
+        self.history_log = []
+        self.oldest_history_id = self.history_id
+
+    def _search(self, q):
+        with self.lock:
+            if q not in self._results:
+                matches = _query_matcher(q)
+                for mid in self.order:
+                    if mid not in self._texts:
+                        self._texts[mid] = _message_text(self.mailbox[mid])
+                self._results[q] = [mid for mid in self.order if matches(self._texts[mid])]
+            return self._results[q]
+
+    def _size_estimate(self, msg_id):
+        """Like Gmail's sizeEstimate: the size of the whole RFC 822 message, attachments included."""
+        with self.lock:
+            if msg_id not in self._sizes:
+                message = self.mailbox[msg_id]
+                self._sizes[msg_id] = len(_payload_to_mime(message["payload"], msg_id, message.get("attachments")))
+            return self._sizes[msg_id]
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return _FakeHistory(self)
+
+    def attachments(self):
+        return _FakeAttachments(self)
+
+    def deliver(self, message):
+        """A new message lands in the inbox. Returns the mailbox historyId after the change."""
+        with self.lock:
+            self.mailbox[message["id"]] = message
+            self.order.insert(0, message["id"])
+            self._results.clear()
+            self.history_id += 1
+            self.history_log.append((self.history_id, message["id"]))
+            return self.history_id
+
+    def watch(self, userId="me", body=None):
+        def run():
+            return {"historyId": str(self.history_id), "expiration": str(int((time.time() + 7 * 86400) * 1000))}
+        return _Request(self.profile, self.stats, "watch", run)
+
+    def list(self, userId="me", q=None, maxResults=100, pageToken=None, **kwargs):
+        def run():
+            found = self._search(q)
+            start = int(pageToken or 0)
+            end = start + min(maxResults, 500)
+            page = [{"id": mid, "threadId": self.mailbox[mid]["threadId"]} for mid in found[start:end]]
+            result = {"messages": page, "resultSizeEstimate": len(found)}
+            if end < len(found):
+                result["nextPageToken"] = str(end)
+            return result
+        return _Request(self.profile, self.stats, "messages.list", run)
+
+    def get(self, userId="me", id=None, format="full", fields=None, metadataHeaders=None, **kwargs):
+        def run():
+            if id not in self.mailbox:
+                raise FakeHttpError(404, "Not Found")
+            message = self.mailbox[id]
+            if format == "raw":
+                raw = _payload_to_mime(message["payload"], id, message.get("attachments"))
+                return {"id": id, "threadId": message["threadId"], "raw": base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")}
+            if format == "minimal":
+                return {"id": id, "threadId": message["threadId"], "sizeEstimate": self._size_estimate(id)}
+            if format == "metadata":
+                wanted = set(metadataHeaders or [])
+                headers = [h for h in message["payload"]["headers"] if not wanted or h["name"] in wanted]
+                return {"id": id, "threadId": message["threadId"], "sizeEstimate": self._size_estimate(id),
+                        "payload": {"mimeType": message["payload"]["mimeType"], "headers": headers}}
+            if fields:
+                return {"id": id, "payload": _strip_to_partial(message["payload"])}
+            return message
+        return _Request(self.profile, self.stats, "messages.get", run)
+
+class _FakeAttachments:
+    """`service.users().messages().attachments().get(...)`"""
+
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def get(self, userId="me", messageId=None, id=None, **kwargs):
+        gmail = self.gmail
+
+        def run():
+            data = gmail.mailbox.get(messageId, {}).get("attachments", {}).get(id)
+            if data is None:
+                raise FakeHttpError(404, "Not Found")
+            return {"attachmentId": id, "size": len(data), "data": data}
+        return _Request(gmail.profile, gmail.stats, "attachments.get", run)
+
+class _FakeHistory:
+    """`service.users().history().list(...)` - messageAdded records since startHistoryId."""
+
+    def __init__(self, gmail):
+        self.gmail = gmail
+
+    def list(self, userId="me", startHistoryId=None, historyTypes=None, labelId=None, pageToken=None, maxResults=100, **kwargs):
+        gmail = self.gmail
+
+        def run():
+            start = int(startHistoryId)
+            with gmail.lock:
+                if start < gmail.oldest_history_id:
+                    raise FakeHttpError(404, "Requested entity was not found.")
+                records = [(hid, mid) for hid, mid in gmail.history_log if hid > start]
+                current = gmail.history_id
+            offset = int(pageToken or 0)
+            page = records[offset:offset + maxResults]
+            result = {"history": [{"id": str(hid), "messagesAdded": [{"message": {"id": mid, "labelIds": ["INBOX"]}}]}
+                                  for hid, mid in page],
+                      "historyId": str(current)}
+            if offset + maxResults < len(records):
+                result["nextPageToken"] = str(offset + maxResults)
+            return result
+        return _Request(gmail.profile, gmail.stats, "history.list", run)
+
+# --- Calendar ---
+
+class FakeCalendarService:
+    """
+    `service.events().list/insert/patch(...).execute()` over an in-memory calendar.
+    Like the real API, inserting a client-supplied id that already exists is a 409.
+    """
+
+    def __init__(self, profile=None):
+        self.store = {}
+        self.profile = profile or FaultProfile()
+        self.stats = {}
+        self.lock = threading.Lock()
+        self._next_id = 0
+
+    def events(self):
+        return self
+
+    def list(self, calendarId=None, timeMin=None, timeMax=None, **kwargs):
+        def run():
+            with self.lock:
+                items = [e for e in self.store.values()
+                         if (not timeMax or e["start"].get("dateTime", "") < timeMax)
+                         and (not timeMin or e["end"].get("dateTime", "") > timeMin)]
+            return {"items": items}
+        return _Request(self.profile, self.stats, "events.list", run)
+
+    def insert(self, calendarId=None, body=None, **kwargs):
+        def run():
+            with self.lock:
+                if body.get("id") in self.store:
+                    raise FakeHttpError(409, "The requested identifier already exists.")
+                self._next_id += 1
+                event = dict(body, id=body.get("id") or f"evt{self._next_id}")
+                event["htmlLink"] = f"https://calendar.example/event?eid={event['id']}"
+                self.store[event["id"]] = event
+            return event
+        return _Request(self.profile, self.stats, "events.insert", run)
+
+    def patch(self, calendarId=None, eventId=None, body=None, **kwargs):
+        def run():
+            with self.lock:
+                if eventId not in self.store:
+                    raise FakeHttpError(404, "Not Found")
+                self.store[eventId].update(body)
+                return dict(self.store[eventId])
+        return _Request(self.profile, self.stats, "events.patch", run)
+
+# --- Gist (config) ---
+
+class FakeGistServer:
+    """
+    Local HTTP server answering GET/PATCH /gists/<id> like the GitHub API.
+    Point state_manager at it with GITHUB_API_URL=<server.url>.
+    """
+
+    def __init__(self, config, gist_id="fakegist", profile=None):
+        self.gist_id = gist_id
+        self.content = json.dumps(config, indent=4)
+        self.profile = profile or FaultProfile()
+        self.stats = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                try:
+                    server.profile.apply(server.stats, "gist.get")
+                except FakeHttpError as e:
+                    return self._reply(e.status_code, {"message": str(e)})
+                self._reply(200, {"id": server.gist_id, "files": {"config.json": {"content": server.content}}})
+
+            def do_PATCH(self):
+                try:
+                    server.profile.apply(server.stats, "gist.patch")
+                except FakeHttpError as e:
+                    return self._reply(e.status_code, {"message": str(e)})
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                server.content = payload.get("files", {}).get("config.json", {}).get("content", server.content)
+                self._reply(200, {"id": server.gist_id})
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# --- Gemini ---
+
+class FakeGenAI:
+    """
+    Stand-in for the `google.generativeai` module: configure() and
+    GenerativeModel(name).generate_content(prompt). Returns a 'found' event
+    for any prompt with a date-like token in it.
+    """
+
+    def __init__(self, profile=None):
+        self.profile = profile or FaultProfile()
+        self.stats = {}
+        self.prompt_chars = 0
+
+    def configure(self, **kwargs):
+        pass
+
+    def GenerativeModel(self, model_name):
+        fake = self
+
+        class _Response:
+            def __init__(self, text):
+                self.text = text
+
+        class _Model:
+            def generate_content(self, prompt):
+                fake.profile.apply(fake.stats, "generate_content")
+                fake.prompt_chars += len(prompt)
+                found = any(ch.isdigit() for ch in prompt)
+                event = {
+                    "event_title": "Synthetic event",
+                    "start_time": "2026-03-01T09:00:00",
+                    "end_time": "2026-03-01T10:00:00",
+                    "location": "School",
+                    "description": "Generated by FakeGenAI",
+                    "subjects": []
+                } if found else None
+                return _Response("```json\n" + json.dumps({"found": found, "analysis": "fake", "event": event}) + "\n```")
+
+        return _Model()
@@ -0,0 +1,428 @@
+"""
+Gmail message fetching with selectable fetch profiles.
+
+    full      - format=full, every part decoded (the original behaviour)
+    partial   - format=full with a fields= mask: same parse, fewer bytes on the wire
+    raw       - format=raw parsed by a streaming MIME scanner that stops after the
+                first usable body part and caps decoded bytes per message
+    screened  - format=metadata first (headers only); the body is fetched with
+                'raw' only for messages that pass the subject screen
+
+format=raw inlines every attachment, so the scanner's early stop doesn't save
+the download of a message with a large attachment. raw therefore makes a
+format=minimal call first for Gmail's sizeEstimate (screened has it from the
+metadata call), and messages over RAW_MAX_SIZE_ESTIMATE are fetched as
+'partial' instead, where attachments stay behind an attachmentId.
+
+Pick one with GMAIL_FETCH_PROFILE or the fetch_profile argument of extract_emails.
+
+Calendar invites (text/calendar parts and .ics attachments) are collected in
+every profile and returned as "calendar" for ics_parser.
+
+Listing runs the config plan's sub-queries (see config_engine.build_gmail_queries)
+concurrently, pages through each one fully and unions the ids.
+"""
+import base64
+import os
+import quopri
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.header import decode_header, make_header
+
+import metrics
+from ics_parser import MAX_ICS_BYTES, is_calendar_part
+
+FETCH_PROFILES = ("full", "partial", "raw", "screened")
+DEFAULT_FETCH_PROFILE = os.getenv("GMAIL_FETCH_PROFILE", "partial")
+
+# Upper bound on decoded body bytes kept per message in the raw/screened profiles
+MAX_BODY_BYTES = int(os.getenv("GMAIL_MAX_BODY_BYTES", "200000"))
+
+# raw/screened: messages Gmail estimates larger than this are fetched as 'partial'
+RAW_MAX_SIZE_ESTIMATE = int(os.getenv("GMAIL_RAW_MAX_SIZE_ESTIMATE", "1000000"))
+
+# A text/plain part shorter than this ("view this email in your browser") doesn't
+# count as usable - keep scanning for the HTML alternative
+MIN_PLAIN_CHARS = 200
+
+PARTIAL_FIELDS = "id,payload(mimeType,headers(name,value),body/data,parts)"
+METADATA_HEADERS = ["Subject", "From", "Date"]
+
+# Sub-queries listed in parallel, and the page size of each list call (Gmail's maximum)
+GMAIL_QUERY_WORKERS = int(os.getenv("GMAIL_QUERY_WORKERS", "4"))
+LIST_PAGE_SIZE = 500
+
+# Base64 characters decoded per step when streaming a raw message (multiple of 4)
+RAW_CHUNK_CHARS = 64 * 1024
+
+# raw/screened: after the body is found, keep reading for calendar parts until this
+# much of the message has been read (invites are small; big messages stop early as before)
+CALENDAR_SCAN_BYTES = int(os.getenv("GMAIL_CALENDAR_SCAN_BYTES", "262144"))
+
+def _decode_header_value(value):
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+def _header(headers, name, default):
+    return next((h['value'] for h in headers if h['name'] == name), default)
+
+# --- format=full / partial ---
+
+def _bodies_from_payload(payload):
+    """The original walk: decode every text/plain and text/html part and keep the longer."""
+    plain_text = ""
+    html_content = ""
+
+    def walk_parts(parts):
+        nonlocal plain_text, html_content
+        for part in parts:
+            mime = part.get('mimeType')
+            data = part.get('body', {}).get('data')
+
+            if mime == 'text/plain' and data:
+                plain_text += base64.urlsafe_b64decode(data).decode()
+            elif mime == 'text/html' and data:
+                html_content += base64.urlsafe_b64decode(data).decode()
+            elif 'parts' in part:
+                walk_parts(part['parts'])
+
+    if 'parts' in payload:
+        walk_parts(payload['parts'])
+    elif 'body' in payload:
+        data = payload['body'].get('data')
+        if data:
+            body_str = base64.urlsafe_b64decode(data).decode()
+            if payload.get('mimeType') == 'text/html':
+                html_content = body_str
+            else:
+                plain_text = body_str
+
+    # Decision: If HTML is present, it's usually the "richer" source for school notices
+    return html_content if len(html_content) > len(plain_text) else plain_text
+
+def _calendar_from_payload(service, msg_id, payload):
+    """Text of the calendar parts: inline data decoded, .ics attachments fetched (size permitting)."""
+    calendars = []
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        stack.extend(reversed(part.get('parts', [])))
+        if not is_calendar_part(part.get('mimeType'), part.get('filename')):
+            continue
+        body = part.get('body', {})
+        data = body.get('data')
+        if not data and body.get('attachmentId') and body.get('size', 0) <= MAX_ICS_BYTES:
+            metrics.inc("gmail.attachments.get")
+            with metrics.stage("gmail_get"):
+                data = service.users().messages().attachments().get(
+                    userId='me', messageId=msg_id, id=body['attachmentId']).execute().get('data')
+        if data:
+            calendars.append(base64.urlsafe_b64decode(data).decode("utf-8", "replace"))
+    return calendars
+
+# --- format=raw ---
+
+def _iter_raw_lines(raw):
+    """Decodes a base64url RFC 822 message chunk by chunk, yielding lines as bytes."""
+    buffer = b""
+    for i in range(0, len(raw), RAW_CHUNK_CHARS):
+        chunk = raw[i:i + RAW_CHUNK_CHARS]
+        buffer += base64.urlsafe_b64decode(chunk + "=" * (-len(chunk) % 4))
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if buffer:
+        yield buffer.rstrip(b"\r")
+
+def _parse_headers(lines):
+    headers = {}
+    last = None
+    for line in lines:
+        if not line:
+            break
+        if line[:1] in (b" ", b"\t") and last:
+            headers[last] += " " + line.strip().decode("utf-8", "replace")
+            continue
+        name, _, value = line.partition(b":")
+        last = name.strip().lower().decode("utf-8", "replace")
+        headers[last] = value.strip().decode("utf-8", "replace")
+    return headers
+
+def _parse_params(value):
+    """'text/plain; charset="utf-8"' -> ('text/plain', {'charset': 'utf-8'})"""
+    main, *params = (value or "").split(";")
+    parsed = {}
+    for param in params:
+        key, _, val = param.partition("=")
+        parsed[key.strip().lower()] = val.strip().strip('"')
+    return main.strip().lower(), parsed
+
+class _RawBodyScanner:
+    """
+    Walks a MIME message line by line, skipping everything except text and
+    calendar parts. Stops reading once a usable body is found and the first
+    CALENDAR_SCAN_BYTES have been looked at for invites, so large quoted
+    threads, trailing alternatives and attachments are never decoded.
+    """
+
+    def __init__(self, lines, max_bytes, calendar_scan_bytes=CALENDAR_SCAN_BYTES):
+        self.lines = self._counted(lines)
+        self.max_bytes = max_bytes
+        self.calendar_scan_bytes = calendar_scan_bytes
+        self.bytes_read = 0
+        self.body = None
+        self.fallback = ""
+        self.calendars = []
+
+    def _counted(self, lines):
+        for line in lines:
+            self.bytes_read += len(line) + 1
+            yield line
+
+    def _wants_more(self):
+        return self.body is None or self.bytes_read < self.calendar_scan_bytes
+
+    def _skip_to_boundary(self, boundaries):
+        for line in self.lines:
+            if line.startswith(b"--") and any(line.startswith(b"--" + b) for b in boundaries):
+                return line.rstrip()
+        return None
+
+    def _collect(self, boundaries, max_bytes=None):
+        # Allow for transfer-encoding overhead (base64 4/3, quoted-printable up to 3x)
+        limit = (max_bytes or self.max_bytes) * 3
+        collected = []
+        size = 0
+        for line in self.lines:
+            if boundaries and line.startswith(b"--") and any(line.startswith(b"--" + b) for b in boundaries):
+                return collected, line.rstrip()
+            collected.append(line)
+            size += len(line) + 1
+            if size > limit:
+                # Big enough to be the body - stop reading the rest of the message
+                return collected, None
+        return collected, None
+
+    def scan(self, headers, boundaries):
+        """Scans the entity whose headers were just read. Returns the delimiter line that ended it."""
+        content_type, params = _parse_params(headers.get("content-type", "text/plain"))
+        disposition = headers.get("content-disposition", "").lower()
+
+        if content_type.startswith("multipart/") and params.get("boundary"):
+            boundary = params["boundary"].encode()
+            inner = boundaries + [boundary]
+            end = self._skip_to_boundary(inner)
+            while end == b"--" + boundary and self._wants_more():
+                end = self.scan(_parse_headers(self.lines), inner)
+            if end == b"--" + boundary + b"--" and self._wants_more():
+                end = self._skip_to_boundary(boundaries)
+            return end
+
+        filename = _parse_params(headers.get("content-disposition", ""))[1].get("filename") or params.get("name")
+        if is_calendar_part(content_type, filename):
+            collected, end = self._collect(boundaries, MAX_ICS_BYTES)
+            data = self._decode(collected, headers)
+            self.calendars.append(data[:MAX_ICS_BYTES].decode(params.get("charset") or "utf-8", "replace"))
+            return end
+
+        if content_type in ("text/plain", "text/html") and "attachment" not in disposition and self.body is None:
+            collected, end = self._collect(boundaries)
+            data = self._decode(collected, headers)
+            text = data[:self.max_bytes].decode(params.get("charset") or "utf-8", "replace")
+            metrics.inc("gmail.body_bytes_decoded", min(len(data), self.max_bytes))
+
+            if content_type == "text/html" or len(text.strip()) >= MIN_PLAIN_CHARS:
+                self.body = text
+            elif len(text) > len(self.fallback):
+                self.fallback = text
+            return end
+
+        return self._skip_to_boundary(boundaries)
+
+    def _decode(self, collected, headers):
+        encoding = headers.get("content-transfer-encoding", "").lower()
+        if encoding == "base64":
+            return base64.b64decode(b"".join(collected) + b"==", validate=False)
+        data = b"\n".join(collected)
+        if encoding == "quoted-printable":
+            return quopri.decodestring(data)
+        return data
+
+def parse_raw_message(raw, max_bytes=MAX_BODY_BYTES):
+    """
+    Streams a format=raw message. Returns (headers, body, calendars): headers
+    is a lower-cased name -> value dict, body is the first usable text part,
+    calendars the text of any calendar parts met on the way.
+    """
+    lines = _iter_raw_lines(raw)
+    headers = _parse_headers(lines)
+    scanner = _RawBodyScanner(lines, max_bytes)
+    scanner.scan(headers, [])
+    return headers, scanner.body if scanner.body is not None else scanner.fallback, scanner.calendars
+
+# --- Listing ---
+
+def _list_all(service, q):
+    """Pages through one search until Gmail stops returning a nextPageToken."""
+    ids = []
+    pages = 0
+    page_token = None
+    while True:
+        params = {"userId": 'me', "q": q, "maxResults": LIST_PAGE_SIZE}
+        if page_token:
+            params["pageToken"] = page_token
+        metrics.inc("gmail.messages.list")
+        with metrics.stage("gmail_list"):
+            result = service.users().messages().list(**params).execute()
+        pages += 1
+        ids.extend(m['id'] for m in result.get('messages', []))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return ids, pages
+
+def list_message_ids(service, queries, prefix="", suffix="", workers=None, service_factory=None):
+    """
+    Lists every sub-query in `queries` ([{"terms", "q"}]) wrapped as
+    "<prefix> <q> <suffix>", on up to `workers` threads. Returns (ids, results):
+    the deduplicated ids in first-seen order, and per sub-query
+    {"terms", "ids", "pages", "new_ids"}.
+
+    googleapiclient services aren't thread safe: pass `service_factory` to give
+    each worker thread its own client. Without it `service` is shared.
+    """
+    workers = max(1, min(workers or GMAIL_QUERY_WORKERS, len(queries)))
+    run = metrics.current_run()
+    local = threading.local()
+
+    def list_one(query):
+        metrics.bind_run(run)
+        client = service
+        if service_factory and workers > 1:
+            if not hasattr(local, "service"):
+                local.service = service_factory()
+            client = local.service
+        q = " ".join(part for part in (prefix, query["q"], suffix) if part)
+        return _list_all(client, q)
+
+    if workers == 1:
+        listed = [list_one(query) for query in queries]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gmail-list") as pool:
+            listed = list(pool.map(list_one, queries))
+
+    seen = {}
+    results = []
+    for query, (ids, pages) in zip(queries, listed):
+        before = len(seen)
+        for msg_id in ids:
+            seen.setdefault(msg_id, None)
+        results.append({"terms": query["terms"], "ids": ids, "pages": pages, "new_ids": len(seen) - before})
+    metrics.inc("gmail.duplicate_ids", sum(len(r["ids"]) for r in results) - len(seen))
+    return list(seen), results
+
+def term_report(results, emails):
+    """
+    How many fetched messages each search term accounts for, so terms that
+    never (or never uniquely) find anything can be pruned from the config.
+    Attribution is local: a message counts for a term from a sub-query that
+    returned it when the term appears in its subject, sender or body.
+    Gmail's own matching is token based, so treat the numbers as approximate.
+    """
+    candidates = {}
+    for result in results:
+        for msg_id in result["ids"]:
+            candidates.setdefault(msg_id, []).extend(result["terms"])
+
+    terms = {term: {"matched": 0, "unique": 0} for result in results for term in result["terms"]}
+    unattributed = 0
+    for email in emails:
+        text = f"{email.subject} {email.sender} {email.body}".lower()
+        matched = [t for t in candidates.get(email.id, []) if t.lower() in text]
+        for term in matched:
+            terms[term]["matched"] += 1
+        if len(matched) == 1:
+            terms[matched[0]]["unique"] += 1
+        elif not matched:
+            unattributed += 1
+
+    return {
+        "sub_queries": [{"terms": r["terms"], "ids": len(r["ids"]), "new_ids": r["new_ids"], "pages": r["pages"]} for r in results],
+        "terms": terms,
+        "unattributed": unattributed,
+        "zero_hit_terms": [t for t, counts in terms.items() if counts["matched"] == 0],
+    }
+
+# --- Fetching ---
+
+def _get(service, msg_id, **params):
+    metrics.inc("gmail.messages.get")
+    with metrics.stage("gmail_get"):
+        return service.users().messages().get(userId='me', id=msg_id, **params).execute()
+
+def _fetch_full(service, msg_id, profile):
+    """format=full ('partial' adds the fields= mask); attachments are fetched only for calendar parts."""
+    params = {"fields": PARTIAL_FIELDS} if profile == "partial" else {}
+    txt = _get(service, msg_id, **params)
+    payload = txt['payload']
+    headers = payload['headers']
+    body = _bodies_from_payload(payload)
+    metrics.inc("gmail.body_bytes_decoded", len(body))
+    return {
+        "id": msg_id,
+        "subject": _header(headers, 'Subject', "No Subject"),
+        "sender": _header(headers, 'From', "Unknown"),
+        "headers": {h['name']: h['value'] for h in headers},
+        "body": body,
+        "calendar": _calendar_from_payload(service, msg_id, payload)
+    }
+
+def fetch_email(service, msg_id, profile=None, screen=None, max_body_bytes=MAX_BODY_BYTES):
+    """
+    Fetches one message and returns {"id", "subject", "sender", "headers", "body", "calendar"}.
+    In the 'screened' profile, `screen(subject)` returning "IGNORE" skips the
+    body fetch and the email comes back with an empty body.
+    In 'raw' and 'screened', a message whose sizeEstimate is over
+    RAW_MAX_SIZE_ESTIMATE is fetched with the 'partial' profile instead of
+    format=raw ('raw' pays one extra format=minimal call per message to find out).
+    """
+    profile = profile or DEFAULT_FETCH_PROFILE
+    if profile not in FETCH_PROFILES:
+        raise ValueError(f"Unknown Gmail fetch profile: {profile}")
+
+    if profile in ("raw", "screened"):
+        headers = None
+        if profile == "screened":
+            meta = _get(service, msg_id, format="metadata", metadataHeaders=METADATA_HEADERS)
+            headers = {h['name']: h['value'] for h in meta.get('payload', {}).get('headers', [])}
+            subject = _decode_header_value(headers.get("Subject", "No Subject"))
+            if screen and screen(subject) == "IGNORE":
+                return {"id": msg_id, "subject": subject, "sender": headers.get("From", "Unknown"), "headers": headers,
+                        "body": "", "calendar": []}
+            size = meta.get('sizeEstimate', 0)
+        else:
+            size = _get(service, msg_id, format="minimal").get('sizeEstimate', 0)
+
+        if size > RAW_MAX_SIZE_ESTIMATE:
+            metrics.inc("gmail.raw_size_fallbacks")
+            return _fetch_full(service, msg_id, "partial")
+
+        raw = _get(service, msg_id, format="raw").get('raw', "")
+        raw_headers, body, calendars = parse_raw_message(raw, max_body_bytes)
+        if headers is None:
+            headers = {
+                "Subject": _decode_header_value(raw_headers.get("subject", "No Subject")),
+                "From": _decode_header_value(raw_headers.get("from", "Unknown")),
+                "Date": raw_headers.get("date", ""),
+            }
+        return {
+            "id": msg_id,
+            "subject": _decode_header_value(headers.get("Subject", "No Subject")),
+            "sender": headers.get("From", "Unknown"),
+            "headers": headers,
+            "body": body,
+            "calendar": calendars
+        }
+
+    return _fetch_full(service, msg_id, profile)
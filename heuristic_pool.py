@@ -0,0 +1,59 @@
+"""
+Optional process-pool execution of the CPU-bound parse/heuristic stage.
+
+On large backfills the DOTALL regex passes in heuristic_extraction and the
+identify_child matching dominate and compete with Flask for the GIL. With
+HEURISTIC_WORKERS > 1 the stage runs in worker processes instead: each one
+receives the run's config once (initializer) and keeps its compiled matchers
+warm, messages travel as compact (id, subject, body) tuples, and results
+come back in input order.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+HEURISTIC_WORKERS = int(os.getenv("HEURISTIC_WORKERS", "0"))
+# spawn avoids forking a process that has Flask/scheduler threads running
+START_METHOD = os.getenv("HEURISTIC_START_METHOD", "spawn")
+
+_worker_config = None
+
+def _init_worker(config):
+    global _worker_config
+    from heuristics import get_matchers
+    _worker_config = config
+    get_matchers(config)  # compile once per worker
+
+def _screen_and_extract(payload):
+    from heuristics import heuristic_extraction, quick_screen_subject
+
+    msg_id, subject, body = payload
+    if quick_screen_subject(subject, _worker_config) == "IGNORE":
+        return "IGNORE", None
+    return [], heuristic_extraction(body, subject, msg_id, _worker_config)
+
+def screen_and_extract(email, config):
+    """Serial form: (pre_subjects, event_data) for one email."""
+    from heuristics import heuristic_extraction, quick_screen_subject
+
+    pre_subjects = quick_screen_subject(email.subject, config)
+    if pre_subjects == "IGNORE":
+        return pre_subjects, None
+    return pre_subjects, heuristic_extraction(email.body, email.subject, email.id, config)
+
+def run_heuristic_stage(emails, config, workers=None):
+    """
+    Returns [(pre_subjects, event_data)] aligned with `emails`.
+    Runs serially when workers <= 1 or there is too little work to be worth a pool.
+    """
+    workers = HEURISTIC_WORKERS if workers is None else workers
+    if workers <= 1 or len(emails) < workers * 4:
+        return [screen_and_extract(email, config) for email in emails]
+
+    payloads = [(e.id, e.subject, e.body) for e in emails]
+    context = multiprocessing.get_context(START_METHOD)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(config,)) as pool:
+        # Chunk so each IPC round trip carries a useful amount of work
+        chunksize = max(1, len(payloads) // (workers * 8))
+        return list(pool.map(_screen_and_extract, payloads, chunksize=chunksize))
@@ -2,14 +2,31 @@ import re
 from datetime import datetime
 
 from state_manager import load_config
+import metrics
+from records import CandidateEvent
 
-def identify_child(text):
+# Compiled matchers for the most recently used config (see compile_matchers)
+_matcher_cache = (None, None)
+
+MONTHS_MAP = {
+    "jan": "01", "feb": "02", "mar": "03", "apr": "04", "may": "05", "jun": "06",
+    "jul": "07", "aug": "08", "sep": "09", "oct": "10", "nov": "11", "dec": "12"
+}
+
+# How much each doubt about a heuristic_extraction result costs its confidence (1.0 = certain)
+CONFIDENCE_PENALTIES = {
+    "multiple_dates": 0.4,  # more than one date mentioned - the first may not be the event
+    "no_time": 0.2,         # no time found, 09:00 assumed
+    "numeric_date": 0.1,    # dd/mm only: no month name to confirm the order
+    "no_child": 0.3,        # nothing the labelling rules recognise
+}
+
+def compile_matchers(config):
     """
-    Updated Rule 1: The "Who" Heuristic + Year Group Guardrail.
+    Precompiles everything identify_child needs from a config: lower-cased
+    keyword lists, name-part regexes and target year digits. Built once per
+    config instead of once per email.
     """
-    text_lower = text.lower()
-    
-    config = load_config()
     search_settings = config.get("search_settings", {})
     filtering_logic = config.get("filtering_logic", {})
     
@@ -18,73 +35,100 @@ def identify_child(text):
     year_groups = search_settings.get("year_groups", ["Year 3", "Year 5", "Year 6", "Reception Year"])
     clubs = search_settings.get("clubs", ["FOBG", "Friends of Bishop Gilpin", "Krispy Kreme", "Wednesday Notice", "PTA"])
     general_keywords = search_settings.get("general_keywords", ["School Trip", "Assembly", "Sports Day", "Parent Evening", "Costume Day", "donut", "fundraiser"])
+
+    # Parse years from config to check against text
+    target_years = []
+    for yg in year_groups:
+        y_match = re.search(r'(\d)', yg)
+        if y_match: target_years.append(y_match.group(1))
+
+    child_matchers = []
+    for child_full_name in children:
+        name_parts = child_full_name.split()
+        first_name = name_parts[0] if name_parts else child_full_name
+        # Individual parts longer than 2 chars to avoid 'of', 'jr'
+        part_patterns = [(part, re.compile(fr'\b{re.escape(part)}\b'))
+                         for part in [p.lower() for p in name_parts if len(p) > 2]]
+        child_matchers.append((child_full_name.lower(), first_name, part_patterns))
+
+    return {
+        "exclude_keywords": [ex.lower() for ex in filtering_logic.get("exclude_keywords", [])],
+        "strict_overrides": [o.lower() for o in filtering_logic.get("strict_override_keywords", [])],
+        "target_years": target_years,
+        "children": child_matchers,
+        "child_mappings": [(label, [t.lower() for t in terms]) for label, terms in config.get("child_mappings", {}).items()],
+        # Override Keywords (Clubs + General)
+        "override_keywords": [k.lower() for k in clubs + general_keywords + ["office", "closing", "closed"]],
+    }
+
+def get_matchers(config=None):
+    """Compiled matchers for `config` (default: load_config()), reusing the last compile when it's the same config."""
+    global _matcher_cache
+    config = config if config is not None else load_config()
+    cached_config, matchers = _matcher_cache
+    if cached_config is not config:
+        matchers = compile_matchers(config)
+        _matcher_cache = (config, matchers)
+    return matchers
+
+def identify_child(text, config=None):
+    """
+    Updated Rule 1: The "Who" Heuristic + Year Group Guardrail.
+    Pass the run's `config` to avoid reloading it for every email.
+    """
+    text_lower = text.lower()
+    m = get_matchers(config)
     
     # --- PHASE 0: EXCLUSION GUARDRAIL ---
-    exclude_keywords = filtering_logic.get("exclude_keywords", [])
-    strict_overrides = filtering_logic.get("strict_override_keywords", [])
-    
     # If we find an override, we bypass exclusions
-    has_override = any(o.lower() in text_lower for o in strict_overrides)
+    has_override = any(o in text_lower for o in m["strict_overrides"])
     if not has_override:
-        for ex in exclude_keywords:
-            if ex.lower() in text_lower:
+        for ex in m["exclude_keywords"]:
+            if ex in text_lower:
                 return "IGNORE"
     
     # 1. Extraction of Year Groups (Year 1, Y1, etc.)
     years_found = re.findall(r'year\s*(\d)|y(\d)', text_lower)
     extracted_years = [y[0] or y[1] for y in years_found]
-    
-    # 1b. Parse years from config to check against text
-    target_years = []
-    for yg in year_groups:
-        y_match = re.search(r'(\d)', yg)
-        if y_match: target_years.append(y_match.group(1))
 
     # Helper to check if any item in a list is in text
     def check_keywords(keywords, text):
-        return any(k.lower() in text for k in keywords)
+        return any(k in text for k in keywords)
 
     # 2. Check for specific names
     is_dewsbery = "dewsbery" in text_lower
     labels = []
 
     # Dynamic Child Check from Configuration
-    for child_full_name in children:
-        name_parts = child_full_name.split()
-        first_name = name_parts[0] if name_parts else child_full_name
-        
+    for full_name_lower, first_name, part_patterns in m["children"]:
         # Check for any part of the name (e.g. "Tristan" or "Dewsbery")
         # We check full name first
-        if child_full_name.lower() in text_lower:
+        if full_name_lower in text_lower:
             if first_name not in labels: labels.append(first_name)
             continue
             
-        # Check individual parts (longer than 2 chars to avoid 'of', 'jr')
-        for part in [p.lower() for p in name_parts if len(p) > 2]:
+        for part, pattern in part_patterns:
             # Special case for "Ben" - only match if "Dewsbery" is there too, 
             # otherwise it might be another "Ben"
             if part == "ben" and not is_dewsbery:
                 continue
                 
-            if re.search(fr'\b{re.escape(part)}\b', text_lower):
+            if pattern.search(text_lower):
                 if first_name not in labels: labels.append(first_name)
                 break
     
     # Check Child Mappings (e.g. Year 2 -> Benjamin)
-    child_mappings = config.get("child_mappings", {})
-    for child_label, mapped_terms in child_mappings.items():
+    for child_label, mapped_terms in m["child_mappings"]:
         if check_keywords(mapped_terms, text_lower):
             if child_label not in labels: labels.append(child_label)
         
     # Check for Year Matches from Configuration
     for y in extracted_years:
-        if y in target_years:
+        if y in m["target_years"]:
             label = f"Year {y}"
             if label not in labels: labels.append(label)
 
-    # Override Keywords (Clubs + General)
-    override_keywords = clubs + general_keywords + ["office", "closing", "closed"]
-    is_override = check_keywords(override_keywords, text_lower)
+    is_override = check_keywords(m["override_keywords"], text_lower)
     
     is_nursery = "dees days" in text_lower
     
@@ -97,16 +141,22 @@ def identify_child(text):
         return "IGNORE"
             
     return labels
-        
-    # 4. Fallback Labels
-    if not labels:
-        if is_nursery:
-            labels.append("Nursery")
-        else:
-            # If no years mentioned at all, we show it as Bishop Gilpin
-            pass
-            
-    return labels
+
+def quick_screen_subject(subject, config=None):
+    """
+    Cheap subject-only pre-screen, run before any body parsing.
+    Returns "IGNORE" if the subject hits an exclusion keyword (and no strict
+    override), otherwise an empty label list - the body decides the rest.
+    """
+    subject_lower = (subject or "").lower()
+    m = get_matchers(config)
+
+    if any(o in subject_lower for o in m["strict_overrides"]):
+        return []
+    for ex in m["exclude_keywords"]:
+        if ex in subject_lower:
+            return "IGNORE"
+    return []
 
 def check_gift_heuristic(event_type, description):
     """
@@ -117,10 +167,23 @@ def check_gift_heuristic(event_type, description):
         return True
     return False
 
-def heuristic_extraction(text, subject, msg_id=None):
+def _distinct_dates(text, months_pattern):
+    """The distinct (day, month) pairs mentioned. Dotted numbers are left out - they are usually times."""
+    dates = {(int(day), MONTHS_MAP[month.lower()[:3]])
+             for day, month in re.findall(fr'\b(\d{{1,2}})[.\s]+({months_pattern})', text, re.IGNORECASE)}
+    for day, month in re.findall(r'\b(\d{1,2})[/-](\d{1,2})\b', text):
+        if 1 <= int(day) <= 31 and 1 <= int(month) <= 12:
+            dates.add((int(day), month.zfill(2)))
+    return dates
+
+@metrics.timed("heuristic_extraction")
+def heuristic_extraction(text, subject, msg_id=None, config=None):
     """
     Rule 4: Emergency Fallback
     If AI is down, try simple regex extraction for Date/Title.
+    The result carries a confidence score and the reasons for any doubt
+    (see CONFIDENCE_PENALTIES), which extraction_router uses to decide
+    whether the email is worth a Gemini call.
     """
     # Aggressive HTML Cleaning
     # Remove style and script blocks content completely
@@ -148,11 +211,7 @@ def heuristic_extraction(text, subject, msg_id=None):
     if named_date_match:
         day = named_date_match.group(1).zfill(2)
         month_str = named_date_match.group(2).lower()[:3]
-        months_map = {
-            "jan": "01", "feb": "02", "mar": "03", "apr": "04", "may": "05", "jun": "06",
-            "jul": "07", "aug": "08", "sep": "09", "oct": "10", "nov": "11", "dec": "12"
-        }
-        month = months_map.get(month_str)
+        month = MONTHS_MAP.get(month_str)
         year = datetime.now().year
         event_date = f"{year}-{month}-{day}"
     elif numerical_date_match:
@@ -176,19 +235,32 @@ def heuristic_extraction(text, subject, msg_id=None):
     if time_match:
         event_time = f"{time_match.group(1).zfill(2)}:{time_match.group(2)}:00"
 
-    labels = identify_child(text_full)
-    if labels == "IGNORE": labels = ["Bishop Gilpin"]
+    labels = identify_child(text_full, config)
 
-    return {
-        "event_title": subject,
-        "start_time": f"{event_date}T{event_time}",
-        "end_time": f"{event_date}T{str(int(event_time[:2])+1).zfill(2)}:00:00",
-        "location": "School / TBD",
+    reasons = []
+    if len(_distinct_dates(text_full, months_pattern)) > 1:
+        reasons.append("multiple_dates")
+    if not time_match:
+        reasons.append("no_time")
+    if not named_date_match:
+        reasons.append("numeric_date")
+    if labels == "IGNORE":
+        reasons.append("no_child")
+        labels = ["Bishop Gilpin"]
+
+    return CandidateEvent(
+        event_title=subject,
+        start_time=f"{event_date}T{event_time}",
+        end_time=f"{event_date}T{str(int(event_time[:2])+1).zfill(2)}:00:00",
+        location="School / TBD",
         # Use simple text_clean here
-        "description": f"{(text_clean[:500] + '...') if len(text_clean) > 500 else text_clean}\n\nSource: {gmail_url}",
-        "subjects": labels if isinstance(labels, list) else ["Bishop Gilpin"],
-        "gmail_url": gmail_url
-    }
+        description=f"{(text_clean[:500] + '...') if len(text_clean) > 500 else text_clean}\n\nSource: {gmail_url}",
+        subjects=labels if isinstance(labels, list) else ["Bishop Gilpin"],
+        gmail_url=gmail_url,
+        source_id=msg_id,
+        confidence=round(max(0.0, 1.0 - sum(CONFIDENCE_PENALTIES[r] for r in reasons)), 2),
+        reasons=reasons
+    )
 
 def check_costume_heuristic(text):
     """
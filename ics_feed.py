@@ -0,0 +1,281 @@
+"""
+iCalendar subscription feed of approved events (/feed.ics).
+
+Approving an event writes it to the Google calendar; family members on other
+calendar apps subscribe to this feed instead. Approved events are kept in
+approved_events.json (per tenant) and each one is rendered to its VEVENT
+once, when it is approved. A feed is those cached VEVENTs joined, optionally
+only the ones carrying a child label (identify_child's title tags), and is
+itself cached until the next approval.
+
+The ETag and Last-Modified come from the store's version and change time,
+so a polling client's conditional request is answered 304 without touching
+the events at all. Events that ended more than FEED_RETENTION_DAYS ago drop
+out, so the feed doesn't grow with the history.
+
+The feed lists the children's names, schools and whereabouts, so it is only
+served with FEED_TOKEN set and given as ?token=. Times are written in
+Europe/London (whose VTIMEZONE the feed carries) or, for invites in any
+other zone, in UTC - RFC 5545 wants a VTIMEZONE for every TZID used.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from records import PendingEvent
+from state_manager import load_approved_events, save_approved_events, get_active_tenant, set_active_tenant
+
+# Secret for the subscription URL (?token=); unset = the feed isn't served
+FEED_TOKEN = os.getenv("FEED_TOKEN")
+
+# Approved events that ended longer ago than this leave the feed
+FEED_RETENTION_DAYS = int(os.getenv("FEED_RETENTION_DAYS", "180"))
+
+# Seconds calendar clients may reuse a feed before asking again
+FEED_MAX_AGE = int(os.getenv("FEED_MAX_AGE", "300"))
+
+FEED_NAME = os.getenv("FEED_NAME", "Family Logistics")
+PRODID = "-//social-etl-scheduler//Approved Events//EN"
+
+# Rendered feeds kept per store (one per child filter asked for)
+MAX_CACHED_FEEDS = 32
+
+# Most events are Europe/London; clients get its rules with the feed
+LONDON_VTIMEZONE = "\r\n".join([
+    "BEGIN:VTIMEZONE", "TZID:Europe/London",
+    "BEGIN:DAYLIGHT", "TZOFFSETFROM:+0000", "TZOFFSETTO:+0100", "TZNAME:BST",
+    "DTSTART:19700329T010000", "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU", "END:DAYLIGHT",
+    "BEGIN:STANDARD", "TZOFFSETFROM:+0100", "TZOFFSETTO:+0000", "TZNAME:GMT",
+    "DTSTART:19701025T020000", "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU", "END:STANDARD",
+    "END:VTIMEZONE",
+])
+
+def escape(text):
+    return (text or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+def fold(line):
+    """RFC 5545 folding: at most 75 octets per line, never splitting a UTF-8 character."""
+    if len(line.encode("utf-8")) <= 75:
+        return line
+    lines, current, size = [], "", 0
+    for char in line:
+        width = len(char.encode("utf-8"))
+        if size + width > (75 if not lines else 74):
+            lines.append(current)
+            current, size = "", 0
+        current += char
+        size += width
+    lines.append(current)
+    return "\r\n ".join(lines)
+
+def _utc_stamp(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def feed_authorized(token):
+    """True only if a feed token is configured and `token` matches it."""
+    if not FEED_TOKEN:
+        return False
+    return hmac.compare_digest((token or "").encode("utf-8"), FEED_TOKEN.encode("utf-8"))
+
+def _in_utc(moment, zone):
+    """A naive local time in `zone` as a UTC stamp; None if the zone is unknown."""
+    try:
+        from zoneinfo import ZoneInfo
+        return moment.replace(tzinfo=ZoneInfo(zone)).astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    except Exception:
+        return None
+
+def ics_time(name, value, zone):
+    """
+    'DTSTART;TZID=Europe/London:20260312T093000' (or VALUE=DATE) for a
+    Calendar-style time. Times with an offset, or in another known zone, are
+    written in UTC; unknown zones are taken as Europe/London.
+    """
+    if "T" not in value:
+        return f"{name};VALUE=DATE:{datetime.strptime(value[:10], '%Y-%m-%d').strftime('%Y%m%d')}"
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if moment.tzinfo is not None:
+        return f"{name}:{moment.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}"
+    stamp = _in_utc(moment, zone) if zone and zone != "Europe/London" else None
+    if stamp:
+        return f"{name}:{stamp}"
+    return f"{name};TZID=Europe/London:{moment.strftime('%Y%m%dT%H%M%S')}"
+
+def recurrence_line(line):
+    """An RDATE/EXDATE line with another zone's TZID rewritten in UTC, like the event's own times."""
+    head, _, values = line.partition(":")
+    params = dict(part.split("=", 1) for part in head.split(";")[1:] if "=" in part)
+    zone = params.get("TZID")
+    if not zone or zone == "Europe/London" or params.get("VALUE", "").upper() == "DATE":
+        return line
+    stamps = []
+    for value in values.split(","):
+        try:
+            stamp = _in_utc(datetime.strptime(value.strip()[:15], "%Y%m%dT%H%M%S"), zone)
+        except ValueError:
+            stamp = None
+        if stamp is None:
+            return head.replace(f"TZID={zone}", "TZID=Europe/London") + ":" + values
+        stamps.append(stamp)
+    rest = "".join(f";{key}={val}" for key, val in params.items() if key != "TZID")
+    return head.split(";")[0] + rest + ":" + ",".join(stamps)
+
+def render_vevent(event, approved_at, sequence=0):
+    """One approved PendingEvent as VEVENT text, or None if its times can't be read."""
+    try:
+        lines = ["BEGIN:VEVENT",
+                 f"UID:{event.id}@social-etl-scheduler",
+                 f"DTSTAMP:{_utc_stamp(approved_at)}",
+                 f"LAST-MODIFIED:{_utc_stamp(approved_at)}",
+                 f"SEQUENCE:{sequence}",
+                 ics_time("DTSTART", event.start_time, event.time_zone),
+                 ics_time("DTEND", event.end_time or event.start_time, event.time_zone)]
+    except (TypeError, ValueError):
+        return None
+    lines.append(f"SUMMARY:{escape(event.summary)}")
+    if event.location:
+        lines.append(f"LOCATION:{escape(event.location)}")
+    if event.description:
+        lines.append(f"DESCRIPTION:{escape(event.description)}")
+    if event.source_url:
+        lines.append(f"URL:{event.source_url}")
+    if event.labels:
+        lines.append("CATEGORIES:" + ",".join(escape(label) for label in event.labels))
+    lines.extend(recurrence_line(line) for line in event.recurrence or [])
+    lines.append("END:VEVENT")
+    return "\r\n".join(fold(line) for line in lines)
+
+def _expired(event, cutoff):
+    """Ended before `cutoff` (a YYYY-MM-DD string). Recurring events stay."""
+    if event.recurrence:
+        return False
+    return ((event.end_time or event.start_time or "")[:10] or cutoff) < cutoff
+
+class ApprovedFeed:
+    """
+    Approved events of one tenant (None = the default household) with their
+    rendered VEVENTs and the feeds built from them.
+    """
+
+    def __init__(self, tenant=None):
+        self.tenant = tenant
+        self.lock = threading.Lock()
+        self._loaded = False
+        self._events = OrderedDict()   # id -> (PendingEvent, approved_at, sequence)
+        self._vevents = {}             # id -> VEVENT text
+        self._stored = {}              # id -> its approved_events.json entry
+        self._feeds = OrderedDict()    # filter key -> (version, body)
+        self.version = 0
+        self.updated_at = time.time()
+
+    def _in_tenant(self, fn, *args):
+        previous = get_active_tenant()
+        set_active_tenant(self.tenant)
+        try:
+            return fn(*args)
+        finally:
+            set_active_tenant(previous)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        state = self._in_tenant(load_approved_events)
+        self.version = state.get("version", 0)
+        self.updated_at = state.get("updated_at", self.updated_at)
+        for item in state.get("events", []):
+            event = PendingEvent.from_dict(item["event"])
+            self._put(event, item.get("approved_at", self.updated_at), item.get("sequence", 0))
+        if self._prune():
+            self._changed()
+
+    def _put(self, event, approved_at, sequence):
+        vevent = render_vevent(event, approved_at, sequence)
+        if vevent is None:
+            print(f"Feed: can't render approved event {event.id} ({event.start_time!r}), left out")
+            return
+        self._events.pop(event.id, None)
+        self._events[event.id] = (event, approved_at, sequence)
+        self._vevents[event.id] = vevent
+        self._stored[event.id] = {"event": event.to_dict(), "approved_at": approved_at, "sequence": sequence}
+
+    def _prune(self):
+        cutoff = (datetime.now() - timedelta(days=FEED_RETENTION_DAYS)).strftime("%Y-%m-%d")
+        expired = [event_id for event_id, (event, _, _) in self._events.items() if _expired(event, cutoff)]
+        for event_id in expired:
+            del self._events[event_id]
+            del self._vevents[event_id]
+            del self._stored[event_id]
+        return len(expired)
+
+    def _changed(self):
+        self.version += 1
+        self.updated_at = time.time()
+        self._feeds.clear()
+        state = {
+            "version": self.version,
+            "updated_at": self.updated_at,
+            "events": [self._stored[event_id] for event_id in self._events],
+        }
+        self._in_tenant(save_approved_events, state)
+
+    def add(self, event):
+        """Records an approved event. Approving the same id again replaces it (with a higher SEQUENCE)."""
+        with self.lock:
+            self._ensure_loaded()
+            previous = self._events.get(event.id)
+            self._put(event, time.time(), previous[2] + 1 if previous else 0)
+            self._prune()
+            self._changed()
+
+    def __len__(self):
+        with self.lock:
+            self._ensure_loaded()
+            return len(self._events)
+
+    @staticmethod
+    def _key(child):
+        return (child or "").strip().lower()
+
+    def validators(self, child=None):
+        """(ETag, Last-Modified datetime) of the feed for `child`, without rendering it."""
+        with self.lock:
+            self._ensure_loaded()
+            tag = hashlib.sha1(f"{self._key(child)}:{self.version}:{self.updated_at}".encode()).hexdigest()[:16]
+            return tag, datetime.fromtimestamp(int(self.updated_at), timezone.utc)
+
+    def render(self, child=None):
+        """The VCALENDAR text, only events labelled `child` if given (case-insensitive)."""
+        key = self._key(child)
+        with self.lock:
+            self._ensure_loaded()
+            cached = self._feeds.get(key)
+            if cached and cached[0] == self.version:
+                return cached[1]
+            ids = [event_id for event_id, (event, _, _) in self._events.items()
+                   if not key or key in (label.lower() for label in event.labels or ())]
+            name = FEED_NAME + (f" - {child.strip()}" if key else "")
+            body = "\r\n".join(["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{PRODID}", "CALSCALE:GREGORIAN",
+                                "METHOD:PUBLISH", fold(f"X-WR-CALNAME:{escape(name)}"), "X-WR-TIMEZONE:Europe/London",
+                                LONDON_VTIMEZONE]
+                               + [self._vevents[event_id] for event_id in ids]
+                               + ["END:VCALENDAR"]) + "\r\n"
+            self._feeds[key] = (self.version, body)
+            while len(self._feeds) > MAX_CACHED_FEEDS:
+                self._feeds.popitem(last=False)
+            return body
+
+# One feed per tenant id, created on first use
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+def get_feed(tenant=None):
+    key = tenant.id if tenant is not None else None
+    with _feeds_lock:
+        if key not in _feeds:
+            _feeds[key] = ApprovedFeed(tenant)
+        return _feeds[key]
@@ -0,0 +1,257 @@
+"""
+iCalendar (RFC 5545) fast path.
+
+Invites from Spond, Outlook, Google Calendar and most school systems carry a
+text/calendar part or an .ics attachment with the exact event in it.
+gmail_client collects those parts and their VEVENTs become CandidateEvents
+directly - no date regexes, no Gemini call.
+
+Handled: folded lines, escaped text, DTSTART/DTEND in a TZID (IANA or
+Windows zone names), UTC or as all-day dates, DURATION, RRULE/RDATE/EXDATE
+(passed on as the Calendar event's `recurrence`), RECURRENCE-ID overrides
+(their own event, excluded from the series) and cancellations (left out;
+calendar_cancellations lists them, so a cancelled invite is never read as
+text).
+"""
+import os
+import re
+from datetime import datetime, timedelta
+
+from records import CandidateEvent
+
+DEFAULT_TIME_ZONE = "Europe/London"
+
+# MIME types a calendar part may come as (besides any *.ics attachment)
+CALENDAR_TYPES = ("text/calendar", "application/ics", "text/x-vcalendar")
+
+# Calendar text parsed per part; invites are a few KB
+MAX_ICS_BYTES = int(os.getenv("MAX_ICS_BYTES", "262144"))
+
+# Outlook writes Windows zone names in TZID
+WINDOWS_ZONES = {
+    "GMT Standard Time": "Europe/London",
+    "Greenwich Standard Time": "Atlantic/Reykjavik",
+    "W. Europe Standard Time": "Europe/Berlin",
+    "Romance Standard Time": "Europe/Paris",
+    "Central Europe Standard Time": "Europe/Budapest",
+    "E. Europe Standard Time": "Europe/Chisinau",
+    "Eastern Standard Time": "America/New_York",
+    "Pacific Standard Time": "America/Los_Angeles",
+    "UTC": "UTC",
+}
+
+ISO_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+_NAME = re.compile(r'[A-Za-z0-9-]+')
+_PARAM = re.compile(r';([A-Za-z0-9-]+)=("[^"]*"|[^;:]*)')
+_ESCAPE = re.compile(r'\\([\\;,nN])')
+_DURATION = re.compile(r'([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+
+def is_calendar_part(mime_type, filename=""):
+    return (mime_type or "").lower() in CALENDAR_TYPES or (filename or "").lower().endswith(".ics")
+
+def unfold_lines(text):
+    """Content lines with RFC 5545 folding (CRLF + space/tab) undone."""
+    lines = []
+    for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        if line[:1] in (" ", "\t") and lines:
+            lines[-1] += line[1:]
+        elif line:
+            lines.append(line)
+    return lines
+
+def parse_property(line):
+    """'DTSTART;TZID=Europe/London:20260111T100000' -> ('DTSTART', {'TZID': 'Europe/London'}, '20260111T100000')"""
+    match = _NAME.match(line)
+    if not match:
+        return None
+    pos = match.end()
+    params = {}
+    while True:
+        param = _PARAM.match(line, pos)
+        if not param:
+            break
+        params[param.group(1).upper()] = param.group(2).strip('"')
+        pos = param.end()
+    if line[pos:pos + 1] != ":":
+        return None
+    return match.group(0).upper(), params, line[pos + 1:]
+
+def unescape(value):
+    return _ESCAPE.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+def parse_calendar(text):
+    """
+    Returns (METHOD, [VEVENT]) for one calendar. Each VEVENT maps a property
+    name to its [(params, value)]; nested VALARMs and VTIMEZONEs are skipped.
+    """
+    method = None
+    events = []
+    stack = []
+    for line in unfold_lines(text[:MAX_ICS_BYTES]):
+        prop = parse_property(line)
+        if prop is None:
+            continue
+        name, params, value = prop
+        if name == "BEGIN":
+            stack.append(value.strip().upper())
+            if stack[-1] == "VEVENT":
+                events.append({})
+        elif name == "END":
+            if stack:
+                stack.pop()
+        elif stack and stack[-1] == "VEVENT":
+            events[-1].setdefault(name, []).append((params, value))
+        elif stack == ["VCALENDAR"] and name == "METHOD":
+            method = value.strip().upper()
+    return method, events
+
+# IANA name (or None) per TZID seen
+_zone_cache = {}
+
+def _zone(tzid):
+    if tzid not in _zone_cache:
+        name = WINDOWS_ZONES.get(tzid.strip().lstrip("/"), tzid.strip().lstrip("/"))
+        try:
+            from zoneinfo import ZoneInfo
+            ZoneInfo(name)
+            _zone_cache[tzid] = name
+        except Exception:
+            _zone_cache[tzid] = None
+    return _zone_cache[tzid]
+
+def _convert(moment, from_zone, to_zone):
+    """Re-expresses a naive local time in another zone. Unchanged if zone data isn't available."""
+    if from_zone == to_zone:
+        return moment
+    try:
+        from zoneinfo import ZoneInfo
+        return moment.replace(tzinfo=ZoneInfo(from_zone)).astimezone(ZoneInfo(to_zone)).replace(tzinfo=None)
+    except Exception:
+        return moment
+
+def parse_ics_time(params, value):
+    """
+    Returns (naive datetime, zone, all_day). UTC times are converted to
+    DEFAULT_TIME_ZONE; floating times and unknown TZIDs are taken as DEFAULT_TIME_ZONE.
+    """
+    value = value.strip()
+    if params.get("VALUE", "").upper() == "DATE" or len(value) == 8:
+        return datetime.strptime(value[:8], "%Y%m%d"), None, True
+    moment = datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        return _convert(moment, "UTC", DEFAULT_TIME_ZONE), DEFAULT_TIME_ZONE, False
+    zone = _zone(params["TZID"]) if params.get("TZID") else None
+    return moment, zone or DEFAULT_TIME_ZONE, False
+
+def parse_duration(value):
+    match = _DURATION.match(value.strip())
+    if not match:
+        return None
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                      minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -delta if sign == "-" else delta
+
+def _first(vevent, name):
+    values = vevent.get(name)
+    return values[0] if values else ({}, "")
+
+def _text(vevent, name):
+    return unescape(_first(vevent, name)[1]).strip()
+
+def _recurrence_line(name, params, value):
+    return name + "".join(f";{key}={val}" for key, val in params.items()) + ":" + value.strip()
+
+def vevent_times(vevent):
+    """(start, end, zone) as Calendar-ready strings: 'YYYY-MM-DDTHH:MM:SS', or 'YYYY-MM-DD' for all-day events."""
+    start, zone, all_day = parse_ics_time(*_first(vevent, "DTSTART"))
+    if "DTEND" in vevent:
+        end, end_zone, _ = parse_ics_time(*_first(vevent, "DTEND"))
+        if not all_day and end_zone != zone:
+            end = _convert(end, end_zone, zone)
+    elif "DURATION" in vevent and parse_duration(_first(vevent, "DURATION")[1]) is not None:
+        end = start + parse_duration(_first(vevent, "DURATION")[1])
+    else:
+        end = start + (timedelta(days=1) if all_day else timedelta(hours=1))
+    if all_day:
+        return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), DEFAULT_TIME_ZONE
+    return start.strftime(ISO_FORMAT), end.strftime(ISO_FORMAT), zone
+
+def parse_vevents(text, msg_id=None, fallback_title="School Event", cancelled=False):
+    """
+    CandidateEvents for the VEVENTs in one calendar part. Cancelled events are
+    left out - or, with `cancelled`, are the only ones returned.
+    """
+    method, vevents = parse_calendar(text)
+    gmail_url = f"https://mail.google.com/mail/u/0/#inbox/{msg_id}" if msg_id else None
+
+    # Overridden or cancelled instances come out of their series
+    exclusions = {}
+    for vevent in vevents:
+        if "RECURRENCE-ID" in vevent:
+            params, value = _first(vevent, "RECURRENCE-ID")
+            exclusions.setdefault(_text(vevent, "UID"), []).append(_recurrence_line("EXDATE", params, value))
+
+    candidates = []
+    for vevent in vevents:
+        if "DTSTART" not in vevent:
+            continue
+        is_cancelled = method == "CANCEL" or _text(vevent, "STATUS").upper() == "CANCELLED"
+        if is_cancelled != cancelled:
+            continue
+        try:
+            start, end, zone = vevent_times(vevent)
+        except ValueError:
+            continue
+
+        uid = _text(vevent, "UID")
+        recurrence_id = _first(vevent, "RECURRENCE-ID")[1].strip()
+        recurrence = None
+        if not recurrence_id:
+            recurrence = [_recurrence_line(name, params, value)
+                          for name in ("RRULE", "RDATE", "EXDATE") for params, value in vevent.get(name, [])]
+            if recurrence:
+                recurrence += exclusions.get(uid, [])
+        description = _text(vevent, "DESCRIPTION")
+        if len(description) > 500:
+            description = description[:500] + "..."
+
+        candidates.append(CandidateEvent(
+            event_title=_text(vevent, "SUMMARY") or fallback_title,
+            start_time=start,
+            end_time=end,
+            location=_text(vevent, "LOCATION"),
+            description="\n\n".join(text for text in (description, gmail_url and f"Source: {gmail_url}") if text),
+            gmail_url=gmail_url,
+            # The invite's UID keeps a re-sent or updated invite on the same calendar entry
+            source_id=(f"ics:{uid}" + (f":{recurrence_id}" if recurrence_id else "")) if uid else msg_id,
+            confidence=1.0,
+            time_zone=zone,
+            recurrence=recurrence or None,
+        ))
+    return candidates
+
+def calendar_candidates(email):
+    """
+    CandidateEvents from all of a Message's calendar parts. The same invite
+    often comes both inline and as an attachment; each event is kept once.
+    """
+    seen = {}
+    for text in email.calendar:
+        for candidate in parse_vevents(text, email.id, email.subject):
+            candidate.message = email
+            seen.setdefault((candidate.source_id, candidate.event_title), candidate)
+    return list(seen.values())
+
+def calendar_cancellations(email):
+    """
+    The cancelled events in a Message's calendar parts (same ids as the
+    original invite's). An email carrying only these is a cancellation
+    notice: nothing to queue, and nothing for the text extractors to read.
+    """
+    seen = {}
+    for text in email.calendar:
+        for candidate in parse_vevents(text, email.id, email.subject, cancelled=True):
+            seen.setdefault((candidate.source_id, candidate.event_title), candidate)
+    return list(seen.values())
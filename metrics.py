@@ -0,0 +1,263 @@
+"""
+Lightweight run instrumentation: stage timers, call counters and histograms.
+
+    with metrics.stage("gmail_fetch"): ...
+    @metrics.timed("load_config")
+    metrics.inc("gmail.messages.get")
+
+Each pipeline run gets its own RunMetrics (start_run/finish_run) which is
+persisted with the run record; a process-lifetime registry backs /api/metrics.
+Anything recorded with no run in scope also goes to an explicit "unscoped"
+entry (with a one-off warning per name), so a timer missing from a run
+record can be found there.
+"""
+import functools
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+# Seconds. Covers everything from a regex pass to a rate-limit sleep / slow Gemini call.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Raw samples kept per histogram for percentile reporting
+MAX_SAMPLES = 5000
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            # Keep a rolling window rather than only the first N samples
+            self.samples[self.count % MAX_SAMPLES] = value
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": round(self.max, 6),
+            "p50": round(self.percentile(50), 6),
+            "p95": round(self.percentile(95), 6),
+            "p99": round(self.percentile(99), 6),
+            "buckets": {str(b): c for b, c in zip(self.buckets, self.bucket_counts)}
+        }
+
+class RunMetrics:
+    """Timers and counters for one scope (a pipeline run, or the whole process)."""
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id
+        self.started_at = time.time()
+        self.finished_at = None
+        self.timers = {}
+        self.counters = {}
+        self.peaks = {}
+        self.reports = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            hist = self.timers.get(name)
+            if hist is None:
+                hist = self.timers[name] = Histogram()
+            hist.observe(seconds)
+
+    def inc(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_peak(self, name, peak_bytes):
+        with self.lock:
+            self.peaks[name] = max(self.peaks.get(name, 0), peak_bytes)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "run_id": self.run_id,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "duration": round((self.finished_at or time.time()) - self.started_at, 3),
+                "timers": {name: h.to_dict() for name, h in self.timers.items()},
+                "counters": dict(self.counters),
+                "peak_memory_bytes": dict(self.peaks),
+                "reports": dict(self.reports)
+            }
+
+# Process-lifetime totals (served to Prometheus) and the runs in progress.
+# Runs are bound per thread so concurrent tenant runs don't mix; threads that
+# never called start_run/bind_run fall back to the most recently started run.
+_totals = RunMetrics(run_id="process")
+_unscoped = RunMetrics(run_id="unscoped")
+_unscoped_warned = set()
+_local = threading.local()
+_current_run = None
+_last_run = None
+
+def _active_run():
+    return getattr(_local, "run", None) or _current_run
+
+def start_run(run_id=None):
+    """Begins a new per-run scope bound to this thread. Returns its run id."""
+    global _current_run
+    run = RunMetrics(run_id=run_id or uuid.uuid4().hex[:12])
+    _local.run = run
+    _current_run = run
+    return run.run_id
+
+def finish_run():
+    """Closes this thread's run scope and returns its snapshot (or None if no run is active)."""
+    global _current_run, _last_run
+    run = _active_run()
+    if run is None:
+        return None
+    run.finished_at = time.time()
+    _last_run = run.snapshot()
+    _local.run = None
+    if _current_run is run:
+        _current_run = None
+    return _last_run
+
+def current_run():
+    """The RunMetrics of this thread's run - hand it to bind_run() in helper threads."""
+    return _active_run()
+
+def bind_run(run):
+    """Attributes this (helper) thread's observations to `run`."""
+    _local.run = run
+
+def current_run_id():
+    run = _active_run()
+    return run.run_id if run else None
+
+def current_stage():
+    """The innermost stage() this thread is in, or None."""
+    return getattr(_local, "stage", None)
+
+def last_run():
+    return _last_run
+
+def unscoped():
+    """Snapshot of the timers/counters recorded while no run was in scope."""
+    return _unscoped.snapshot()
+
+def _warn_unscoped(kind, name):
+    if name not in _unscoped_warned:
+        _unscoped_warned.add(name)
+        print(f"Metrics: {kind} '{name}' recorded outside a run; counted under 'unscoped'.")
+
+def attach(name, report):
+    """Stores a JSON-able report (e.g. per-term query hits) on this thread's run record."""
+    run = _active_run()
+    if run is not None:
+        with run.lock:
+            run.reports[name] = report
+
+def observe(name, seconds):
+    _totals.observe(name, seconds)
+    run = _active_run()
+    if run is not None:
+        run.observe(name, seconds)
+    else:
+        _warn_unscoped("timer", name)
+        _unscoped.observe(name, seconds)
+
+def inc(name, amount=1):
+    _totals.inc(name, amount)
+    run = _active_run()
+    if run is not None:
+        run.inc(name, amount)
+    else:
+        _warn_unscoped("counter", name)
+        _unscoped.inc(name, amount)
+
+@contextmanager
+def stage(name):
+    """
+    Times the enclosed block as stage `name`.
+    When tracemalloc is tracing (benchmarks only) the stage's peak memory is
+    recorded too; nested stages reset the peak, so outer values are approximate.
+    """
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    outer = getattr(_local, "stage", None)
+    _local.stage = name
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.stage = outer
+        observe(name, time.perf_counter() - start)
+        run = _active_run()
+        if tracing and run is not None:
+            run.record_peak(name, tracemalloc.get_traced_memory()[1])
+
+def timed(name=None):
+    """Decorator form of stage(); defaults to the function name."""
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_prometheus():
+    """Renders process totals, plus the last run's stage sums, in Prometheus text format."""
+    lines = [
+        "# HELP etl_stage_duration_seconds Time spent per pipeline stage.",
+        "# TYPE etl_stage_duration_seconds histogram"
+    ]
+    with _totals.lock:
+        for name, hist in sorted(_totals.timers.items()):
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.bucket_counts):
+                cumulative += count
+                lines.append(f'etl_stage_duration_seconds_bucket{{stage="{_label(name)}",le="{bound}"}} {cumulative}')
+            lines.append(f'etl_stage_duration_seconds_bucket{{stage="{_label(name)}",le="+Inf"}} {hist.count}')
+            lines.append(f'etl_stage_duration_seconds_sum{{stage="{_label(name)}"}} {hist.sum:.6f}')
+            lines.append(f'etl_stage_duration_seconds_count{{stage="{_label(name)}"}} {hist.count}')
+
+        lines.append("# HELP etl_calls_total External API calls and other counted operations.")
+        lines.append("# TYPE etl_calls_total counter")
+        for name, value in sorted(_totals.counters.items()):
+            lines.append(f'etl_calls_total{{name="{_label(name)}"}} {value}')
+
+    last = _last_run
+    if last:
+        lines.append("# HELP etl_last_run_duration_seconds Wall time of the most recent pipeline run.")
+        lines.append("# TYPE etl_last_run_duration_seconds gauge")
+        lines.append(f'etl_last_run_duration_seconds {last["duration"]}')
+        lines.append("# HELP etl_last_run_stage_seconds Time per stage in the most recent pipeline run.")
+        lines.append("# TYPE etl_last_run_stage_seconds gauge")
+        for name, hist in sorted(last["timers"].items()):
+            lines.append(f'etl_last_run_stage_seconds{{stage="{_label(name)}"}} {hist["sum"]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,187 @@
+"""
+Near-duplicate notices, collapsed before extraction.
+
+Schools send the same notice to each class list and reminders repeat the
+original with small edits. Each email's normalized subject + body is cut
+into word shingles and summarised as a MinHash signature; an LSH index
+(BANDS bands of ROWS values) finds the candidates and the estimated
+Jaccard similarity decides. Only emails mentioning the same dates and
+times can match - a reminder that moves the date is a new notice.
+
+Within a run each cluster is processed once, through its newest email
+(Gmail lists newest first), with the other members' message ids kept on the
+queued event. Representatives are remembered for NEAR_DUPLICATE_DAYS, so a
+copy arriving in a later run is skipped - but only once they have been
+processed (remember_near_duplicates): a representative deferred to a later
+run (priority.py), or in a run that failed, must not make its copies look
+handled. Emails carrying an invite are left alone - ics_parser keys those
+on the invite UID already.
+"""
+import hashlib
+import os
+import re
+import struct
+import time
+
+from state_manager import load_near_duplicates, save_near_duplicates
+
+# Estimated Jaccard similarity at which two emails count as the same notice (above 1 turns dedupe off)
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+
+# How long (and how many) representatives are remembered across runs
+NEAR_DUPLICATE_DAYS = float(os.getenv("NEAR_DUPLICATE_DAYS", "30"))
+NEAR_DUPLICATE_MAX_STORED = int(os.getenv("NEAR_DUPLICATE_MAX_STORED", "5000"))
+
+# Text compared per email - notices say what they are near the top
+DEDUPE_MAX_CHARS = int(os.getenv("DEDUPE_MAX_CHARS", "2000"))
+
+SHINGLE_WORDS = 5
+# One 64-byte blake2b digest per shingle gives all 32 16-bit hash values
+NUM_HASHES = 32
+BANDS = 8
+ROWS = NUM_HASHES // BANDS
+_UNPACK = struct.Struct(f"<{NUM_HASHES}H").unpack
+
+_TAGS = re.compile(r'<(style|script)[^>]*>.*?</\1>|<[^>]+>', re.IGNORECASE | re.DOTALL)
+_QUOTED = re.compile(r'^\s*>.*$|^\s*on .{0,200} wrote:\s*$', re.IGNORECASE | re.MULTILINE)
+_WORD = re.compile(r"[a-z0-9]+(?:['.:/][a-z0-9]+)*")
+_MOMENT = re.compile(
+    r'\b\d{1,2}(?:st|nd|rd|th)?\.?\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*'
+    r'|\b\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?\b|\b\d{1,2}[:.]\d{2}\b|\b\d{1,2}\s*[ap]m\b'
+    r'|\b(?:mon|tues|wednes|thurs|fri|satur|sun)day\b|\b(?:tomorrow|tonight)\b')
+
+def normalize(subject, body):
+    """Lowercased subject + body without markup, quoted replies or extra whitespace."""
+    text = _TAGS.sub(" ", body or "")
+    text = _QUOTED.sub("", text)
+    return re.sub(r'\s+', ' ', f"{subject or ''} {text}".lower()).strip()[:DEDUPE_MAX_CHARS]
+
+def date_key(text):
+    """The dates and times a normalized text mentions, as one comparable string."""
+    return "|".join(sorted({re.sub(r'\s+', ' ', m) for m in _MOMENT.findall(text)}))
+
+def shingles(text):
+    words = _WORD.findall(text)
+    if len(words) <= SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def signature(shingle_set):
+    """MinHash signature: per hash value, the minimum over all shingles."""
+    rows = [_UNPACK(hashlib.blake2b(s.encode(), digest_size=64).digest()) for s in shingle_set]
+    return tuple(min(column) for column in zip(*rows))
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return sum(x == y for x, y in zip(a, b)) / NUM_HASHES
+
+def _bands(sig, key):
+    return [(band, key, sig[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+class NearDuplicateIndex:
+    """
+    LSH index over cluster representatives: this run's and, marked `previous`,
+    those remembered from earlier runs.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+        self.buckets = {}
+        self.entries = []
+
+    def add(self, entry):
+        self.entries.append(entry)
+        for band in _bands(entry["sig"], entry["dates"]):
+            self.buckets.setdefault(band, []).append(entry)
+
+    def match(self, sig, key):
+        """The most similar representative at or above the threshold, or None."""
+        best, best_score = None, self.threshold
+        seen = set()
+        for band in _bands(sig, key):
+            for entry in self.buckets.get(band, ()):
+                if id(entry) in seen:
+                    continue
+                seen.add(id(entry))
+                score = similarity(sig, entry["sig"])
+                if score >= best_score:
+                    best, best_score = entry, score
+        return best
+
+def collapse_near_duplicates(emails, remember=True):
+    """
+    Returns (representatives, members, report, state). `members` maps each
+    representative's id to the ids of the emails it stands for; emails
+    matching a notice handled in an earlier run are dropped. Nothing is saved
+    here: pass `state` to remember_near_duplicates once the run has processed
+    the representatives (None when `remember` is off).
+    """
+    now = time.time()
+    index = NearDuplicateIndex()
+    if index.threshold > 1:
+        return list(emails), {}, {"emails": len(emails), "clusters": len(emails), "collapsed": 0, "cross_run": 0,
+                                  "largest_cluster": 1 if emails else 0, "dedupe_ratio": 0.0,
+                                  "threshold": index.threshold}, None
+    stored = load_near_duplicates() if remember else []
+    for entry in stored:
+        if now - entry.get("seen_at", 0) <= NEAR_DUPLICATE_DAYS * 86400:
+            index.add({"id": entry["id"], "sig": tuple(entry["sig"]), "dates": entry["dates"],
+                       "members": entry.get("members", []), "seen_at": entry["seen_at"], "previous": True,
+                       "stored": True})
+
+    previous = {entry["id"]: entry for entry in index.entries}
+    representatives = []
+    members = {}
+    cross_run = 0
+    for email in emails:
+        text = normalize(email.subject, email.body) if not email.calendar else ""
+        shingle_set = shingles(text)
+        if not shingle_set:
+            representatives.append(email)
+            continue
+        if email.id in previous and previous[email.id]["previous"]:
+            # The lookback window overlaps the last run: the same message again, processed as before
+            previous[email.id]["previous"] = False
+            previous[email.id]["seen_at"] = now
+            representatives.append(email)
+            continue
+        sig = signature(shingle_set)
+        key = date_key(text)
+        entry = index.match(sig, key)
+        if entry is None:
+            index.add({"id": email.id, "sig": sig, "dates": key, "members": [], "seen_at": now, "previous": False})
+            representatives.append(email)
+        elif entry["previous"]:
+            cross_run += 1
+            entry["seen_at"] = now
+            if email.id not in entry["members"]:
+                entry["members"].append(email.id)
+        else:
+            entry["members"].append(email.id)
+            members.setdefault(entry["id"], []).append(email.id)
+
+    collapsed = sum(len(ids) for ids in members.values())
+    report = {
+        "emails": len(emails),
+        "clusters": len(representatives),
+        "collapsed": collapsed,
+        "cross_run": cross_run,
+        "largest_cluster": 1 + max((len(ids) for ids in members.values()), default=0),
+        "dedupe_ratio": round((collapsed + cross_run) / len(emails), 4) if emails else 0.0,
+        "threshold": index.threshold,
+    }
+    return representatives, members, report, (index.entries if remember else None)
+
+def remember_near_duplicates(state, handled_ids):
+    """
+    Saves the representatives from earlier runs plus this run's that were
+    handled (`handled_ids`: processed, not deferred). The others are
+    forgotten, so their copies are collapsed into them again next time.
+    """
+    if state is None:
+        return
+    handled_ids = set(handled_ids)
+    kept = [e for e in state if e.get("stored") or e["id"] in handled_ids]
+    kept = sorted(kept, key=lambda e: -e["seen_at"])[:NEAR_DUPLICATE_MAX_STORED]
+    save_near_duplicates([{"id": e["id"], "sig": list(e["sig"]), "dates": e["dates"],
+                           "members": e["members"][-50:], "seen_at": e["seen_at"]} for e in kept])
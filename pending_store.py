@@ -0,0 +1,102 @@
+"""
+Indexed in-memory store for the approval queue and the recent-events history.
+
+Pending events (records.PendingEvent) are kept in one dict by id, whose
+insertion order is discovery order, so add, approve and reject are O(1).
+There is no separate start-time index to keep in step: between() filters
+the queue and sorts only the events in range, which the dashboard asks for
+far less often than events change. Every change happens under one lock, so
+concurrent request threads and tenant workers can't interleave
+half-applied transitions.
+
+Ids that were approved or rejected are remembered (the last RESOLVED_LIMIT
+of them) so a later run re-finding the same event doesn't queue it again.
+"""
+import threading
+from collections import OrderedDict
+
+# Status-tagged events kept for the dashboard history
+HISTORY_LIMIT = 50
+
+# Approved/rejected ids remembered so they aren't queued again
+RESOLVED_LIMIT = 10000
+
+def _start_key(event):
+    # ISO-8601 strings in one format sort chronologically
+    return event.start_time or ""
+
+class PendingStore:
+    def __init__(self, history_limit=HISTORY_LIMIT, resolved_limit=RESOLVED_LIMIT):
+        self.lock = threading.Lock()
+        self.history_limit = history_limit
+        self.resolved_limit = resolved_limit
+        self._pending = {}                 # id -> event, oldest first
+        self._history = OrderedDict()      # id -> event, oldest first
+        self._resolved = OrderedDict()     # id -> APPROVED/REJECTED, oldest first
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _record(self, event, status_tag):
+        # The history holds the same record as the queue, tagged in place
+        event.status_tag = status_tag
+        self._history.pop(event.id, None)
+        self._history[event.id] = event
+        while len(self._history) > self.history_limit:
+            self._history.popitem(last=False)
+
+    def add(self, event):
+        """
+        Queues `event` unless one with its id is already pending or was
+        already approved/rejected. Returns True if it was added.
+        """
+        with self.lock:
+            event_id = event.id
+            if event_id in self._pending or event_id in self._resolved:
+                return False
+            self._pending[event_id] = event
+            self._record(event, "PENDING")
+            return True
+
+    def get(self, event_id):
+        with self.lock:
+            return self._pending.get(event_id)
+
+    def resolve(self, event_id, status_tag):
+        """
+        Atomically removes a pending event and tags it in the history
+        (APPROVED/REJECTED). Returns the event, or None if it wasn't pending.
+        """
+        with self.lock:
+            event = self._pending.pop(event_id, None)
+            if event is None:
+                return None
+            self._resolved.pop(event_id, None)
+            self._resolved[event_id] = status_tag
+            while len(self._resolved) > self.resolved_limit:
+                self._resolved.popitem(last=False)
+            self._record(event, status_tag)
+            return event
+
+    def status(self, event_id):
+        """The latest status tag for an event in the history or the resolved ids, else None."""
+        with self.lock:
+            entry = self._history.get(event_id)
+            return entry.status_tag if entry else self._resolved.get(event_id)
+
+    def pending(self):
+        """Pending events, most recently discovered first."""
+        with self.lock:
+            return list(reversed(self._pending.values()))
+
+    def between(self, start=None, end=None):
+        """Pending events starting in [start, end), in start order. Bounds are ISO datetime strings."""
+        with self.lock:
+            found = [event for event in self._pending.values()
+                     if (not start or _start_key(event) >= start) and (not end or _start_key(event) < end)]
+        return sorted(found, key=lambda event: (_start_key(event), event.id))
+
+    def history(self):
+        """Status-tagged recent events, newest first."""
+        with self.lock:
+            return list(reversed(self._history.values()))
@@ -0,0 +1,257 @@
+"""
+Deterministic extractors for the portal page types we know the layout of.
+Each layout is a set of simple selectors ("tag.class", ".class" or "tag",
+comma separated for alternatives). A page that matches a layout's URL but
+not its list container, or with any listed item that doesn't parse, returns
+None so the caller can fall back to the LLM agent - a partial result would
+get the page's fingerprint committed and the rest never looked at again.
+
+Only pages that list events with their own date are here. Notices and the
+newsfeed only carry a posting date, with the event date (if any) somewhere
+in the text, so they stay with the agent.
+
+The layouts are checked against the pages in tests/fixtures/portal; run
+`python portal_extractors.py <url> <saved.html>` on a freshly saved page
+after markup changes.
+"""
+import re
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+
+LAYOUTS = [
+    {
+        "name": "weduc_calendar",
+        "url": r"app\.weduc\.co\.uk/calendar/event",
+        "container": ".calendar-events, .event-list, #calendar-list",
+        "item": ".calendar-event, .event-item, li.event",
+        "title": ".event-title, .title, h3, h4",
+        "date": "time, .event-date, .date",
+        "location": ".event-location, .location",
+        "description": ".event-description, .description",
+    },
+    {
+        "name": "schoolcloud_home",
+        "url": r"schoolcloud\.co\.uk/Parent",
+        "container": ".event-list, .appointments, #events",
+        "item": ".event, .appointment, .panel",
+        "title": ".event-name, .panel-heading, .title, h3, h4",
+        "date": "time, .event-date, .date",
+        "location": ".event-location, .location",
+        "description": ".event-description, .panel-body, .description",
+    },
+]
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12
+}
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+class Node:
+    __slots__ = ("tag", "attrs", "children", "parent")
+
+    def __init__(self, tag, attrs=None, parent=None):
+        self.tag = tag
+        self.attrs = attrs or {}
+        self.children = []
+        self.parent = parent
+
+    @property
+    def classes(self):
+        return (self.attrs.get("class") or "").split()
+
+    def text(self):
+        parts = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                parts.append(node)
+            else:
+                stack.extend(reversed(node.children))
+        return re.sub(r'\s+', ' ', " ".join(parts)).strip()
+
+class _TreeBuilder(HTMLParser):
+    """Builds a small Node tree, tolerating the unclosed tags real pages contain."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node("document")
+        self.current = self.root
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+            return
+        node = Node(tag, {k: (v or "") for k, v in attrs}, self.current)
+        self.current.children.append(node)
+        if tag not in VOID_TAGS:
+            self.current = node
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skip = max(0, self._skip - 1)
+            return
+        # Walk up to the matching open tag, closing anything left open inside it
+        node = self.current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self.current = node.parent
+
+    def handle_data(self, data):
+        if not self._skip and data.strip():
+            self.current.children.append(data)
+
+def parse_html(html):
+    builder = _TreeBuilder()
+    builder.feed(html or "")
+    builder.close()
+    return builder.root
+
+def _matches(node, simple_selector):
+    tag, _, cls = simple_selector.partition(".")
+    if simple_selector.startswith("#"):
+        return node.attrs.get("id") == simple_selector[1:]
+    if tag and node.tag != tag:
+        return False
+    if cls and cls not in node.classes:
+        return False
+    return True
+
+def select(node, selector):
+    """Returns descendant nodes matching any of the comma separated simple selectors, in document order."""
+    options = [s.strip() for s in selector.split(",") if s.strip()]
+    found = []
+    stack = [c for c in reversed(node.children) if not isinstance(c, str)]
+    while stack:
+        child = stack.pop()
+        if any(_matches(child, s) for s in options):
+            found.append(child)
+        stack.extend(c for c in reversed(child.children) if not isinstance(c, str))
+    return found
+
+def select_one(node, selector):
+    # Try each alternative in priority order rather than document order
+    for option in selector.split(","):
+        matches = select(node, option)
+        if matches:
+            return matches[0]
+    return None
+
+def parse_portal_datetime(text):
+    """
+    Parses the date formats the portals render, e.g.
+    '2026-01-12T09:00', 'Mon 12 Jan 2026 09:00 - 10:30', '12/01/2026 15:15'.
+    Returns (start_iso, end_iso) or None.
+    """
+    if not text:
+        return None
+    text = text.strip()
+
+    iso = re.match(r'(\d{4})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2}))?', text)
+    if iso:
+        year, month, day = int(iso.group(1)), int(iso.group(2)), int(iso.group(3))
+    else:
+        named = re.search(r'(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]{3,9})\.?,?\s*(\d{4})?', text)
+        numeric = re.search(r'(\d{1,2})/(\d{1,2})/(\d{2,4})', text)
+        if named and named.group(2)[:3].lower() in MONTHS:
+            day, month = int(named.group(1)), MONTHS[named.group(2)[:3].lower()]
+            year = int(named.group(3)) if named.group(3) else datetime.now().year
+        elif numeric:
+            day, month, year = int(numeric.group(1)), int(numeric.group(2)), int(numeric.group(3))
+            if year < 100: year += 2000
+        else:
+            return None
+
+    try:
+        date = datetime(year, month, day)
+    except ValueError:
+        return None
+
+    times = re.findall(r'(\d{1,2})[:.](\d{2})\s*(am|pm)?', text[iso.end(3):] if iso else text, re.IGNORECASE)
+
+    def to_time(match):
+        hour, minute, meridiem = int(match[0]), int(match[1]), match[2].lower()
+        if meridiem == "pm" and hour < 12: hour += 12
+        if meridiem == "am" and hour == 12: hour = 0
+        return hour, minute
+
+    if iso and iso.group(4):
+        start_h, start_m = int(iso.group(4)), int(iso.group(5))
+    elif times:
+        start_h, start_m = to_time(times[0])
+    else:
+        start_h, start_m = 9, 0
+
+    start = date.replace(hour=start_h, minute=start_m)
+    if len(times) > 1 and not (iso and iso.group(4)):
+        end_h, end_m = to_time(times[1])
+        end = date.replace(hour=end_h, minute=end_m)
+        if end <= start:
+            end += timedelta(days=1)  # runs past midnight
+    else:
+        end = start + timedelta(hours=1)
+    return start.strftime("%Y-%m-%dT%H:%M:%S"), end.strftime("%Y-%m-%dT%H:%M:%S")
+
+def find_layout(url):
+    for layout in LAYOUTS:
+        if re.search(layout["url"], url or ""):
+            return layout
+    return None
+
+def extract_known_layout(url, html):
+    """
+    Extracts events from a page with a known layout.
+    Returns a list of event dicts (empty only for an empty list), or None if
+    the page isn't a recognised layout - or no longer parses as one - and
+    should go to the LLM agent instead.
+    """
+    layout = find_layout(url)
+    if not layout:
+        return None
+
+    root = parse_html(html)
+    container = select_one(root, layout["container"])
+    if container is None:
+        # Layout changed or we got an unexpected page - let the agent handle it
+        return None
+
+    items = select(container, layout["item"])
+    events = []
+    for item in items:
+        title_node = select_one(item, layout["title"])
+        date_node = select_one(item, layout["date"])
+        if not title_node or not date_node:
+            return None
+
+        when = parse_portal_datetime(date_node.attrs.get("datetime") or date_node.text())
+        if not when:
+            return None
+
+        location_node = select_one(item, layout["location"])
+        description_node = select_one(item, layout["description"])
+        events.append({
+            "event_title": title_node.text(),
+            "start_time": when[0],
+            "end_time": when[1],
+            "location": location_node.text() if location_node else "",
+            "description": description_node.text() if description_node else "",
+            "subjects": [],
+            "source_url": url,
+            "source": "portal",
+            "extractor": layout["name"]
+        })
+    if not items and container.text():
+        # Something is listed but no item matched: the markup drifted
+        return None
+    return events
+
+if __name__ == "__main__":
+    # Run against a saved page: python portal_extractors.py <url> <saved.html>
+    import sys
+    import json
+    with open(sys.argv[2], encoding="utf-8") as f:
+        print(json.dumps(extract_known_layout(sys.argv[1], f.read()), indent=2))
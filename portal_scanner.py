@@ -1,72 +1,206 @@
 import os
 import asyncio
 import json
-from langchain_google_genai import ChatGoogleGenerativeAI
-from browser_use import Agent
+import re
+import hashlib
+import time
+from state_manager import load_portal_fingerprints, save_portal_fingerprints
+from portal_extractors import extract_known_layout
 
-async def scan_school_portal():
+PORTAL_URLS = [
+    "https://app.weduc.co.uk/notice/daily/index",
+    "https://app.weduc.co.uk/dashboard/newsfeed/list/user/281474978573967",
+    "https://app.weduc.co.uk/message/message/index/folder/281474987931452",
+    "https://app.weduc.co.uk/message/message/index/folder/281474987931456",
+    "https://app.weduc.co.uk/calendar/event/index",
+    "https://bishopgilpin.schoolcloud.co.uk/Parent/Home"
+]
+
+WEDUC_LOGIN_URL = "https://app.weduc.co.uk/"
+
+# Rough chars-per-token ratio, used to estimate the LLM tokens a skipped page would have cost.
+# The browser agent also sends DOM/screenshots, so this is a lower bound.
+CHARS_PER_TOKEN = 4
+
+# Text that changes between visits without the notice board changing
+VOLATILE_PATTERNS = [
+    re.compile(r'\b\d+\s+(?:second|minute|hour|day|week)s?\s+ago\b', re.IGNORECASE),
+    re.compile(r'\b(?:just now|yesterday|today)\b', re.IGNORECASE),
+    re.compile(r'\blast (?:login|logged in|seen)[^.|]*', re.IGNORECASE),
+]
+
+# Summary of the most recent scan, for logging / the dashboard
+last_scan_report = {}
+
+def extract_relevant_region(html):
     """
-    Scans the configured School Portal for new events using Browser Use.
-    Returns a list of event dictionaries similar to the email extractor.
+    Reduces a portal page to the text of its content region.
+    Drops scripts, styles, navigation chrome and hidden form tokens so that
+    session-specific noise doesn't change the fingerprint.
     """
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("Logistics Officer: GEMINI_API_KEY not set. Cannot use LLM for portal scan.")
-        return []
+    if not html:
+        return ""
+    text = re.sub(r'<(script|style|noscript|svg|head|nav|header|footer)[^>]*>.*?</\1>', ' ', html, flags=re.IGNORECASE|re.DOTALL)
+    text = re.sub(r'<input[^>]*type=["\']?hidden[^>]*>', ' ', text, flags=re.IGNORECASE)
 
-    # Try multiple models for rotation
-    models_to_try = ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-2.0-flash", "gemini-1.0-pro"]
-    last_err = ""
-    
-    for model_name in models_to_try:
+    # Prefer the <main> element if the page has one, otherwise the body
+    region = re.search(r'<main[^>]*>(.*)</main>', text, flags=re.IGNORECASE|re.DOTALL)
+    if not region:
+        region = re.search(r'<body[^>]*>(.*)</body>', text, flags=re.IGNORECASE|re.DOTALL)
+    if region:
+        text = region.group(1)
+
+    text = re.sub(r'<[^>]+>', ' ', text)
+    for pattern in VOLATILE_PATTERNS:
+        text = pattern.sub(' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+def compute_fingerprint(html):
+    """Returns (fingerprint, region_text) for a portal page."""
+    region = extract_relevant_region(html)
+    return hashlib.sha256(region.encode('utf-8')).hexdigest(), region
+
+def looks_like_login_page(html):
+    """A page with a password box means the session wasn't accepted - never fingerprint it."""
+    return bool(re.search(r'<input[^>]*type=["\']?password', html or "", re.IGNORECASE))
+
+async def fetch_portal_pages(urls, username, password):
+    """
+    Fetches the raw HTML of each portal URL with a logged-in headless browser.
+    Returns {url: html or None}. None means the page could not be fetched and
+    should be treated as changed.
+    """
+    from playwright.async_api import async_playwright
+
+    pages = {url: None for url in urls}
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
         try:
-            print(f"Logistics Officer: Attempting Portal Scan with {model_name}...")
-            llm = ChatGoogleGenerativeAI(model=model_name, google_api_key=api_key)
-            agent = Agent(task=task, llm=llm)
-            result = await agent.run()
-            final_output = result.final_result()
-            if final_output:
-                break
-        except Exception as e:
-            last_err = str(e)
-            print(f"Logistics Officer: Model {model_name} failed: {last_err}")
-            if "429" not in last_err and "quota" not in last_err.lower():
-                # If it's not a quota error, it might be a connectivity issue, try next
-                continue
-            continue
-    else:
-        print(f"Logistics Officer: All portal scan models failed. Last Error: {last_err}")
-        return []
+            page = await browser.new_page()
+
+            # Login to weduc once; the session cookie covers all app.weduc.co.uk pages
+            try:
+                await page.goto(WEDUC_LOGIN_URL, wait_until="domcontentloaded")
+                await page.fill('input[type="text"], input[type="email"]', username)
+                await page.fill('input[type="password"]', password)
+                await page.press('input[type="password"]', "Enter")
+                await page.wait_for_load_state("networkidle")
+            except Exception as e:
+                print(f"Logistics Officer: Portal login failed: {e}")
+
+            for url in urls:
+                try:
+                    await page.goto(url, wait_until="networkidle")
+                    html = await page.content()
+                    pages[url] = None if looks_like_login_page(html) else html
+                except Exception as e:
+                    print(f"Logistics Officer: Could not fetch {url}: {e}")
+        finally:
+            await browser.close()
+    return pages
+
+async def scan_school_portal(log_callback=print):
+    """
+    Scans the configured School Portal for new events.
+    Pages whose content fingerprint matches the last scan are skipped. Changed
+    pages with a known layout are parsed directly from the HTML; only the
+    rest are sent through the Browser Use LLM agent.
+    Returns a list of event dictionaries similar to the email extractor.
+    """
+    global last_scan_report
+
+    urls = list(PORTAL_URLS)
 
-    urls = [
-        "https://app.weduc.co.uk/notice/daily/index",
-        "https://app.weduc.co.uk/dashboard/newsfeed/list/user/281474978573967",
-        "https://app.weduc.co.uk/message/message/index/folder/281474987931452",
-        "https://app.weduc.co.uk/message/message/index/folder/281474987931456",
-        "https://app.weduc.co.uk/calendar/event/index",
-        "https://bishopgilpin.schoolcloud.co.uk/Parent/Home"
-    ]
-    
     # Allow override via env for flexibility, but default to known user URLs
     env_url = os.getenv("SCHOOL_PORTAL_URL")
     if env_url and env_url not in urls:
         urls.append(env_url)
 
-    all_events = []
-
-    all_urls = ", ".join(urls)
-    
     # Prepare auth context
     weduc_user = os.getenv("SCHOOL_USERNAME") or os.getenv("WEDUC_USERNAME")
     weduc_pass = os.getenv("SCHOOL_PASSWORD") or os.getenv("WEDUC_PASSWORD")
-    
-    auth_step = ""
-    if weduc_user and weduc_pass:
-        auth_step = f'First, login to app.weduc.co.uk using username "{weduc_user}" and password "{weduc_pass}".'
-    else:
+
+    if not (weduc_user and weduc_pass):
         print("Logistics Officer: No portal credentials found in .env")
         return []
 
+    auth_step = f'First, login to app.weduc.co.uk using username "{weduc_user}" and password "{weduc_pass}".'
+
+    # --- CHANGE DETECTION ---
+    try:
+        pages = await fetch_portal_pages(urls, weduc_user, weduc_pass)
+    except Exception as e:
+        log_callback(f"Logistics Officer: Page fetch failed, scanning all pages: {e}")
+        pages = {url: None for url in urls}
+
+    stored = load_portal_fingerprints()
+    now = time.time()
+    changed_urls = []
+    skipped_urls = []
+    new_fingerprints = {}
+    tokens_saved = 0
+
+    for url in urls:
+        html = pages.get(url)
+        if html is None:
+            # Unknown state - let the agent look at it
+            changed_urls.append(url)
+            continue
+
+        fingerprint, region = compute_fingerprint(html)
+        previous = stored.get(url, {})
+        if previous.get("fingerprint") == fingerprint:
+            skipped_urls.append(url)
+            tokens_saved += len(region) // CHARS_PER_TOKEN
+            stored[url] = {**previous, "checked_at": now}
+        else:
+            changed_urls.append(url)
+            new_fingerprints[url] = {"fingerprint": fingerprint, "checked_at": now, "changed_at": now, "chars": len(region)}
+
+    # --- DETERMINISTIC EXTRACTION FOR KNOWN LAYOUTS ---
+    dom_events = []
+    parsed_urls = []
+    llm_urls = []
+    for url in changed_urls:
+        page_events = extract_known_layout(url, pages[url]) if pages.get(url) else None
+        if page_events is None:
+            llm_urls.append(url)
+            continue
+        dom_events.extend(page_events)
+        parsed_urls.append(url)
+        # Parsed successfully - safe to commit this page's fingerprint now
+        stored[url] = new_fingerprints.pop(url)
+
+    last_scan_report = {
+        "scanned_at": now,
+        "changed_pages": changed_urls,
+        "skipped_pages": skipped_urls,
+        "parsed_pages": parsed_urls,
+        "llm_pages": llm_urls,
+        "estimated_tokens_saved": tokens_saved
+    }
+    log_callback(f"Logistics Officer: {len(changed_urls)} page(s) new/changed, {len(skipped_urls)} unchanged (~{tokens_saved} tokens saved).")
+    for url in skipped_urls:
+        log_callback(f"   > Skipped (unchanged): {url}")
+    if parsed_urls:
+        log_callback(f"   > Parsed {len(dom_events)} event(s) from {len(parsed_urls)} known page layout(s) without LLM.")
+
+    if not llm_urls:
+        save_portal_fingerprints(stored)
+        return dom_events
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("Logistics Officer: GEMINI_API_KEY not set. Cannot use LLM for portal scan.")
+        save_portal_fingerprints(stored)
+        return dom_events
+
+    # Heavy agent stack - only imported when a page actually needs the LLM
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    from browser_use import Agent
+
+    all_urls = ", ".join(llm_urls)
+
     task = f"""
     {auth_step}
     Navigate to and check each of these URLs for school events, schedule changes, or notices:
@@ -94,7 +228,33 @@ async def scan_school_portal():
         }}
     ]
     """
+
+    # Try multiple models for rotation
+    models_to_try = ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-2.0-flash", "gemini-1.0-pro"]
+    last_err = ""
     
+    for model_name in models_to_try:
+        try:
+            print(f"Logistics Officer: Attempting Portal Scan with {model_name}...")
+            llm = ChatGoogleGenerativeAI(model=model_name, google_api_key=api_key)
+            agent = Agent(task=task, llm=llm)
+            result = await agent.run()
+            final_output = result.final_result()
+            if final_output:
+                break
+        except Exception as e:
+            last_err = str(e)
+            print(f"Logistics Officer: Model {model_name} failed: {last_err}")
+            if "429" not in last_err and "quota" not in last_err.lower():
+                # If it's not a quota error, it might be a connectivity issue, try next
+                continue
+            continue
+    else:
+        print(f"Logistics Officer: All portal scan models failed. Last Error: {last_err}")
+        # Keep the old fingerprints for changed pages so they are retried next scan
+        save_portal_fingerprints(stored)
+        return dom_events
+
     try:
         # Extract JSON from potential markdown
         if "```json" in final_output:
@@ -113,13 +273,18 @@ async def scan_school_portal():
         for event in page_events:
             event['source'] = 'portal'
         
-        all_events = page_events
+        # Only commit fingerprints once the changed pages have actually been extracted
+        stored.update(new_fingerprints)
+        save_portal_fingerprints(stored)
+
+        all_events = dom_events + page_events
         print(f"Logistics Officer: Found {len(all_events)} total events from Portal.")
         return all_events
         
     except Exception as e:
         print(f"Logistics Officer: Portal Parsing Failed: {e}")
-        return []
+        save_portal_fingerprints(stored)
+        return dom_events
 
 if __name__ == "__main__":
     # Test run
@@ -128,3 +293,4 @@ if __name__ == "__main__":
     print("Running Portal Scanner Test...")
     events = asyncio.run(scan_school_portal())
     print(json.dumps(events, indent=2))
+    print(json.dumps(last_scan_report, indent=2))
@@ -0,0 +1,149 @@
+"""
+Urgency ordering for the emails of one run, and the carry-over of the ones
+put off to a later run.
+
+A big backfill used to spend the Gemini quota in Gmail list order, old
+newsletters included, before it got to a notice about tomorrow. Now
+process_emails ranks the screened emails first by a cheap score from what
+the heuristics already found (WEIGHTS):
+
+    date     how soon the extracted date is (relative dates - "tomorrow",
+             "this Friday" - count as soon)
+    sender   a TRUSTED_SENDERS domain, or a configured school/club in From
+    child    a configured child named directly (a year group or mapped
+             club counts half)
+    recency  position of the message id in the run (Gmail ids grow with time)
+
+Emails with an event in the next NEAR_TERM_DAYS go first whatever their
+score and are never deferred. The others are processed in score order
+within the run's budgets - RUN_EMAIL_QUOTA emails (0 = no cap) and the
+router's Gemini call/token budget - and whatever doesn't fit is deferred:
+its id is kept in deferred_emails.json and the next full run fetches it
+again, ahead of equally urgent new mail. An email is deferred at most
+DEFER_MAX_RUNS times; after that it is processed with what the
+heuristics found.
+"""
+import os
+import re
+import time
+from datetime import datetime
+
+from extraction_router import RELATIVE_DATE_PATTERN
+from heuristics import get_matchers
+from state_manager import load_deferred_emails, save_deferred_emails
+
+WEIGHTS = {"date": 0.5, "sender": 0.2, "child": 0.2, "recency": 0.1}
+
+# Events this close are loaded this run, whatever the budgets
+NEAR_TERM_DAYS = int(os.getenv("PRIORITY_NEAR_TERM_DAYS", "7"))
+
+# Emails processed per run (0 = no cap); near-term ones don't count against it
+RUN_EMAIL_QUOTA = int(os.getenv("RUN_EMAIL_QUOTA", "0"))
+
+# Sender domains always trusted, e.g. "bishopgilpin.org,spond.com"
+TRUSTED_SENDERS = [d.strip().lower() for d in os.getenv("TRUSTED_SENDERS", "").split(",") if d.strip()]
+
+DEFER_MAX_RUNS = int(os.getenv("DEFER_MAX_RUNS", "3"))
+# Deferred ids older than this are dropped (the email is presumably gone or stale)
+DEFER_MAX_DAYS = float(os.getenv("DEFER_MAX_DAYS", "14"))
+
+# Per run already deferred before, so carried-over mail doesn't starve behind new mail
+CARRY_OVER_BONUS = 0.05
+
+_DOMAIN = re.compile(r'@([\w.-]+)')
+
+def _start_date(value):
+    try:
+        return datetime.strptime((value or "")[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+def date_score(email, start_times, today):
+    """(score, days until the nearest upcoming date or None)."""
+    days = [(date - today).days for date in map(_start_date, start_times) if date is not None]
+    upcoming = [d for d in days if d >= 0]
+    if upcoming:
+        nearest = min(upcoming)
+        return 1.0 / (1.0 + nearest / 7.0), nearest
+    if days:
+        return 0.0, None  # only past dates
+    if RELATIVE_DATE_PATTERN.search(email.subject) or RELATIVE_DATE_PATTERN.search(email.body[:2000]):
+        return 0.8, 0
+    return 0.1, None
+
+def sender_score(sender, config):
+    sender = (sender or "").lower()
+    domain = _DOMAIN.search(sender)
+    if domain and any(domain.group(1) == d or domain.group(1).endswith("." + d) for d in TRUSTED_SENDERS):
+        return 1.0
+    compact = re.sub(r'[^a-z0-9@.]', '', sender)
+    search = config.get("search_settings", {}) if config else {}
+    for term in search.get("schools", []) + search.get("clubs", []):
+        if re.sub(r'[^a-z0-9]', '', term.lower()) in compact:
+            return 1.0
+    return 0.3
+
+def child_score(email, config):
+    text = f"{email.subject} {email.body[:4000]}".lower()
+    m = get_matchers(config)
+    for full_name, _, part_patterns in m["children"]:
+        if full_name in text or any(pattern.search(text) for part, pattern in part_patterns if part != "ben"):
+            return 1.0
+    if any(term in text for _, terms in m["child_mappings"] for term in terms):
+        return 0.5
+    return 0.0
+
+def _id_value(msg_id):
+    try:
+        return int(msg_id, 16)
+    except (TypeError, ValueError):
+        return 0
+
+def prioritize(emails, prepared, config, carried=None, today=None):
+    """
+    Returns [(index, score, near_term)] in processing order. `prepared[i]` is
+    (pre_subjects, event_data, calendar candidates) for emails[i]; screened-out
+    emails go last with score None. `carried` is the deferred-email store.
+    """
+    today = today or datetime.now().date()
+    carried = carried or {}
+    by_age = sorted(range(len(emails)), key=lambda i: _id_value(emails[i].id))
+    recency = {index: (rank + 1) / len(emails) for rank, index in enumerate(by_age)}
+
+    ranked, ignored = [], []
+    for index, email in enumerate(emails):
+        pre_subjects, event_data, candidates = prepared[index]
+        if pre_subjects == "IGNORE":
+            ignored.append((index, None, False))
+            continue
+        starts = [c.start_time for c in candidates] or ([event_data.start_time] if event_data else [])
+        date, days = date_score(email, starts, today)
+        score = (WEIGHTS["date"] * date + WEIGHTS["sender"] * sender_score(email.sender, config)
+                 + WEIGHTS["child"] * child_score(email, config) + WEIGHTS["recency"] * recency[index])
+        score += CARRY_OVER_BONUS * carried.get(email.id, {}).get("runs", 0)
+        near_term = days is not None and days <= NEAR_TERM_DAYS
+        ranked.append((index, round(score, 4), near_term))
+    ranked.sort(key=lambda item: (not item[2], -item[1]))
+    return ranked + ignored
+
+def load_carry_over(now=None):
+    """The deferred-email store with expired entries dropped: {msg_id: {"runs", "first_deferred", ...}}."""
+    now = now or time.time()
+    return {msg_id: entry for msg_id, entry in load_deferred_emails().items()
+            if now - entry.get("first_deferred", now) <= DEFER_MAX_DAYS * 86400}
+
+def can_defer(msg_id, near_term, carried):
+    return not near_term and carried.get(msg_id, {}).get("runs", 0) < DEFER_MAX_RUNS
+
+def update_carry_over(carried, processed, deferred, now=None):
+    """
+    Persists the store after a run: processed ids leave it, `deferred`
+    ({msg_id: (reason, score)}) join it or have their run count raised.
+    """
+    now = now or time.time()
+    store = {msg_id: entry for msg_id, entry in carried.items() if msg_id not in processed}
+    for msg_id, (reason, score) in deferred.items():
+        entry = store.get(msg_id) or {"first_deferred": now, "runs": 0}
+        store[msg_id] = {**entry, "runs": entry["runs"] + 1, "last_deferred": now, "reason": reason, "score": score}
+    save_deferred_emails(store)
+    return store
@@ -0,0 +1,189 @@
+"""
+On-demand profiling of pipeline runs.
+
+    with profiling.profile_run("cprofile", "manual", log_callback):
+        run_pipeline(...)
+
+Two modes:
+
+    cprofile   deterministic: every call in the thread that runs the job,
+               saved as a .prof file (pstats, snakeviz). Slows the run down.
+    sampling   every PROFILE_SAMPLE_INTERVAL seconds, the stacks of the job
+               thread and the worker threads it starts (Gmail fetch pools,
+               tenant workers), saved as collapsed stacks (flamegraph.pl,
+               speedscope). Low overhead; catches time in worker threads.
+
+Next to each artifact goes a .json summary with the top PROFILE_TOP_N hot
+functions. Both land in PERSISTENT_DIR/profiles, newest PROFILE_KEEP runs
+kept, listed and downloadable from the debug page. With no mode given the
+context manager does nothing.
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from state_manager import PERSISTENT_DIR
+
+PROFILES_DIR = os.path.join(PERSISTENT_DIR, "profiles")
+PROFILE_MODES = ("cprofile", "sampling")
+
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "30"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+
+# Profiling mode for the scheduled daily run (empty = off)
+PROFILE_SCHEDULED_RUNS = os.getenv("PROFILE_SCHEDULED_RUNS", "")
+
+_SAFE_NAME = re.compile(r'^[\w.-]+$')
+
+def _function_label(filename, line, name):
+    if filename == "~":
+        return name  # a builtin, as cProfile names them
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+class SamplingProfiler:
+    """
+    Samples the stacks of the starting thread and of threads started after it,
+    from a daemon thread. Threads that were already running (the web server,
+    the scheduler loop) are left out.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = PROFILE_SAMPLE_INTERVAL if interval is None else interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._owner = threading.get_ident()
+        self._ignored = {t.ident for t in threading.enumerate()} - {self._owner}
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me or ident in self._ignored:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(_function_label(code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, n):
+        """Hot functions by samples on top of the stack (self) and anywhere in it (total)."""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+        samples = self.samples or 1
+        return [{"function": label, "self_pct": round(100.0 * own[label] / samples, 2),
+                 "total_pct": round(100.0 * total[label] / samples, 2), "self_samples": own[label]}
+                for label, _ in own.most_common(n)]
+
+def _cprofile_top(profiler, n):
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: -item[1][2])[:n]  # by own (tottime)
+    return [{"function": _function_label(*func), "calls": nc, "tottime": round(tt, 4), "cumtime": round(ct, 4)}
+            for func, (cc, nc, tt, ct, callers) in rows]
+
+def _prune():
+    summaries = sorted(name for name in os.listdir(PROFILES_DIR) if name.endswith(".json"))
+    for name in summaries[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else []:
+        stem = name[:-len(".json")]
+        for artifact in os.listdir(PROFILES_DIR):
+            if artifact.startswith(stem + "."):
+                os.remove(os.path.join(PROFILES_DIR, artifact))
+
+@contextmanager
+def profile_run(mode, label="run", log_callback=print):
+    """Profiles the block with `mode` (see PROFILE_MODES) and saves the artifacts. A falsy mode is a no-op."""
+    if not mode:
+        yield None
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profiling mode '{mode}' (use {' or '.join(PROFILE_MODES)})")
+
+    profiler = cProfile.Profile() if mode == "cprofile" else SamplingProfiler()
+    started = time.time()
+    if mode == "cprofile":
+        profiler.enable()
+    else:
+        profiler.start()
+    try:
+        yield profiler
+    finally:
+        if mode == "cprofile":
+            profiler.disable()
+        else:
+            profiler.stop()
+        duration = time.time() - started
+        try:
+            save_profile(profiler, mode, label, started, duration, log_callback)
+        except Exception as e:
+            log_callback(f"Profile could not be saved: {e}")
+
+def save_profile(profiler, mode, label, started, duration, log_callback=print):
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    stem = "_".join([time.strftime("%Y%m%d-%H%M%S", time.localtime(started)), re.sub(r'[^\w-]', '_', label), mode])
+    if mode == "cprofile":
+        artifact = f"{stem}.prof"
+        profiler.dump_stats(os.path.join(PROFILES_DIR, artifact))
+        top = _cprofile_top(profiler, PROFILE_TOP_N)
+        extra = {"functions": len(pstats.Stats(profiler).stats)}
+    else:
+        artifact = f"{stem}.collapsed"
+        profiler.write(os.path.join(PROFILES_DIR, artifact))
+        top = profiler.top(PROFILE_TOP_N)
+        extra = {"samples": profiler.samples, "interval": profiler.interval}
+    summary = {"name": stem, "mode": mode, "label": label, "started": started,
+               "duration": round(duration, 3), "artifact": artifact, **extra, "top": top}
+    with open(os.path.join(PROFILES_DIR, f"{stem}.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    _prune()
+    log_callback(f"Profile saved: {artifact} ({mode}, {duration:.1f}s); hottest: {top[0]['function'] if top else '-'}")
+    return summary
+
+def list_profiles():
+    """Saved profile summaries, newest first."""
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(PROFILES_DIR), reverse=True):
+        if name.endswith(".json"):
+            try:
+                with open(os.path.join(PROFILES_DIR, name)) as f:
+                    profiles.append(json.load(f))
+            except Exception as e:
+                print(f"Error reading profile summary {name}: {e}")
+    return profiles
+
+def profile_path(name):
+    """Path of a saved profile file, or None if `name` isn't one."""
+    if not _SAFE_NAME.match(name or "") or name.startswith("."):
+        return None
+    path = os.path.join(PROFILES_DIR, name)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,139 @@
+"""
+Local Gmail push simulator.
+
+Delivers synthetic school notices into a fake inbox in bursts and sends a
+Pub/Sub-style notification for each (sometimes twice, as Gmail does). The
+notifications go through the same path as /api/gmail/push: debounce ->
+Gmail history -> incremental sync -> pending queue. Prints notice-to-pending
+latency, how many syncs the bursts were coalesced into and how many messages
+were fetched.
+
+    python push_simulator.py --messages 40 --debounce 1 --max-delay 5
+
+With --url the notifications are POSTed to a running app's webhook instead
+(the app then syncs against its real Gmail account):
+
+    python push_simulator.py --url "http://127.0.0.1:5000/api/gmail/push?token=..." --messages 5
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import urllib.request
+
+def push_payload(email_address, history_id):
+    """A Pub/Sub push body as Gmail's watch() produces it."""
+    data = json.dumps({"emailAddress": email_address, "historyId": history_id}).encode("utf-8")
+    return {
+        "message": {"data": base64.b64encode(data).decode("ascii"), "messageId": str(random.getrandbits(48)),
+                    "publishTime": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+        "subscription": "projects/local/subscriptions/gmail-push"
+    }
+
+def _bursts(messages, rnd, gap):
+    """Yields (message, pause before it): bursts of 1-4 messages, `gap` seconds apart on average."""
+    index = 0
+    while index < len(messages):
+        size = rnd.randint(1, 4)
+        for i, message in enumerate(messages[index:index + size]):
+            yield message, (rnd.uniform(0.5, 1.5) * gap if i == 0 and index else rnd.uniform(0, 0.2))
+        index += size
+
+def post_to_url(args):
+    rnd = random.Random(args.seed)
+    history_id = 1000
+    for i in range(args.messages):
+        history_id += rnd.randint(1, 5)
+        body = json.dumps(push_payload("me@example.com", history_id)).encode("utf-8")
+        request = urllib.request.Request(args.url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=10) as response:
+            print(f"notification {i + 1}: historyId {history_id} -> HTTP {response.status}")
+        time.sleep(rnd.uniform(0, args.gap))
+
+def simulate(args):
+    data_dir = tempfile.mkdtemp(prefix="etl_push_")
+    os.environ["ETL_DATA_DIR"] = data_dir
+    os.environ["GEMINI_RATE_LIMIT_SECONDS"] = "0"
+
+    import metrics
+    import push_sync
+    import state_manager
+    from fake_services import FakeCalendarService, FakeGmailService, generate_mailbox
+
+    state_manager.pin_config(state_manager.load_template_config())
+    rnd = random.Random(args.seed)
+    mailbox = generate_mailbox(args.backlog + args.messages, seed=args.seed)
+    gmail = FakeGmailService(mailbox[:args.backlog])
+    calendar = FakeCalendarService()
+    services = {"gmail": gmail, "calendar": calendar}
+    state_manager.save_gmail_history_id(gmail.history_id)
+
+    delivered_at = {}
+    queued = []
+    reports = []
+
+    def on_event(event):
+        queued.append((time.time(), event))
+
+    def sync(batch):
+        reports.append(push_sync.run_push_batch(batch, log_callback=lambda msg: None, event_callback=on_event, services=services))
+
+    debouncer = push_sync.Debouncer(sync, args.debounce, args.max_delay)
+    notices = 0
+    try:
+        for message, pause in _bursts(mailbox[args.backlog:], rnd, args.gap):
+            time.sleep(pause)
+            history_id = gmail.deliver(message)
+            delivered_at[message["id"]] = time.time()
+            for _ in range(2 if rnd.random() < args.duplicate_rate else 1):
+                push_sync.handle_push(push_payload("me@example.com", history_id), debouncer)
+                notices += 1
+
+        deadline = time.time() + args.max_delay + 60
+        while (debouncer.batch is not None or debouncer.thread is not None) and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        state_manager.pin_config(None)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    latency = metrics.Histogram()
+    for pending_at, event in queued:
+        msg_id = (event.source_url or "").rsplit("/", 1)[-1]
+        if msg_id in delivered_at:
+            latency.observe(pending_at - delivered_at[msg_id])
+
+    result = {
+        "messages_delivered": args.messages,
+        "notifications": notices,
+        "syncs": len(reports),
+        "outcomes": [r["outcome"] for r in reports],
+        "messages_fetched": gmail.stats.get("messages.get", 0),
+        "events_queued": len(queued),
+        "notice_to_pending_seconds": {k: latency.to_dict()[k] for k in ("count", "p50", "p95", "max")},
+        "settings": {"debounce": args.debounce, "max_delay": args.max_delay, "gap": args.gap},
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate Gmail push notifications")
+    parser.add_argument("--messages", type=int, default=40, help="New messages to deliver")
+    parser.add_argument("--backlog", type=int, default=200, help="Messages already in the inbox")
+    parser.add_argument("--gap", type=float, default=2.0, help="Average seconds between bursts")
+    parser.add_argument("--duplicate-rate", type=float, default=0.3, help="Chance a change is notified twice")
+    parser.add_argument("--debounce", type=float, default=1.0, help="Quiet period before a sync (PUSH_DEBOUNCE_SECONDS)")
+    parser.add_argument("--max-delay", type=float, default=5.0, help="Longest a burst may delay its sync (PUSH_MAX_DELAY_SECONDS)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--url", default=None, help="POST notifications to this webhook instead of simulating in-process")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        return post_to_url(args)
+    return simulate(args)
+
+if __name__ == "__main__":
+    main()
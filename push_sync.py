@@ -0,0 +1,205 @@
+"""
+Event-driven sync from Gmail push notifications.
+
+Gmail's users.watch() publishes a notification to a Pub/Sub topic whenever
+the mailbox changes, and a push subscription POSTs it to /api/gmail/push:
+
+    {"message": {"data": base64('{"emailAddress": "...", "historyId": "1234"}'), ...},
+     "subscription": "projects/.../subscriptions/..."}
+
+Changes arrive in bursts (one notification per label change), so they are
+coalesced: a sync runs once the mailbox has been quiet for
+PUSH_DEBOUNCE_SECONDS, and at the latest PUSH_MAX_DELAY_SECONDS after the
+first notification of a burst. The sync reads Gmail history since the last
+synced historyId and processes only the new messages. The daily sweep in
+app.scheduler_loop stays as the safety net and renews the watch.
+
+Push sync serves the default household; tenants keep the scheduled sweep.
+Try it offline with push_simulator.py.
+
+Setting it up takes both GMAIL_PUSH_TOPIC and PUSH_VERIFICATION_TOKEN, with
+the push subscription's endpoint set to /api/gmail/push?token=<token>.
+Without a token the endpoint refuses every request and no watch is
+registered - anyone could otherwise POST notifications and trigger syncs.
+"""
+import base64
+import hmac
+import json
+import os
+import threading
+import time
+
+import metrics
+from state_manager import get_gmail_history_id, save_gmail_history_id
+
+GMAIL_PUSH_TOPIC = os.getenv("GMAIL_PUSH_TOPIC")  # projects/<project>/topics/<topic>
+# Required alongside GMAIL_PUSH_TOPIC: the ?token= the push subscription sends
+PUSH_VERIFICATION_TOKEN = os.getenv("PUSH_VERIFICATION_TOKEN")
+PUSH_DEBOUNCE_SECONDS = float(os.getenv("PUSH_DEBOUNCE_SECONDS", "5"))
+PUSH_MAX_DELAY_SECONDS = float(os.getenv("PUSH_MAX_DELAY_SECONDS", "30"))
+
+# Summary of the most recent push-triggered sync
+last_push_report = {}
+
+def parse_push(payload):
+    """Returns (email_address, history_id) from a Pub/Sub push body. Raises ValueError if malformed."""
+    try:
+        data = json.loads(base64.b64decode(payload["message"]["data"]))
+        return data.get("emailAddress"), int(data["historyId"])
+    except Exception as e:
+        raise ValueError(f"Not a Gmail push notification: {e}")
+
+class Debouncer:
+    """
+    Coalesces notifications into batches and hands each batch to `action`
+    on a background thread. One batch runs at a time; notifications that
+    arrive meanwhile form the next batch.
+    """
+
+    def __init__(self, action, quiet_seconds=None, max_delay_seconds=None):
+        self.action = action
+        self.quiet_seconds = PUSH_DEBOUNCE_SECONDS if quiet_seconds is None else quiet_seconds
+        self.max_delay_seconds = PUSH_MAX_DELAY_SECONDS if max_delay_seconds is None else max_delay_seconds
+        self.condition = threading.Condition()
+        self.batch = None
+        self.thread = None
+
+    def notify(self, history_id):
+        now = time.time()
+        with self.condition:
+            if self.batch is None:
+                self.batch = {"first_at": now, "last_at": now, "history_id": history_id, "notices": 1}
+            else:
+                self.batch["last_at"] = now
+                self.batch["history_id"] = max(self.batch["history_id"], history_id)
+                self.batch["notices"] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._worker, name="push-sync", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                if self.batch is None:
+                    self.thread = None
+                    return
+                due = min(self.batch["last_at"] + self.quiet_seconds, self.batch["first_at"] + self.max_delay_seconds)
+                wait = due - time.time()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                batch, self.batch = self.batch, None
+            try:
+                self.action(batch)
+            except Exception as e:
+                print(f"Push sync failed: {e}")
+
+def push_authorized(token):
+    """True only if a verification token is configured and `token` matches it."""
+    if not PUSH_VERIFICATION_TOKEN:
+        return False
+    return hmac.compare_digest((token or "").encode("utf-8"), PUSH_VERIFICATION_TOKEN.encode("utf-8"))
+
+def handle_push(payload, debouncer):
+    """What /api/gmail/push does with a notification body: validate it and queue a sync."""
+    email_address, history_id = parse_push(payload)
+    metrics.inc("push.notifications")
+    debouncer.notify(history_id)
+    return email_address, history_id
+
+def _status(error):
+    resp = getattr(error, 'resp', None)
+    return getattr(resp, 'status', None) or getattr(error, 'status_code', None)
+
+def new_message_ids(service, start_history_id):
+    """Ids of messages added to the inbox since `start_history_id`, and the latest historyId seen."""
+    ids = {}
+    latest = int(start_history_id)
+    page_token = None
+    while True:
+        params = {"userId": 'me', "startHistoryId": str(start_history_id), "historyTypes": ['messageAdded'], "labelId": 'INBOX'}
+        if page_token:
+            params["pageToken"] = page_token
+        metrics.inc("gmail.history.list")
+        with metrics.stage("gmail_history"):
+            result = service.users().history().list(**params).execute()
+        for record in result.get('history', []):
+            for added in record.get('messagesAdded', []):
+                ids[added['message']['id']] = None
+        latest = max(latest, int(result.get('historyId', latest)))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return list(ids), latest
+
+def run_push_batch(batch, log_callback=print, event_callback=None, services=None):
+    """
+    Syncs one debounced batch: Gmail history since the stored historyId ->
+    incremental sync of the new messages. Falls back to a 24 hour scan when
+    there is no stored historyId or Gmail no longer has that far back.
+    Observes push.notice_to_pending for every event queued.
+    """
+    global last_push_report
+    from etl_pipeline import connect_services, run_incremental_sync, run_pipeline
+
+    def timed_event(event):
+        metrics.observe("push.notice_to_pending", time.time() - batch["first_at"])
+        if event_callback:
+            event_callback(event)
+
+    report = {"notices": batch["notices"], "history_id": batch["history_id"],
+              "debounce_seconds": round(time.time() - batch["first_at"], 3)}
+    start_history_id = get_gmail_history_id()
+    if start_history_id is not None and batch["history_id"] <= int(start_history_id):
+        report["outcome"] = "already_synced"
+        last_push_report = report
+        return report
+
+    gmail_service, calendar_service, gmail_factory = connect_services(services)
+    connected = {"gmail": gmail_service, "calendar": calendar_service, "gmail_factory": gmail_factory}
+
+    msg_ids = None
+    latest = batch["history_id"]
+    if start_history_id is not None:
+        try:
+            msg_ids, latest = new_message_ids(gmail_service, start_history_id)
+        except Exception as e:
+            if str(_status(e)) != "404":
+                raise
+            log_callback("Push sync: Gmail history expired, scanning the last 24 hours instead")
+
+    if msg_ids is None:
+        report["outcome"] = "full_scan"
+        # Only 24 hours are scanned: the daily sweep's lookback must still start from its own last success
+        run_pipeline(log_callback=log_callback, event_callback=timed_event, is_manual=True, services=connected,
+                     update_state=False)
+    else:
+        report["outcome"] = "incremental"
+        report["new_messages"] = len(msg_ids)
+        if msg_ids:
+            run_incremental_sync(msg_ids, log_callback=log_callback, event_callback=timed_event, services=connected)
+
+    save_gmail_history_id(max(latest, batch["history_id"]))
+    report["sync_seconds"] = round(time.time() - batch["first_at"] - report["debounce_seconds"], 3)
+    last_push_report = report
+    return report
+
+def renew_watch(services=None, log_callback=print):
+    """
+    (Re)registers the Gmail watch on GMAIL_PUSH_TOPIC. Watches lapse after
+    7 days, so the daily sweep calls this. Seeds the stored historyId on first use.
+    """
+    if not GMAIL_PUSH_TOPIC:
+        return None
+    if not PUSH_VERIFICATION_TOKEN:
+        log_callback("Gmail watch not registered: GMAIL_PUSH_TOPIC is set but PUSH_VERIFICATION_TOKEN is not")
+        return None
+    from etl_pipeline import connect_services
+
+    gmail_service, _, _ = connect_services(services)
+    response = gmail_service.users().watch(userId='me', body={
+        "topicName": GMAIL_PUSH_TOPIC, "labelIds": ['INBOX'], "labelFilterBehavior": "include"}).execute()
+    if get_gmail_history_id() is None:
+        save_gmail_history_id(response["historyId"])
+    log_callback(f"Gmail watch active until {time.strftime('%Y-%m-%d %H:%M', time.localtime(int(response['expiration']) / 1000))}")
+    return response
@@ -0,0 +1,154 @@
+"""
+Compact record types for the objects that flow through a run.
+
+    Message         an extracted email (extract_emails)
+    CandidateEvent  an event found in a message (heuristic_extraction, Gemini, portal)
+    PendingEvent    a labelled event waiting for approval (load_to_calendar)
+
+They use __slots__ instead of per-instance dicts, and later stages hold a
+reference to the earlier record (CandidateEvent.message) instead of copying
+the body along. to_dict()/from_dict() convert to and from the JSON shapes the
+dashboard, corpus files and Calendar API use.
+"""
+
+class Message:
+    __slots__ = ("id", "subject", "sender", "body", "calendar")
+
+    def __init__(self, id, subject="No Subject", sender="Unknown", body="", calendar=()):
+        self.id = id
+        self.subject = subject
+        self.sender = sender
+        self.body = body
+        self.calendar = calendar  # text of any text/calendar parts or .ics attachments (see ics_parser)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], data.get("subject", "No Subject"), data.get("sender", "Unknown"), data.get("body", ""),
+                   tuple(data.get("calendar") or ()))
+
+    def to_dict(self):
+        data = {"id": self.id, "subject": self.subject, "sender": self.sender, "body": self.body}
+        if self.calendar:
+            data["calendar"] = list(self.calendar)
+        return data
+
+    def __repr__(self):
+        return f"Message({self.id!r}, subject={self.subject!r}, body={len(self.body)} chars)"
+
+class CandidateEvent:
+    __slots__ = ("event_title", "start_time", "end_time", "location", "description", "subjects",
+                 "gmail_url", "source_url", "source", "source_id", "confidence", "reasons", "time_zone", "recurrence",
+                 "message")
+
+    def __init__(self, event_title="School Event", start_time=None, end_time=None, location="", description="",
+                 subjects=None, gmail_url=None, source_url=None, source="email", source_id=None,
+                 confidence=None, reasons=None, time_zone=None, recurrence=None, message=None):
+        self.event_title = event_title
+        self.start_time = start_time
+        self.end_time = end_time
+        self.location = location
+        self.description = description
+        self.subjects = subjects or []
+        self.gmail_url = gmail_url
+        self.source_url = source_url
+        self.source = source
+        self.source_id = source_id
+        self.confidence = confidence  # heuristic_extraction's score, None if it came from elsewhere
+        self.reasons = reasons or []
+        self.time_zone = time_zone    # IANA zone of start/end, None = Europe/London
+        self.recurrence = recurrence  # RRULE/RDATE/EXDATE lines from an invite
+        self.message = message  # the Message it came from, if any - its body is not copied
+
+    @classmethod
+    def from_dict(cls, data):
+        """From the JSON Gemini or the portal scanner returns. Unknown keys are dropped."""
+        return cls(data.get("event_title") or data.get("summary") or "School Event", data.get("start_time"),
+                   data.get("end_time"), data.get("location", ""), data.get("description", ""),
+                   data.get("subjects"), data.get("gmail_url"), data.get("source_url"),
+                   data.get("source", "email"), data.get("source_id"))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != "message"}
+
+    def __repr__(self):
+        return f"CandidateEvent({self.event_title!r}, start_time={self.start_time!r}, source_id={self.source_id!r})"
+
+class PendingEvent:
+    __slots__ = ("id", "summary", "location", "description", "start_time", "end_time", "time_zone",
+                 "color_id", "status", "source", "source_url", "tenant_id", "discovered_at", "status_tag", "recurrence",
+                 "duplicate_ids", "labels")
+
+    def __init__(self, id, summary, start_time, end_time, location="", description="", time_zone="Europe/London",
+                 color_id="1", status="tentative", source="email", source_url=None, tenant_id=None,
+                 discovered_at=None, status_tag=None, recurrence=None, duplicate_ids=None, labels=None):
+        self.id = id
+        self.summary = summary
+        self.location = location
+        self.description = description
+        self.start_time = start_time
+        self.end_time = end_time
+        self.time_zone = time_zone
+        self.color_id = color_id
+        self.status = status
+        self.source = source
+        self.source_url = source_url
+        self.tenant_id = tenant_id
+        self.discovered_at = discovered_at
+        self.status_tag = status_tag
+        self.recurrence = recurrence
+        # Message ids of the near-duplicate copies this event stands for (near_duplicates.py)
+        self.duplicate_ids = duplicate_ids
+        self.labels = labels  # identify_child's labels (the title tag), for per-child feeds
+
+    def _when(self, value):
+        # All-day events (from invites) carry a bare YYYY-MM-DD
+        if value and "T" not in value:
+            return {'date': value}
+        return {'dateTime': value, 'timeZone': self.time_zone}
+
+    def calendar_body(self):
+        """The Calendar API event resource (with its deterministic id)."""
+        body = {
+            'id': self.id,
+            'summary': self.summary,
+            'location': self.location,
+            'description': self.description,
+            'start': self._when(self.start_time),
+            'end': self._when(self.end_time),
+            'colorId': self.color_id,
+            'status': self.status,
+        }
+        if self.recurrence:
+            body['recurrence'] = list(self.recurrence)
+        return body
+
+    def to_dict(self, with_status=False):
+        """The dashboard/API shape: the Calendar body plus the UI metadata."""
+        data = self.calendar_body()
+        data['source'] = self.source
+        data['source_url'] = self.source_url
+        if self.discovered_at:
+            data['_discovered_at'] = self.discovered_at
+        if self.tenant_id:
+            data['tenant_id'] = self.tenant_id
+        if self.duplicate_ids:
+            data['duplicate_ids'] = list(self.duplicate_ids)
+        if self.labels:
+            data['labels'] = list(self.labels)
+        if with_status:
+            data['status_tag'] = self.status_tag
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        start = data.get('start') or {}
+        end = data.get('end') or {}
+        return cls(data['id'], data.get('summary', ''), start.get('dateTime') or start.get('date'),
+                   end.get('dateTime') or end.get('date'), data.get('location', ''), data.get('description', ''),
+                   start.get('timeZone', 'Europe/London'), data.get('colorId', '1'), data.get('status', 'tentative'),
+                   data.get('source', 'email'), data.get('source_url'), data.get('tenant_id'),
+                   data.get('_discovered_at'), data.get('status_tag'), data.get('recurrence'),
+                   data.get('duplicate_ids'), data.get('labels'))
+
+    def __repr__(self):
+        return f"PendingEvent({self.id!r}, {self.summary!r}, start_time={self.start_time!r}, status_tag={self.status_tag!r})"
@@ -0,0 +1,370 @@
+"""
+Structured run log: JSON-lines records on the persistent disk.
+
+    run_log.log("Processing: Sports Day", level="INFO", decision="heuristic")
+    run_log.query(run="ab12cd34", level="WARNING", limit=100)
+
+Each record carries its time, level, message and whatever context is known
+where it was logged: the metrics run id and stage, the active tenant and
+the message id process_emails is working on (bind_message), plus a
+duration and free-form fields if given.
+
+log() only appends to an in-memory queue; a background thread writes the
+queued records in batches to run_log.jsonl, rotating it at
+RUN_LOG_MAX_BYTES (run_log.jsonl.1 ... .RUN_LOG_BACKUPS). If the disk falls
+behind and the queue fills up, records are dropped (and counted) rather
+than blocking the pipeline.
+
+Queries go through an offset index: each file is cut into blocks of
+INDEX_BLOCK_RECORDS records, summarised by byte range, time range, run ids,
+message ids and levels. The index is extended as the file grows, each line
+parsed once, and a query only reads the blocks that can match.
+
+The dashboard's recent lines are a small cache of the newest records,
+seeded from the end of the file after a restart.
+"""
+import atexit
+import hashlib
+import json
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import metrics
+from state_manager import PERSISTENT_DIR, get_active_tenant
+
+RUN_LOG_FILE = os.path.join(PERSISTENT_DIR, "run_log.jsonl")
+RUN_LOG_MAX_BYTES = int(os.getenv("RUN_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+RUN_LOG_BACKUPS = int(os.getenv("RUN_LOG_BACKUPS", "5"))
+
+# Records waiting for the writer thread before new ones are dropped
+RUN_LOG_QUEUE_SIZE = int(os.getenv("RUN_LOG_QUEUE_SIZE", "10000"))
+
+# Records per offset-index block
+INDEX_BLOCK_RECORDS = 256
+
+# Newest records kept in memory for the dashboard
+RECENT_RECORDS = 50
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+_FAILURE = re.compile(r'\b(?:fail(?:ed|ure)?|error|exception)\b', re.IGNORECASE)
+_WARNING = re.compile(r'\b(?:warning|quota|429|retry(?:ing)?|over budget)\b', re.IGNORECASE)
+
+_context = threading.local()
+
+def bind_message(msg_id):
+    """Tags this thread's following records with `msg_id` (None to clear)."""
+    _context.msg_id = msg_id
+
+def infer_level(message):
+    """Level for a free-text log line logged without one."""
+    if _FAILURE.search(message):
+        return "ERROR"
+    if _WARNING.search(message):
+        return "WARNING"
+    return "INFO"
+
+def make_record(message, level=None, duration=None, **fields):
+    record = {"ts": round(time.time(), 3), "level": (level or infer_level(message)).upper(), "message": message}
+    run_id = metrics.current_run_id()
+    if run_id:
+        record["run"] = run_id
+    stage = metrics.current_stage()
+    if stage:
+        record["stage"] = stage
+    tenant = get_active_tenant()
+    if tenant is not None:
+        record["tenant"] = tenant.id
+    msg_id = getattr(_context, "msg_id", None)
+    if msg_id:
+        record["msg"] = msg_id
+    if duration is not None:
+        record["duration"] = round(duration, 4)
+    if fields:
+        record["fields"] = fields
+    return record
+
+def format_line(record):
+    """The dashboard's '[YYYY-MM-DD HH:MM:SS] message' form of a record."""
+    return f"[{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record['ts']))}] {record['message']}"
+
+def _log_files(path, backups=None):
+    """The live file and its rotations, newest first."""
+    return [path] + [f"{path}.{n}" for n in range(1, (RUN_LOG_BACKUPS if backups is None else backups) + 1)]
+
+class RunLogWriter:
+    """Queue + background thread appending records to `path` and rotating it."""
+
+    def __init__(self, path=None, max_bytes=None, backups=None, queue_size=None):
+        self.path = path or RUN_LOG_FILE
+        self.max_bytes = RUN_LOG_MAX_BYTES if max_bytes is None else max_bytes
+        self.backups = RUN_LOG_BACKUPS if backups is None else backups
+        self.queue = queue.Queue(RUN_LOG_QUEUE_SIZE if queue_size is None else queue_size)
+        self.dropped = 0
+        self.written = 0
+        self.rotations = 0
+        self.recent = deque(maxlen=RECENT_RECORDS)  # newest first
+        self._lock = threading.Lock()
+        self._seeded = False
+        self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="run-log-writer", daemon=True)
+                self._thread.start()
+
+    def write(self, record):
+        """Never blocks: a full queue drops the record."""
+        if not self._seeded:
+            self._seed_recent()
+        if LEVELS.get(record["level"], 20) >= LEVELS["INFO"]:
+            self.recent.appendleft(record)
+        if self._thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Waits until everything queued so far is on disk."""
+        if self._thread is not None:
+            self.queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < 1000:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print(f"Run log write failed, {len(batch)} records lost: {e}")
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write_batch(self, batch):
+        data = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+                       for record in batch).encode("utf-8")
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size and size + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self.written += len(batch)
+
+    def _rotate(self):
+        files = _log_files(self.path, self.backups)
+        if os.path.exists(files[-1]):
+            os.remove(files[-1])
+        for older, newer in zip(reversed(files[1:]), reversed(files[:-1])):
+            if os.path.exists(newer):
+                os.replace(newer, older)
+        self.rotations += 1
+
+    def _seed_recent(self):
+        """After a restart, fills the recent cache from the end of the log file."""
+        with self._lock:
+            if self._seeded:
+                return
+            self._seeded = True
+            if not os.path.exists(self.path):
+                return
+            try:
+                with open(self.path, "rb") as f:
+                    start = max(0, os.path.getsize(self.path) - 64 * 1024)
+                    f.seek(start)
+                    lines = f.read().split(b"\n")
+                if start:
+                    lines = lines[1:]  # starts mid-line
+            except OSError as e:
+                print(f"Error reading run log tail: {e}")
+                return
+            for line in reversed(lines):
+                if len(self.recent) >= RECENT_RECORDS:
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if LEVELS.get(record.get("level"), 20) >= LEVELS["INFO"]:
+                    self.recent.append(record)
+
+def _first_line_hash(f):
+    f.seek(0)
+    line = f.readline(64 * 1024)
+    return hashlib.sha1(line).hexdigest() if line.endswith(b"\n") else None
+
+class _FileIndex:
+    """
+    Block summaries of one log file (by device and inode, so it survives the
+    file being rotated). The first line's hash tells it apart from a later
+    file that got the same inode back.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.indexed_to = 0
+        self.head = None
+
+    def describes(self, f, size):
+        """Whether this index (still) belongs to open file `f` of `size` bytes."""
+        if size < self.indexed_to:
+            return False
+        return self.head is None or _first_line_hash(f) == self.head
+
+    def refresh(self, f):
+        """Indexes whatever was appended to open file `f` since the last call."""
+        if self.head is None:
+            self.head = _first_line_hash(f)
+        f.seek(self.indexed_to)
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        offset = self.indexed_to
+        block = self.blocks[-1] if self.blocks and self.blocks[-1]["count"] < INDEX_BLOCK_RECORDS else None
+        for line in data[:end].split(b"\n")[:-1]:
+            next_offset = offset + len(line) + 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                offset = next_offset
+                continue
+            if block is None:
+                block = {"start": offset, "end": offset, "count": 0, "ts_min": record["ts"], "ts_max": record["ts"],
+                         "runs": set(), "msgs": set(), "level": 0}
+                self.blocks.append(block)
+            block["end"] = next_offset
+            block["count"] += 1
+            block["ts_max"] = record["ts"]
+            block["level"] = max(block["level"], LEVELS.get(record.get("level"), 20))
+            if "run" in record:
+                block["runs"].add(record["run"])
+            if "msg" in record:
+                block["msgs"].add(record["msg"])
+            if block["count"] >= INDEX_BLOCK_RECORDS:
+                block = None
+            offset = next_offset
+        self.indexed_to += end
+
+def _timestamp(value):
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+class RunLogReader:
+    def __init__(self, path=None):
+        self.path = path or RUN_LOG_FILE
+        self._indexes = {}  # (device, inode) -> _FileIndex
+        self._lock = threading.Lock()
+
+    def _indexed_files(self):
+        """(open file, index) for the live file and its rotations, newest first. The caller closes the files."""
+        files = []
+        for path in _log_files(self.path):
+            try:
+                f = open(path, "rb")
+            except OSError:
+                continue
+            # Keyed by inode: a rotated file keeps its index, and an open handle
+            # keeps reading the same file even if it is rotated meanwhile. A
+            # new file can get a deleted backup's inode back - then the index
+            # doesn't describe it and is rebuilt.
+            stat = os.fstat(f.fileno())
+            inode = (stat.st_dev, stat.st_ino)
+            index = self._indexes.get(inode)
+            if index is None or not index.describes(f, stat.st_size):
+                index = self._indexes[inode] = _FileIndex()
+            index.refresh(f)
+            files.append((inode, f, index))
+        live = {inode for inode, _, _ in files}
+        for inode in list(self._indexes):
+            if inode not in live:
+                del self._indexes[inode]
+        return [(f, index) for _, f, index in files]
+
+    def query(self, run=None, msg=None, level=None, stage=None, tenant=None, text=None,
+              since=None, until=None, limit=200):
+        """Matching records, newest first, plus how much of the log was read."""
+        min_level = LEVELS.get((level or "DEBUG").upper(), 10)
+        since, until = _timestamp(since), _timestamp(until)
+        text = text.lower() if text else None
+        records = []
+        scanned = skipped = 0
+        with self._lock:
+            files = self._indexed_files()
+        for f, index in files:
+            with f:
+                if len(records) >= limit:
+                    continue
+                for block in reversed(index.blocks):
+                    if len(records) >= limit:
+                        break
+                    if ((run and run not in block["runs"]) or (msg and msg not in block["msgs"])
+                            or block["level"] < min_level
+                            or (since and block["ts_max"] < since) or (until and block["ts_min"] > until)):
+                        skipped += 1
+                        continue
+                    scanned += 1
+                    f.seek(block["start"])
+                    for line in reversed(f.read(block["end"] - block["start"]).split(b"\n")[:-1]):
+                        record = json.loads(line)
+                        if ((run and record.get("run") != run) or (msg and record.get("msg") != msg)
+                                or LEVELS.get(record.get("level"), 20) < min_level
+                                or (stage and record.get("stage") != stage)
+                                or (tenant and record.get("tenant") != tenant)
+                                or (since and record["ts"] < since) or (until and record["ts"] > until)
+                                or (text and text not in record["message"].lower())):
+                            continue
+                        records.append(record)
+                        if len(records) >= limit:
+                            break
+        return {"records": records, "blocks_read": scanned, "blocks_skipped": skipped}
+
+_writer = None
+_reader = None
+_singleton_lock = threading.Lock()
+
+def get_writer():
+    global _writer
+    with _singleton_lock:
+        if _writer is None:
+            _writer = RunLogWriter()
+            atexit.register(_writer.flush)
+        return _writer
+
+def get_reader():
+    global _reader
+    with _singleton_lock:
+        if _reader is None:
+            _reader = RunLogReader()
+        return _reader
+
+def log(message, level=None, duration=None, **fields):
+    """Queues a structured record and returns it."""
+    record = make_record(message, level, duration, **fields)
+    get_writer().write(record)
+    return record
+
+def recent_lines(n=RECENT_RECORDS):
+    """The newest dashboard lines (INFO and up), newest first."""
+    writer = get_writer()
+    if not writer._seeded:
+        writer._seed_recent()
+    return [format_line(record) for record in list(writer.recent)[:n]]
+
+def query(**filters):
+    """See RunLogReader.query. Flushes queued records first so they are included."""
+    get_writer().flush()
+    return get_reader().query(**filters)
@@ -2,25 +2,54 @@ import json
 import os
 import time
 import shutil
-import requests
+import threading
+import metrics
 
 # Determine if we're running on Render (persistent disk available)
 # On Render, use /var/data for persistent storage
 # Locally, use project root
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# Check if Render persistent disk is mounted
-if os.path.exists('/var/data'):
+# Check if Render persistent disk is mounted (ETL_DATA_DIR overrides, e.g. for benchmarks)
+if os.getenv("ETL_DATA_DIR"):
+    PERSISTENT_DIR = os.getenv("ETL_DATA_DIR")
+elif os.path.exists('/var/data'):
     PERSISTENT_DIR = '/var/data'
 else:
     PERSISTENT_DIR = BASE_DIR
 
 STATE_FILE = os.path.join(PERSISTENT_DIR, "pipeline_state.json")
+RUN_HISTORY_FILE = os.path.join(PERSISTENT_DIR, "run_history.json")
+PORTAL_FINGERPRINT_FILE = os.path.join(PERSISTENT_DIR, "portal_fingerprints.json")
+GMAIL_HISTORY_FILE = os.path.join(PERSISTENT_DIR, "gmail_history.json")
+NEAR_DUPLICATE_FILE = os.path.join(PERSISTENT_DIR, "near_duplicates.json")
+APPROVED_EVENTS_FILE = os.path.join(PERSISTENT_DIR, "approved_events.json")
+DEFERRED_EMAILS_FILE = os.path.join(PERSISTENT_DIR, "deferred_emails.json")
 CONFIG_TEMPLATE = os.path.join(BASE_DIR, "config.template.json")
 
 # GitHub Gist configuration
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 CONFIG_GIST_ID = os.getenv("CONFIG_GIST_ID")
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+
+# --- Tenant context ---
+# Each worker thread of a multi-tenant run binds its tenant here; state files,
+# config and calendar then resolve per tenant. Unbound threads use the defaults.
+_tenant_context = threading.local()
+
+def set_active_tenant(tenant):
+    _tenant_context.tenant = tenant
+
+def get_active_tenant():
+    return getattr(_tenant_context, "tenant", None)
+
+def _data_path(default_path):
+    """Maps one of the default state file paths into the active tenant's data dir."""
+    tenant = get_active_tenant()
+    if tenant is None:
+        return default_path
+    os.makedirs(tenant.data_dir, exist_ok=True)
+    return os.path.join(tenant.data_dir, os.path.basename(default_path))
 
 def load_template_config():
     """Load config from template file as fallback."""
@@ -35,9 +64,10 @@ def load_template_config():
 
 def get_last_successful_run():
     """Returns the timestamp of the last successful run, or a default lookback if none exists."""
-    if os.path.exists(STATE_FILE):
+    state_file = _data_path(STATE_FILE)
+    if os.path.exists(state_file):
         try:
-            with open(STATE_FILE, 'r') as f:
+            with open(state_file, 'r') as f:
                 data = json.load(f)
                 return data.get("last_run_timestamp", None)
         except Exception:
@@ -46,24 +76,204 @@ def get_last_successful_run():
 
 def update_last_successful_run():
     """Updates the last successful run timestamp to now."""
-    with open(STATE_FILE, 'w') as f:
+    with open(_data_path(STATE_FILE), 'w') as f:
         json.dump({"last_run_timestamp": time.time()}, f)
 
-def load_config():
-    """Load config from GitHub Gist (or template as fallback)."""
+# Number of run records (with their metrics) kept on disk
+MAX_RUN_HISTORY = 30
+
+def load_run_history():
+    """Returns the list of recent run records, newest first."""
+    history_file = _data_path(RUN_HISTORY_FILE)
+    if os.path.exists(history_file):
+        try:
+            with open(history_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading run history: {e}")
+            return []
+    return []
+
+def record_run(run_record):
+    """Prepends a run record (status + metrics snapshot) to the on-disk run history."""
+    history = load_run_history()
+    history.insert(0, run_record)
+    try:
+        with open(_data_path(RUN_HISTORY_FILE), 'w') as f:
+            json.dump(history[:MAX_RUN_HISTORY], f)
+        return True
+    except Exception as e:
+        print(f"Error saving run history: {e}")
+        return False
+
+def load_portal_fingerprints():
+    """Returns the stored {url: fingerprint record} map from the last portal scan."""
+    fingerprint_file = _data_path(PORTAL_FINGERPRINT_FILE)
+    if os.path.exists(fingerprint_file):
+        try:
+            with open(fingerprint_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading portal fingerprints: {e}")
+            return {}
+    return {}
+
+def save_portal_fingerprints(fingerprints):
+    """Persists the {url: fingerprint record} map for the next portal scan."""
+    try:
+        with open(_data_path(PORTAL_FINGERPRINT_FILE), 'w') as f:
+            json.dump(fingerprints, f, indent=2)
+        return True
+    except Exception as e:
+        print(f"Error saving portal fingerprints: {e}")
+        return False
+
+def load_near_duplicates():
+    """Returns the near-duplicate representatives remembered from recent runs."""
+    near_duplicate_file = _data_path(NEAR_DUPLICATE_FILE)
+    if os.path.exists(near_duplicate_file):
+        try:
+            with open(near_duplicate_file, 'r') as f:
+                return json.load(f).get("entries", [])
+        except Exception as e:
+            print(f"Error loading near-duplicate index: {e}")
+            return []
+    return []
+
+def save_near_duplicates(entries):
+    try:
+        with open(_data_path(NEAR_DUPLICATE_FILE), 'w') as f:
+            json.dump({"entries": entries, "updated_at": time.time()}, f)
+        return True
+    except Exception as e:
+        print(f"Error saving near-duplicate index: {e}")
+        return False
+
+def load_approved_events():
+    """Returns the stored approved-events state: {"events": [...], "version": n, "updated_at": ts}."""
+    approved_file = _data_path(APPROVED_EVENTS_FILE)
+    if os.path.exists(approved_file):
+        try:
+            with open(approved_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading approved events: {e}")
+            return {}
+    return {}
+
+def save_approved_events(state):
+    try:
+        # json.dumps runs the C encoder; json.dump streams through the pure-Python one
+        with open(_data_path(APPROVED_EVENTS_FILE), 'w') as f:
+            f.write(json.dumps(state))
+        return True
+    except Exception as e:
+        print(f"Error saving approved events: {e}")
+        return False
+
+def load_deferred_emails():
+    """Returns the emails put off to a later run: {msg_id: {"runs", "first_deferred", "reason", "score", ...}}."""
+    deferred_file = _data_path(DEFERRED_EMAILS_FILE)
+    if os.path.exists(deferred_file):
+        try:
+            with open(deferred_file, 'r') as f:
+                return json.load(f).get("emails", {})
+        except Exception as e:
+            print(f"Error loading deferred emails: {e}")
+            return {}
+    return {}
+
+def save_deferred_emails(emails):
+    try:
+        with open(_data_path(DEFERRED_EMAILS_FILE), 'w') as f:
+            json.dump({"emails": emails, "updated_at": time.time()}, f)
+        return True
+    except Exception as e:
+        print(f"Error saving deferred emails: {e}")
+        return False
+
+def get_gmail_history_id():
+    """The Gmail historyId the last push-triggered sync read up to, or None."""
+    history_file = _data_path(GMAIL_HISTORY_FILE)
+    if os.path.exists(history_file):
+        try:
+            with open(history_file, 'r') as f:
+                return json.load(f).get("history_id")
+        except Exception as e:
+            print(f"Error loading Gmail history state: {e}")
+            return None
+    return None
+
+def save_gmail_history_id(history_id):
+    try:
+        with open(_data_path(GMAIL_HISTORY_FILE), 'w') as f:
+            json.dump({"history_id": str(history_id), "updated_at": time.time()}, f)
+        return True
+    except Exception as e:
+        print(f"Error saving Gmail history state: {e}")
+        return False
+
+# Config pinned in-process (offline replay), bypassing the Gist entirely
+_pinned_config = None
+
+# Last config seen per Gist id: {gist_id: (fetched_at, config)}. Saves go
+# through save_config, which refreshes the entry, so a short TTL only delays
+# edits made directly on the Gist.
+CONFIG_CACHE_SECONDS = float(os.getenv("CONFIG_CACHE_SECONDS", "300"))
+_config_cache = {}
+_config_cache_lock = threading.Lock()
+
+def _config_gist_id():
+    tenant = get_active_tenant()
+    return tenant.config_gist_id if tenant is not None and tenant.config_gist_id else CONFIG_GIST_ID
+
+def invalidate_config_cache():
+    with _config_cache_lock:
+        _config_cache.clear()
+
+def pin_config(config_data):
+    """Serve `config_data` from load_config() without any network access. Pass None to unpin."""
+    global _pinned_config
+    _pinned_config = config_data
+
+@metrics.timed("load_config")
+def load_config(max_age=None):
+    """
+    Load config from GitHub Gist (or template as fallback).
+    A copy fetched within `max_age` seconds (default CONFIG_CACHE_SECONDS) is
+    reused; pass max_age=0 to force a fresh read.
+    """
+    if _pinned_config is not None:
+        return _pinned_config
+
+    tenant = get_active_tenant()
+    if tenant is not None and tenant.config is not None:
+        # Tenant carries its own config snapshot
+        return tenant.config
+    gist_id = _config_gist_id()
+
     # If GitHub credentials not configured, use template
-    if not GITHUB_TOKEN or not CONFIG_GIST_ID:
+    if not GITHUB_TOKEN or not gist_id:
         print("GitHub Gist not configured, using template")
         return load_template_config()
+
+    max_age = CONFIG_CACHE_SECONDS if max_age is None else max_age
+    with _config_cache_lock:
+        cached = _config_cache.get(gist_id)
+    if cached and time.time() - cached[0] < max_age:
+        metrics.inc("config.cache_hit")
+        return cached[1]
     
+    import requests
     try:
         headers = {
             "Authorization": f"token {GITHUB_TOKEN}",
             "Accept": "application/vnd.github.v3+json"
         }
-        url = f"https://api.github.com/gists/{CONFIG_GIST_ID}"
+        url = f"{GITHUB_API_URL}/gists/{gist_id}"
         
-        print(f"Loading config from Gist: {CONFIG_GIST_ID}")
+        print(f"Loading config from Gist: {gist_id}")
+        metrics.inc("gist.get")
         r = requests.get(url, headers=headers, timeout=10)
         r.raise_for_status()
         
@@ -77,6 +287,8 @@ def load_config():
         config_content = gist_data["files"]["config.json"]["content"]
         config = json.loads(config_content)
         print("Successfully loaded config from Gist")
+        with _config_cache_lock:
+            _config_cache[gist_id] = (time.time(), config)
         return config
         
     except requests.exceptions.RequestException as e:
@@ -88,17 +300,20 @@ def load_config():
 
 def save_config(config_data):
     """Save config to GitHub Gist."""
+    gist_id = _config_gist_id()
+
     # If GitHub credentials not configured, cannot save
-    if not GITHUB_TOKEN or not CONFIG_GIST_ID:
+    if not GITHUB_TOKEN or not gist_id:
         print("GitHub Gist not configured, cannot save")
         return False
     
+    import requests
     try:
         headers = {
             "Authorization": f"token {GITHUB_TOKEN}",
             "Accept": "application/vnd.github.v3+json"
         }
-        url = f"https://api.github.com/gists/{CONFIG_GIST_ID}"
+        url = f"{GITHUB_API_URL}/gists/{gist_id}"
         
         payload = {
             "files": {
@@ -108,11 +323,14 @@ def save_config(config_data):
             }
         }
         
-        print(f"Saving config to Gist: {CONFIG_GIST_ID}")
+        print(f"Saving config to Gist: {gist_id}")
+        metrics.inc("gist.patch")
         r = requests.patch(url, headers=headers, json=payload, timeout=10)
         r.raise_for_status()
         
         print("Successfully saved config to Gist")
+        with _config_cache_lock:
+            _config_cache[gist_id] = (time.time(), config_data)
         return True
         
     except requests.exceptions.RequestException as e:
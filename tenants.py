@@ -0,0 +1,182 @@
+"""
+Multi-household fan-out.
+
+Tenants are listed in tenants.json on the persistent disk:
+
+    [
+        {"id": "dewsbery", "name": "Dewsbery family",
+         "token_path": "/var/data/tenants/dewsbery/token.json",
+         "calendar_id": "abc@group.calendar.google.com",
+         "config_gist_id": "...",          # or "config_path": "...json" for a local snapshot
+         "calls_per_minute": 120}
+    ]
+
+Each tenant gets its own credentials, calendar, config and state directory.
+run_all_tenants() processes them on a bounded worker pool, least recently
+served first, with a per-tenant API quota. Without tenants.json the app
+keeps running the single default household.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from state_manager import PERSISTENT_DIR, set_active_tenant
+
+TENANTS_FILE = os.path.join(PERSISTENT_DIR, "tenants.json")
+TENANT_WORKERS = int(os.getenv("TENANT_WORKERS", "4"))
+DEFAULT_CALLS_PER_MINUTE = int(os.getenv("TENANT_CALLS_PER_MINUTE", "240"))
+
+class Tenant:
+    def __init__(self, id, name=None, token_path=None, credentials_path=None, calendar_id=None,
+                 config_gist_id=None, config_path=None, calls_per_minute=None, data_dir=None):
+        self.id = id
+        self.name = name or id
+        self.data_dir = data_dir or os.path.join(PERSISTENT_DIR, "tenants", id)
+        self.token_path = token_path or os.path.join(self.data_dir, "token.json")
+        self.credentials_path = credentials_path or "credentials.json"
+        self.calendar_id = calendar_id
+        self.config_gist_id = config_gist_id
+        self.config = None
+        if config_path:
+            # Snapshot the config at load time so a run sees one consistent version
+            with open(config_path) as f:
+                self.config = json.load(f)
+        self.limiter = QuotaLimiter(calls_per_minute or DEFAULT_CALLS_PER_MINUTE)
+
+class QuotaLimiter:
+    """Token bucket: allows `calls_per_minute` with bursts up to the same size. Thread safe."""
+
+    def __init__(self, calls_per_minute):
+        self.rate = calls_per_minute / 60.0
+        self.capacity = float(calls_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                self.waited += wait
+            time.sleep(wait)
+
+class QuotaService:
+    """
+    Wraps a googleapiclient-style service so every .execute() first takes a
+    token from the tenant's limiter. Method chains are wrapped transparently.
+    """
+
+    def __init__(self, target, limiter):
+        self._target = target
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == "execute":
+            def execute(*args, **kwargs):
+                self._limiter.acquire()
+                return attr(*args, **kwargs)
+            return execute
+        if callable(attr):
+            def call(*args, **kwargs):
+                return QuotaService(attr(*args, **kwargs), self._limiter)
+            return call
+        return attr
+
+def load_tenants():
+    """Returns the configured tenants, or [] when running single-household."""
+    if not os.path.exists(TENANTS_FILE):
+        return []
+    try:
+        with open(TENANTS_FILE) as f:
+            return [Tenant(**entry) for entry in json.load(f)]
+    except Exception as e:
+        print(f"Error loading tenants: {e}")
+        return []
+
+# Per-tenant report of the most recent fan-out, plus when each tenant was last served
+tenant_report = {}
+_last_started = {}
+_running = set()
+_running_lock = threading.Lock()
+
+def _run_tenant(tenant, enqueued_at, log_callback, event_callback, build_services):
+    from etl_pipeline import run_pipeline
+
+    started_at = time.time()
+    entry = tenant_report[tenant.id]
+    entry.update({"status": "RUNNING", "started_at": started_at, "queue_lag_seconds": round(started_at - enqueued_at, 3)})
+    _last_started[tenant.id] = started_at
+
+    def tenant_log(message):
+        log_callback(f"[{tenant.name}] {message}")
+
+    def tenant_event(event):
+        event.tenant_id = tenant.id
+        if event_callback:
+            event_callback(event)
+
+    set_active_tenant(tenant)
+    try:
+        services = build_services(tenant)
+        gmail_factory = services.pop("gmail_factory", None)
+        services = {name: QuotaService(service, tenant.limiter) for name, service in services.items()}
+        if gmail_factory:
+            services["gmail_factory"] = lambda: QuotaService(gmail_factory(), tenant.limiter)
+        run_pipeline(log_callback=tenant_log, event_callback=tenant_event, services=services)
+        entry["status"] = "SUCCESS"
+    except Exception as e:
+        entry["status"] = f"FAILED: {e}"
+        tenant_log(f"Tenant run failed: {e}")
+    finally:
+        set_active_tenant(None)
+        finished_at = time.time()
+        entry.update({"finished_at": finished_at, "duration_seconds": round(finished_at - started_at, 3),
+                      "quota_wait_seconds": round(tenant.limiter.waited, 3)})
+        with _running_lock:
+            _running.discard(tenant.id)
+
+def _default_services(tenant):
+    from googleapiclient.discovery import build
+    from etl_pipeline import get_credentials
+
+    creds = get_credentials()
+    return {"gmail": build('gmail', 'v1', credentials=creds), "calendar": build('calendar', 'v3', credentials=creds),
+            "gmail_factory": lambda: build('gmail', 'v1', credentials=creds)}
+
+def run_all_tenants(tenants=None, log_callback=print, event_callback=None, max_workers=None, build_services=None):
+    """
+    Runs the pipeline for every tenant on a bounded pool and returns the
+    per-tenant report (queue lag, duration, quota wait, status).
+    """
+    tenants = load_tenants() if tenants is None else tenants
+    build_services = build_services or _default_services
+
+    # Fair ordering: whoever was served longest ago goes first.
+    # A tenant still running from an earlier fan-out is not queued twice.
+    with _running_lock:
+        queue = [t for t in sorted(tenants, key=lambda t: _last_started.get(t.id, 0)) if t.id not in _running]
+        _running.update(t.id for t in queue)
+
+    enqueued_at = time.time()
+    for tenant in queue:
+        tenant_report[tenant.id] = {"name": tenant.name, "status": "QUEUED", "enqueued_at": enqueued_at}
+
+    log_callback(f"Fan-out: {len(queue)} tenant(s) on {max_workers or TENANT_WORKERS} worker(s)")
+    with ThreadPoolExecutor(max_workers=max_workers or TENANT_WORKERS, thread_name_prefix="tenant") as pool:
+        for tenant in queue:
+            pool.submit(_run_tenant, tenant, enqueued_at, log_callback, event_callback, build_services)
+
+    total = time.time() - enqueued_at
+    lags = [tenant_report[t.id].get("queue_lag_seconds", 0) for t in queue]
+    log_callback(f"Fan-out complete in {total:.1f}s, max queue lag {max(lags) if lags else 0:.1f}s")
+    return {t.id: tenant_report[t.id] for t in queue}
@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+# State files go to a scratch directory, never the repo or /var/data
+os.environ.setdefault("ETL_DATA_DIR", tempfile.mkdtemp(prefix="etl_tests_"))
+os.environ.setdefault("GEMINI_RATE_LIMIT_SECONDS", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import shutil
+
+import pytest
+
+@pytest.fixture
+def data_dir():
+    """The scratch state directory, emptied before the test."""
+    path = os.environ["ETL_DATA_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+@pytest.fixture
+def config(data_dir):
+    """The template config, served by load_config() without touching the Gist."""
+    import state_manager
+    with open(os.path.join(state_manager.BASE_DIR, "config.template.json")) as f:
+        config_data = json.load(f)
+    state_manager.pin_config(config_data)
+    yield config_data
+    state_manager.pin_config(None)
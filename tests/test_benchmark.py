@@ -0,0 +1,33 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _bench(tmp_path, *args):
+    out = tmp_path / "bench.json"
+    subprocess.run([sys.executable, os.path.join(REPO, "benchmark.py"), "--sizes", "40", "--no-memory",
+                    "--out", str(out), *args], check=True, cwd=REPO, capture_output=True, text=True)
+    with open(out) as f:
+        return json.load(f)
+
+
+def test_benchmark_runs_offline_and_records_stages(tmp_path):
+    results = _bench(tmp_path)
+    run = results["runs"][0]
+    assert run["status"] == "success"
+    assert run["size"] == 40
+    assert run["events_queued"] > 0
+    assert run["service_stats"]["gmail"]["messages.get"] > 0
+    assert {"load_config", "extract_emails", "gmail_get", "load_to_calendar"} <= set(run["stages"])
+    for stage in run["stages"].values():
+        assert stage["p50"] <= stage["p95"] <= stage["p99"] <= stage["max"]
+
+
+def test_benchmark_is_repeatable_for_a_seed(tmp_path):
+    first = _bench(tmp_path, "--seed", "3")["runs"][0]
+    second = _bench(tmp_path, "--seed", "3")["runs"][0]
+    assert first["events_queued"] == second["events_queued"]
+    assert first["service_stats"]["gmail"] == second["service_stats"]["gmail"]
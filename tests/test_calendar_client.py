@@ -0,0 +1,91 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import calendar_client
+from calendar_client import event_id_for, event_lock, upsert_event
+from fake_services import FakeCalendarService, FaultProfile
+from records import CandidateEvent, PendingEvent
+
+class _CountingStore(dict):
+    """The fake calendar's store, counting how often each id is created."""
+
+    def __init__(self):
+        super().__init__()
+        self.created = Counter()
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.created[key] += 1
+        super().__setitem__(key, value)
+
+def _pending(n):
+    events = []
+    for i in range(n):
+        candidate = CandidateEvent(f"Event {i}", start_time=f"2026-03-{i % 28 + 1:02d}T09:00:00",
+                                   end_time=f"2026-03-{i % 28 + 1:02d}T10:00:00", source_id=f"msg{i}")
+        events.append(PendingEvent(event_id_for(candidate), candidate.event_title,
+                                   candidate.start_time, candidate.end_time))
+    return events
+
+def test_concurrent_approvals_through_lost_responses_insert_once():
+    calendar = FakeCalendarService(FaultProfile(seed=7, timeout_rate=0.3))
+    calendar.store = _CountingStore()
+    pending = _pending(40)
+    failures = []
+
+    def approve(event):
+        try:
+            with event_lock(event.id):
+                upsert_event(calendar, "test", event.calendar_body(), retries=8, backoff=0)
+        except Exception as e:
+            failures.append(e)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(approve, pending * 3))  # every approval clicked three times at once
+        list(pool.map(approve, pending))      # then the whole batch retried
+
+    assert calendar.stats.get("timeouts")  # responses really were lost
+    assert not failures
+    assert set(calendar.store) == {event.id for event in pending}
+    assert all(calendar.store.created[event.id] == 1 for event in pending)
+
+def test_event_locks_are_released():
+    started, release = threading.Event(), threading.Event()
+
+    def hold():
+        with event_lock("abc"):
+            started.set()
+            release.wait()
+
+    worker = threading.Thread(target=hold)
+    worker.start()
+    started.wait()
+    assert "abc" in calendar_client._locks
+    release.set()
+    worker.join()
+    for i in range(100):
+        with event_lock(f"id{i}"):
+            pass
+    assert calendar_client._locks == {}
+
+def test_portal_events_on_different_dates_get_their_own_ids():
+    url = "https://app.weduc.co.uk/calendar/event"
+    monday = CandidateEvent("Swimming", start_time="2026-03-02T09:00:00", source_url=url)
+    next_monday = CandidateEvent("Swimming", start_time="2026-03-09T09:00:00", source_url=url)
+    moved = CandidateEvent("Swimming", start_time="2026-03-02T13:00:00", source_url=url)
+    assert event_id_for(monday) != event_id_for(next_monday)
+    assert event_id_for(monday) == event_id_for(moved)
+
+def test_same_title_twice_in_one_message_gets_two_ids():
+    first = CandidateEvent("Swimming", start_time="2026-03-02T09:00:00", source_id="msg1")
+    second = CandidateEvent("Swimming", start_time="2026-03-09T09:00:00", source_id="msg1")
+    again = CandidateEvent("swimming ", start_time="2026-03-02T10:30:00", source_id="msg1")
+    assert event_id_for(first) != event_id_for(second)
+    # Re-extracting the same message (e.g. a different time read) keeps the id
+    assert event_id_for(first) == event_id_for(again)
+
+def test_invite_updates_keep_their_id():
+    original = CandidateEvent("Sports Day", start_time="2026-06-10T09:00:00", source_id="ics:abc@school")
+    moved = CandidateEvent("Sports Day", start_time="2026-06-12T09:00:00", source_id="ics:abc@school")
+    assert event_id_for(original) == event_id_for(moved)
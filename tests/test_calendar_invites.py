@@ -0,0 +1,38 @@
+import random
+from datetime import datetime
+
+import etl_pipeline
+from calendar_client import event_id_for
+from fake_services import FakeCalendarService, generate_ics
+from heuristics import heuristic_extraction
+from ics_parser import calendar_cancellations, calendar_candidates
+from records import Message
+
+BODY = ("Football training has been cancelled.\n\nSaturday 21 November 2026 at 10:00am\n\n"
+        "Goals Wimbledon, Beverley Way, London\n\nSee you next week, Tristan Dewsbery and the U9s")
+
+def _invite(shape, msg_id):
+    ics = generate_ics(random.Random(1), "training-2026-11-21@spond.com", "Football training",
+                       datetime(2026, 11, 21, 10, 0), shape)
+    subject = ("Cancelled: " if shape == "cancel" else "") + "Football training"
+    return Message(msg_id, subject, "Spond <noreply@spond.com>", BODY, (ics,))
+
+def _process(emails, config):
+    queued = []
+    etl_pipeline.process_emails(emails, config, FakeCalendarService(), log_callback=lambda msg: None,
+                                event_callback=queued.append)
+    return queued
+
+def test_cancelled_invite_queues_nothing(config):
+    email = _invite("cancel", "18c2f0a1b2c3d4e5")
+    # The text alone would read as an event on the cancelled date
+    assert heuristic_extraction(email.body, email.subject, email.id, config) is not None
+    assert calendar_candidates(email) == []
+    assert [c.start_time for c in calendar_cancellations(email)] == ["2026-11-21T10:00:00"]
+    assert _process([email], config) == []
+
+def test_cancellation_refers_to_the_original_invite(config):
+    invite, cancel = _invite("spond", "18c2f0a1b2c3d4e4"), _invite("cancel", "18c2f0a1b2c3d4e5")
+    [queued] = _process([invite], config)
+    assert queued.start_time == "2026-11-21T10:00:00"
+    assert [event_id_for(c) for c in calendar_cancellations(cancel)] == [queued.id]
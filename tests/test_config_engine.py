@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+import state_manager
+from config_engine import build_gmail_queries, diff_config, exclusion_terms, search_terms, split_query_terms
+from fake_services import FakeGistServer, FakeGmailService, generate_mailbox
+from gmail_client import list_message_ids
+
+
+def _template():
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.template.json")) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def gist(monkeypatch):
+    with FakeGistServer(_template()) as server:
+        monkeypatch.setattr(state_manager, "GITHUB_TOKEN", "test")
+        monkeypatch.setattr(state_manager, "CONFIG_GIST_ID", server.gist_id)
+        monkeypatch.setattr(state_manager, "GITHUB_API_URL", server.url)
+        state_manager.invalidate_config_cache()
+        yield server
+        state_manager.invalidate_config_cache()
+
+
+def test_diff_config_lists_changed_paths():
+    old = {"a": 1, "b": {"c": [1], "d": "x"}}
+    new = {"a": 1, "b": {"c": [1, 2]}, "e": True}
+    assert diff_config(old, new) == ["b.c", "b.d", "e"]
+    assert diff_config(old, json.loads(json.dumps(old))) == []
+
+
+def test_fresh_read_sees_an_edit_made_elsewhere(gist):
+    cached = state_manager.load_config()
+    edited = dict(cached, edited_elsewhere=True)
+    gist.content = json.dumps(edited)
+
+    # The cached copy hides the edit; the settings save diffs against a fresh read
+    assert diff_config(state_manager.load_config(), edited) == ["edited_elsewhere"]
+    assert diff_config(state_manager.load_config(max_age=0), edited) == []
+    assert gist.stats["gist.get"] == 2
+
+
+def test_split_keeps_every_term_in_order_within_the_bound():
+    terms = [f"term number {i}" for i in range(40)]
+    groups = split_query_terms(terms, max_chars=120)
+    assert len(groups) > 1
+    assert [t for group in groups for t in group] == terms
+    for group in groups:
+        assert len("(" + " OR ".join(f'"{t}"' for t in group) + ")") <= 120
+
+
+def test_term_longer_than_the_bound_gets_its_own_group():
+    groups = split_query_terms(["a", "x" * 50, "b"], max_chars=20)
+    assert groups == [["a"], ["x" * 50], ["b"]]
+
+
+def test_search_terms_drop_case_duplicates():
+    config = {"search_settings": {"children": ["Tristan"], "schools": ["Bishop Gilpin"], "clubs": ["tristan", "Spond"]}}
+    assert search_terms(config) == ["Tristan", "Bishop Gilpin", "Spond"]
+
+
+def test_every_sub_query_carries_the_exclusions():
+    config = _template()
+    queries = build_gmail_queries(config, max_chars=60)
+    exclusions = " ".join(f"-{e}" for e in exclusion_terms(config))
+    assert len(queries) > 1
+    for query in queries:
+        assert query["q"].endswith(exclusions)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_sub_queries_find_what_the_single_query_finds(workers):
+    config = _template()
+    gmail = FakeGmailService(generate_mailbox(200, seed=9))
+    single, _ = list_message_ids(gmail, build_gmail_queries(config, max_chars=100000))
+    split, results = list_message_ids(gmail, build_gmail_queries(config, max_chars=60), workers=workers,
+                                      service_factory=lambda: gmail)
+    assert len(results) > 1
+    assert sorted(split) == sorted(single)
+    assert len(split) == len(set(split))
+    assert sum(r["new_ids"] for r in results) == len(split)
@@ -0,0 +1,57 @@
+import context_selector
+from context_selector import CHARS_PER_TOKEN, prompt_targets, select_context
+
+CONTEXT = {"children": ["Tristan Dewsbery"], "keywords": ["Sports Day", "Trip"], "year_groups": ["Year 3"], "clubs": []}
+
+FILLER = "The library has new books and the garden club planted bulbs along the fence. "
+
+
+def _newsletter(notice, position, paragraphs=200):
+    body = [FILLER] * paragraphs
+    body.insert(position, notice)
+    return "".join(body)
+
+
+def test_short_email_goes_through_whole():
+    text = "Sports Day is on 12 June.   Bring a hat."
+    selected, stats = select_context(text, CONTEXT, token_budget=100)
+    assert selected == "Sports Day is on 12 June. Bring a hat."
+    assert stats["windows"] == 0
+
+
+def test_buried_notice_is_kept_within_the_budget():
+    notice = "Year 3 Trip to Kew Gardens on 14th May, reply before Friday. "
+    text = _newsletter(notice, 150)
+    selected, stats = select_context(text, CONTEXT, token_budget=200)
+    assert notice.strip() in selected
+    assert notice not in text[:4000]
+    # Snapping to word boundaries and the gap markers may run slightly over
+    assert len(selected) <= 200 * CHARS_PER_TOKEN + 40
+    assert selected.startswith(text[:100])
+    assert "[...]" in selected
+    assert set(stats["matched"]) == {"year 3", "trip"}
+
+
+def test_no_anchors_falls_back_to_the_opening():
+    text = FILLER * 100
+    selected, _ = select_context(text, CONTEXT, token_budget=50)
+    assert selected == text.strip()[:50 * CHARS_PER_TOKEN]
+
+
+def test_windows_stay_in_document_order():
+    first = "Sports Day on 3rd June for Year 3. "
+    second = "Trip to Wisley on 20th June for Tristan. "
+    text = FILLER * 20 + first + FILLER * 60 + second + FILLER * 20
+    selected, _ = select_context(text, CONTEXT, token_budget=300)
+    assert selected.index("3rd June") < selected.index("20th June")
+
+
+def test_prompt_targets_keep_only_mentioned_keywords():
+    targets = prompt_targets(CONTEXT, {"sports day"})
+    assert targets == {"children": ["Tristan Dewsbery"], "keywords": ["Sports Day"], "year_groups": []}
+
+
+def test_keyword_pattern_is_cached_per_plan_version():
+    pattern = context_selector._keyword_pattern(CONTEXT, version="v1")
+    assert context_selector._keyword_pattern({"children": ["Someone Else"]}, version="v1") is pattern
+    assert context_selector._keyword_pattern({"children": ["Someone Else"]}, version="v2") is not pattern
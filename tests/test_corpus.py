@@ -0,0 +1,64 @@
+import json
+
+import corpus
+from etl_pipeline import extract_emails
+from fake_services import FakeGmailService, generate_mailbox
+
+
+def _capture(path, size=40, seed=42):
+    gmail = FakeGmailService(generate_mailbox(size, seed=seed, ics_ratio=0.2))
+    return extract_emails(gmail, capture_path=str(path))
+
+
+def test_capture_round_trips_fetched_messages(config, tmp_path):
+    path = tmp_path / "corpus.jsonl.gz"
+    emails = _capture(path)
+    records = list(corpus.read_corpus(path))
+    assert [r["id"] for r in records] == [e.id for e in emails]
+    assert records[0]["subject"] == emails[0].subject
+
+
+def test_appended_captures_read_as_one_stream(config, tmp_path):
+    path = tmp_path / "corpus.jsonl.gz"
+    first = _capture(path, size=10, seed=1)
+    second = _capture(path, size=10, seed=2)
+    assert len(list(corpus.read_corpus(path))) == len(first) + len(second)
+
+
+def test_replay_is_repeatable_and_diffs_clean(config, tmp_path):
+    path = tmp_path / "corpus.jsonl.gz"
+    _capture(path)
+    before = corpus.replay_corpus(path)
+    after = corpus.replay_corpus(path)
+    assert before["events"] > 0
+    assert before["outcomes"] == after["outcomes"]
+    assert corpus.diff_reports(before, after)["identical_events"]
+
+
+def test_diff_reports_added_removed_and_changed():
+    event = {"summary": "Sports Day", "start": "2026-06-01T10:00:00"}
+    before = {"outcomes": {"a": {"outcome": "event", "event": event},
+                           "b": {"outcome": "no_date"},
+                           "c": {"outcome": "event", "event": event}}}
+    after = {"outcomes": {"a": {"outcome": "screened_out"},
+                          "b": {"outcome": "event", "event": event},
+                          "c": {"outcome": "event", "event": {**event, "start": "2026-06-02T10:00:00"}}}}
+    result = corpus.diff_reports(before, after)
+    assert not result["identical_events"]
+    assert [r["id"] for r in result["removed"]] == ["a"]
+    assert [r["id"] for r in result["added"]] == ["b"]
+    assert [r["id"] for r in result["changed"]] == ["c"]
+
+
+def test_diff_command_fails_when_events_differ(config, tmp_path):
+    path = tmp_path / "corpus.jsonl.gz"
+    _capture(path)
+    before, after = tmp_path / "before.json", tmp_path / "after.json"
+    assert corpus.main(["replay", str(path), "--out", str(before)]) == 0
+    assert corpus.main(["diff", str(before), str(before)]) == 0
+
+    report = corpus.replay_corpus(path)
+    msg_id = next(i for i, o in report["outcomes"].items() if o["outcome"] == "event")
+    report["outcomes"][msg_id] = {"outcome": "no_date"}
+    after.write_text(json.dumps(report))
+    assert corpus.main(["diff", str(before), str(after)]) == 1
@@ -0,0 +1,92 @@
+import json
+import os
+
+import pytest
+
+import metrics
+from extraction_router import ExtractionRouter, estimate_tokens
+from heuristics import heuristic_extraction
+from records import CandidateEvent, Message
+
+
+@pytest.fixture
+def template():
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.template.json")) as f:
+        return json.load(f)
+
+
+CLEAR = ("Year 3 Trip to Kew", "Tristan Dewsbery class visits Kew on 14 May at 9:30.")
+TWO_DATES = ("Year 3 Trip", "Tristan trip on 14 May, or 21 May if wet, 9:30")
+RELATIVE = ("Year 3 Trip", "Tristan trip next Friday")
+
+
+def _route(router, subject, body, config, **kwargs):
+    email = Message("m1", subject, "office@school.org", body)
+    return router.route(email, heuristic_extraction(body, subject, email.id, config), **kwargs)
+
+
+@pytest.mark.parametrize("subject, body", [CLEAR, ("Newsletter", "Nothing dated here")])
+def test_heuristic_extraction_is_timed_once_per_call(template, subject, body):
+    metrics.start_run()
+    heuristic_extraction(body, subject, "m1", template)
+    snapshot = metrics.finish_run()
+    assert snapshot["timers"]["heuristic_extraction"]["count"] == 1
+
+
+@pytest.mark.parametrize("subject, body, confidence, reasons", [
+    (*CLEAR, 1.0, []),
+    (*TWO_DATES, 0.6, ["multiple_dates"]),
+    ("Year 3 Trip", "Tristan trip on 14 May", 0.8, ["no_time"]),
+    ("Year 3 Trip", "Tristan trip on 14/05 at 9:30", 0.9, ["numeric_date"]),
+    ("Boiler service", "Engineer visits on 14 May at 9:30", 0.7, ["no_child"]),
+])
+def test_confidence_penalties(template, subject, body, confidence, reasons):
+    event = heuristic_extraction(body, subject, "m1", template)
+    assert event.confidence == pytest.approx(confidence)
+    assert event.reasons == reasons
+
+
+def test_only_ambiguous_emails_are_escalated(template):
+    asked = []
+    router = ExtractionRouter(lambda email: asked.append(email.id) or (None, {}), template, budget=5)
+    assert _route(router, *CLEAR, template)[1] == "heuristic"
+    assert _route(router, "Boiler service", "Engineer visits on 14 May", template)[1] == "heuristic"  # no child
+    assert _route(router, "Newsletter", "Nothing dated here", template)[1] == "no_date"
+    assert _route(router, *TWO_DATES, template)[1] == "escalated"
+    assert _route(router, *RELATIVE, template)[1:] == ("escalated", ["relative_date"])
+    assert len(asked) == 2
+
+
+def test_call_budget_defers_or_keeps_the_heuristic_result(template):
+    llm = CandidateEvent("Trip", "2026-05-21T09:30:00")
+    router = ExtractionRouter(lambda email: (llm, {}), template, budget=1)
+    event, decision, _ = _route(router, *TWO_DATES, template)
+    assert (event, decision) == (llm, "escalated")
+
+    event, decision, _ = _route(router, *TWO_DATES, template)
+    assert decision == "over_budget"
+    assert event.start_time == "2026-05-14T09:30:00"
+
+    assert _route(router, *TWO_DATES, template, can_defer=True)[:2] == (None, "deferred")
+    report = router.report()
+    assert report["decisions"]["escalated"] == 1
+    assert report["llm"]["changed_outcome"] == 1
+
+
+def test_token_budget_limits_escalations(template):
+    email_tokens = estimate_tokens(Message("m1", TWO_DATES[0], "", TWO_DATES[1]))
+    router = ExtractionRouter(lambda email: (None, {}), template, budget=10, token_budget=email_tokens * 2)
+    decisions = [_route(router, *TWO_DATES, template)[1] for _ in range(3)]
+    assert decisions == ["escalated", "escalated", "over_budget"]
+    assert router.tokens == email_tokens * 2
+
+
+def test_gemini_failure_keeps_the_heuristic_result(template):
+    def broken(email):
+        raise RuntimeError("429 quota")
+
+    router = ExtractionRouter(broken, template, budget=5)
+    event, decision, _ = _route(router, *TWO_DATES, template)
+    assert decision == "escalated"
+    assert event.start_time == "2026-05-14T09:30:00"
+    assert router.report()["llm"]["failed"] == 1
@@ -0,0 +1,66 @@
+import pytest
+
+from fake_services import (FakeCalendarService, FakeGmailService, FakeHttpError, FaultProfile,
+                           generate_mailbox)
+
+
+def test_mailbox_is_deterministic_for_a_seed():
+    first = generate_mailbox(50, seed=7, ics_ratio=0.2, duplicate_ratio=0.2)
+    again = generate_mailbox(50, seed=7, ics_ratio=0.2, duplicate_ratio=0.2)
+    other = generate_mailbox(50, seed=8, ics_ratio=0.2, duplicate_ratio=0.2)
+    assert first == again
+    assert first != other
+    assert len({m["id"] for m in first}) == 50
+
+
+def test_gmail_lists_newest_first_and_pages():
+    gmail = FakeGmailService(generate_mailbox(30, noise_ratio=0.0))
+    ids = []
+    token = None
+    while True:
+        page = gmail.users().messages().list(userId="me", q="", maxResults=10, pageToken=token).execute()
+        ids += [m["id"] for m in page["messages"]]
+        token = page.get("nextPageToken")
+        if not token:
+            break
+    assert ids == sorted(ids, reverse=True)
+    assert len(ids) == 30
+    assert gmail.stats["messages.list"] == 3
+
+
+def test_gmail_get_formats():
+    gmail = FakeGmailService(generate_mailbox(3))
+    msg_id = gmail.order[0]
+    full = gmail.users().messages().get(userId="me", id=msg_id).execute()
+    raw = gmail.users().messages().get(userId="me", id=msg_id, format="raw").execute()
+    meta = gmail.users().messages().get(userId="me", id=msg_id, format="metadata", metadataHeaders=["Subject"]).execute()
+    assert "payload" in full and "raw" in raw
+    assert [h["name"] for h in meta["payload"]["headers"]] == ["Subject"]
+    with pytest.raises(FakeHttpError) as err:
+        gmail.users().messages().get(userId="me", id="missing").execute()
+    assert err.value.resp.status == 404
+
+
+def test_rate_limit_raises_429():
+    gmail = FakeGmailService(generate_mailbox(3), FaultProfile(rate_limit_per_minute=2))
+    request = lambda: gmail.users().messages().list(userId="me", q="").execute()
+    request()
+    request()
+    with pytest.raises(FakeHttpError) as err:
+        request()
+    assert err.value.status_code == 429
+    assert gmail.stats["429"] == 1
+
+
+def test_calendar_insert_conflict_and_lost_response():
+    calendar = FakeCalendarService(FaultProfile(timeout_rate=1.0, seed=1))
+    body = {"id": "abc123", "summary": "Sports Day",
+            "start": {"dateTime": "2026-06-01T10:00:00"}, "end": {"dateTime": "2026-06-01T11:00:00"}}
+    # The write lands even though the caller never sees the response
+    with pytest.raises(TimeoutError):
+        calendar.events().insert(calendarId="c", body=body).execute()
+    assert "abc123" in calendar.store
+    with pytest.raises(FakeHttpError) as err:
+        calendar.events().insert(calendarId="c", body=body).execute()
+    assert err.value.status_code == 409
+    assert calendar.stats["timeouts"] == 1
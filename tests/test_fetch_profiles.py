@@ -0,0 +1,66 @@
+import pytest
+
+import gmail_client
+from fake_services import FakeGmailService, generate_mailbox
+
+
+class _RecordingGmail(FakeGmailService):
+    def __init__(self, messages):
+        super().__init__(messages)
+        self.formats = []
+
+    def get(self, userId="me", id=None, format="full", fields=None, **kwargs):
+        self.formats.append(format)
+        return super().get(userId=userId, id=id, format=format, fields=fields, **kwargs)
+
+
+def _invite_id(gmail):
+    return next(mid for mid in gmail.order
+                if any(p.get("filename") for p in gmail.mailbox[mid]["payload"].get("parts", [])))
+
+
+@pytest.fixture
+def gmail():
+    return _RecordingGmail(generate_mailbox(20, seed=5, noise_ratio=0.0, quoted_thread_ratio=0.0, ics_ratio=0.5))
+
+
+@pytest.mark.parametrize("profile", gmail_client.FETCH_PROFILES)
+def test_every_profile_reads_the_same_message(gmail, profile):
+    msg_id = _invite_id(gmail)
+    reference = gmail_client.fetch_email(gmail, msg_id, profile="full")
+    email = gmail_client.fetch_email(gmail, msg_id, profile=profile)
+    assert email["subject"] == reference["subject"]
+    assert email["sender"] == reference["sender"]
+    assert email["body"].strip() == reference["body"].strip()
+    assert email["calendar"] == reference["calendar"] != []
+
+
+def test_raw_checks_the_size_estimate_first(gmail):
+    gmail_client.fetch_email(gmail, gmail.order[0], profile="raw")
+    assert gmail.formats == ["minimal", "raw"]
+
+
+def test_large_message_falls_back_to_partial(gmail, monkeypatch):
+    msg_id = _invite_id(gmail)
+    monkeypatch.setattr(gmail_client, "RAW_MAX_SIZE_ESTIMATE", 100)
+    email = gmail_client.fetch_email(gmail, msg_id, profile="raw")
+    assert gmail.formats == ["minimal", "full"]
+    # The invite is still found through the attachment fetch
+    assert email["calendar"]
+
+
+def test_screened_uses_the_metadata_size(gmail, monkeypatch):
+    monkeypatch.setattr(gmail_client, "RAW_MAX_SIZE_ESTIMATE", 100)
+    gmail_client.fetch_email(gmail, gmail.order[0], profile="screened")
+    assert gmail.formats == ["metadata", "full"]
+
+
+def test_screened_skips_the_body_of_ignored_mail(gmail):
+    email = gmail_client.fetch_email(gmail, gmail.order[0], profile="screened", screen=lambda subject: "IGNORE")
+    assert gmail.formats == ["metadata"]
+    assert email["body"] == ""
+
+
+def test_unknown_profile_is_rejected(gmail):
+    with pytest.raises(ValueError):
+        gmail_client.fetch_email(gmail, gmail.order[0], profile="fast")
@@ -0,0 +1,43 @@
+import json
+import os
+
+import heuristic_pool
+from fake_services import FakeGmailService, generate_mailbox
+from gmail_client import fetch_email
+from records import Message
+
+
+def _emails(size):
+    gmail = FakeGmailService(generate_mailbox(size, seed=11))
+    emails = []
+    for msg_id in gmail.order:
+        email = fetch_email(gmail, msg_id, profile="full")
+        emails.append(Message(email["id"], email["subject"], email["sender"], email["body"], tuple(email["calendar"])))
+    return emails
+
+
+def _config():
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.template.json")) as f:
+        return json.load(f)
+
+
+def _comparable(results):
+    return [(pre, event.to_dict() if event else None) for pre, event in results]
+
+
+def test_pool_matches_the_serial_stage_in_order():
+    emails, config = _emails(40), _config()
+    serial = heuristic_pool.run_heuristic_stage(emails, config, workers=1)
+    pooled = heuristic_pool.run_heuristic_stage(emails, config, workers=2)
+    assert len(pooled) == len(emails)
+    assert _comparable(pooled) == _comparable(serial)
+    assert any(event for _, event in serial) and any(pre == "IGNORE" for pre, _ in serial)
+
+
+def test_small_batches_stay_in_process(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("pool started for a small batch")
+
+    monkeypatch.setattr(heuristic_pool, "ProcessPoolExecutor", no_pool)
+    emails = _emails(5)
+    assert len(heuristic_pool.run_heuristic_stage(emails, _config(), workers=4)) == 5
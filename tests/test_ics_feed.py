@@ -0,0 +1,42 @@
+import re
+
+import ics_feed
+from ics_feed import ApprovedFeed, feed_authorized, ics_time, render_vevent
+from records import PendingEvent
+
+def _event(id="evt1", start="2026-11-21T10:00:00", end="2026-11-21T11:00:00", zone="Europe/London", **kwargs):
+    return PendingEvent(id, "Football training", start, end, time_zone=zone, **kwargs)
+
+def test_feed_needs_a_configured_token(monkeypatch):
+    monkeypatch.setattr(ics_feed, "FEED_TOKEN", None)
+    assert not feed_authorized(None) and not feed_authorized("")
+    monkeypatch.setattr(ics_feed, "FEED_TOKEN", "s3cret")
+    assert feed_authorized("s3cret")
+    assert not feed_authorized("wrong") and not feed_authorized(None)
+
+def test_london_times_keep_their_tzid():
+    assert ics_time("DTSTART", "2026-11-21T10:00:00", "Europe/London") == "DTSTART;TZID=Europe/London:20261121T100000"
+    assert ics_time("DTSTART", "2026-11-21T10:00:00", None) == "DTSTART;TZID=Europe/London:20261121T100000"
+    assert ics_time("DTSTART", "2026-11-21", "Europe/London") == "DTSTART;VALUE=DATE:20261121"
+
+def test_other_zones_are_written_in_utc():
+    assert ics_time("DTSTART", "2026-11-21T10:00:00", "America/New_York") == "DTSTART:20261121T150000Z"
+    assert ics_time("DTSTART", "2026-07-01T10:00:00", "Europe/Berlin") == "DTSTART:20260701T080000Z"
+    # Unknown zone: read as Europe/London, like ics_parser does
+    assert ics_time("DTSTART", "2026-11-21T10:00:00", "Mars/Olympus") == "DTSTART;TZID=Europe/London:20261121T100000"
+
+def test_every_tzid_in_the_feed_has_a_vtimezone(data_dir):
+    feed = ApprovedFeed()
+    feed.add(_event("london"))
+    feed.add(_event("ny", zone="America/New_York",
+                    recurrence=["RRULE:FREQ=WEEKLY;COUNT=4", "EXDATE;TZID=America/New_York:20261128T100000"]))
+    body = feed.render()
+    vtimezones = set(re.findall(r"BEGIN:VTIMEZONE\r\nTZID:([^\r]+)", body))
+    assert set(re.findall(r";TZID=([^:;]+)", body)) <= vtimezones
+    assert "EXDATE:20261128T150000Z" in body
+
+def test_unreadable_times_are_left_out(data_dir):
+    assert render_vevent(_event(start="not a time"), 0) is None
+    feed = ApprovedFeed()
+    feed.add(_event(start="not a time"))
+    assert len(feed) == 0
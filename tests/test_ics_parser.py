@@ -0,0 +1,77 @@
+import random
+from datetime import datetime
+
+import etl_pipeline
+from fake_services import FakeCalendarService, generate_ics
+from ics_parser import calendar_candidates, is_calendar_part, parse_vevents, unfold_lines
+from records import Message
+
+
+def _ics(shape, start=datetime(2026, 1, 11, 10, 0), uid="training@spond.com", title="Training at Goals"):
+    return generate_ics(random.Random(3), uid, title, start, shape)
+
+
+def test_folded_lines_and_escapes():
+    # Only the one leading space or tab of a continuation line is dropped
+    assert unfold_lines("SUMMARY:Long\r\n  title\r\n\tcontinued\r\nEND:VEVENT") == ["SUMMARY:Long titlecontinued", "END:VEVENT"]
+    [event] = parse_vevents(_ics("spond"))
+    # The description is longer than one folded line and has escaped commas
+    assert "trainers or astro boots; studded boots are not allowed. If you would like" in event.description
+    assert "contribution of £5 on the day, please" in event.description
+
+
+def test_tzid_times_are_kept_in_their_zone():
+    [event] = parse_vevents(_ics("spond"), msg_id="m1")
+    assert event.start_time == "2026-01-11T10:00:00"
+    assert event.time_zone == "Europe/London"
+    assert event.source_id == "ics:training@spond.com"
+    assert event.gmail_url.endswith("#inbox/m1")
+
+
+def test_windows_zone_and_duration():
+    [event] = parse_vevents(_ics("outlook"))
+    assert event.time_zone == "Europe/London"
+    assert event.start_time == "2026-01-11T10:00:00"
+    assert event.end_time > event.start_time
+
+
+def test_utc_times_convert_to_london_summer_time():
+    series, moved = parse_vevents(_ics("google", start=datetime(2026, 6, 7, 10, 0)))
+    # 10:00Z is 11:00 BST
+    assert series.start_time == "2026-06-07T11:00:00"
+    assert series.recurrence[0] == "RRULE:FREQ=WEEKLY;COUNT=6;BYDAY=SU"
+    # The overridden instance is excluded from the series and stands on its own
+    assert "EXDATE:20260614T100000Z" in series.recurrence
+    assert moved.event_title.endswith("(moved)")
+    assert moved.start_time == "2026-06-14T12:00:00"
+    assert moved.recurrence is None
+    assert moved.source_id != series.source_id
+
+
+def test_all_day_events_are_dates():
+    [event] = parse_vevents(_ics("allday"))
+    assert (event.start_time, event.end_time) == ("2026-01-11", "2026-01-12")
+
+
+def test_invite_inline_and_attached_is_one_event():
+    ics = _ics("spond")
+    email = Message("m1", "Invitation: Training", "noreply@spond.com", "", (ics, ics))
+    assert len(calendar_candidates(email)) == 1
+
+
+def test_calendar_part_detection():
+    assert is_calendar_part("text/calendar")
+    assert is_calendar_part("application/octet-stream", "invite.ICS")
+    assert not is_calendar_part("text/plain", "notes.txt")
+
+
+def test_all_day_invite_is_queued_as_a_date_event(config):
+    email = Message("18c2f0a1b2c3d4e6", "Invitation: INSET day", "office@bishopgilpin.org",
+                    "Tristan Dewsbery: school closed for INSET.", (_ics("allday", title="INSET day"),))
+    queued = []
+    etl_pipeline.process_emails([email], config, FakeCalendarService(), log_callback=lambda msg: None,
+                                event_callback=queued.append)
+    [event] = queued
+    body = event.to_dict()
+    assert body["start"] == {"date": "2026-01-11"}
+    assert body["end"] == {"date": "2026-01-12"}
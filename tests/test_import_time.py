@@ -0,0 +1,25 @@
+import importlib.util
+
+import pytest
+
+import check_import_time
+
+
+@pytest.mark.parametrize("module", ["etl_pipeline", "heuristics", "state_manager", "portal_scanner", "tenants"])
+def test_entry_points_do_not_load_heavy_sdks(module):
+    _, heavy, _ = check_import_time.measure(module)
+    assert heavy == []
+
+
+@pytest.mark.skipif(importlib.util.find_spec("flask") is None, reason="flask not installed")
+def test_app_import_stays_light():
+    _, heavy, _ = check_import_time.measure("app")
+    assert heavy == []
+
+
+def test_measure_reports_a_heavy_import():
+    # Guards the check itself: a module that does pull in requests must be flagged
+    if importlib.util.find_spec("requests") is None:
+        pytest.skip("requests not installed")
+    _, heavy, _ = check_import_time.measure("requests")
+    assert heavy == ["requests"]
@@ -0,0 +1,44 @@
+import threading
+
+import metrics
+
+
+def test_observations_outside_a_run_go_to_unscoped(capsys):
+    assert metrics.current_run() is None
+    before = metrics.unscoped()["counters"].get("test.unscoped.calls", 0)
+
+    metrics.inc("test.unscoped.calls")
+    with metrics.stage("test_unscoped_stage"):
+        pass
+
+    snapshot = metrics.unscoped()
+    assert snapshot["run_id"] == "unscoped"
+    assert snapshot["counters"]["test.unscoped.calls"] == before + 1
+    assert snapshot["timers"]["test_unscoped_stage"]["count"] >= 1
+    assert "test_unscoped_stage" in capsys.readouterr().out
+
+
+def test_observations_inside_a_run_are_not_unscoped():
+    metrics.start_run("test-scoped")
+    try:
+        metrics.inc("test.scoped.calls", 2)
+    finally:
+        snapshot = metrics.finish_run()
+    assert snapshot["counters"]["test.scoped.calls"] == 2
+    assert "test.scoped.calls" not in metrics.unscoped()["counters"]
+
+
+def test_helper_thread_bound_to_the_run_is_attributed():
+    metrics.start_run("test-bound")
+    run = metrics.current_run()
+
+    def helper():
+        metrics.bind_run(run)
+        metrics.inc("test.helper.calls")
+
+    thread = threading.Thread(target=helper)
+    thread.start()
+    thread.join()
+    snapshot = metrics.finish_run()
+    assert snapshot["counters"]["test.helper.calls"] == 1
+    assert "test.helper.calls" not in metrics.unscoped()["counters"]
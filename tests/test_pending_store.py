@@ -0,0 +1,71 @@
+import threading
+
+from pending_store import PendingStore
+from records import PendingEvent
+
+
+def _event(event_id, start):
+    return PendingEvent(event_id, f"Event {event_id}", start, start)
+
+
+def test_pending_is_newest_first_and_between_is_start_ordered():
+    store = PendingStore()
+    for event_id, start in [("a", "2026-03-05T09:00:00"), ("b", "2026-03-01T09:00:00"), ("c", "2026-03-03T09:00:00")]:
+        assert store.add(_event(event_id, start))
+    assert [e.id for e in store.pending()] == ["c", "b", "a"]
+    assert [e.id for e in store.between()] == ["b", "c", "a"]
+    assert [e.id for e in store.between("2026-03-02", "2026-03-05")] == ["c"]
+
+
+def test_duplicate_add_is_refused():
+    store = PendingStore()
+    assert store.add(_event("a", "2026-03-01T09:00:00"))
+    assert not store.add(_event("a", "2026-03-01T09:00:00"))
+    assert len(store) == 1
+
+
+def test_resolve_moves_the_event_to_history():
+    store = PendingStore()
+    store.add(_event("a", "2026-03-01T09:00:00"))
+    store.add(_event("b", "2026-03-02T09:00:00"))
+    assert store.resolve("a", "APPROVED").id == "a"
+    assert store.resolve("a", "REJECTED") is None
+    assert [e.id for e in store.pending()] == ["b"]
+    assert [e.id for e in store.between()] == ["b"]
+    assert [(e.id, e.status_tag) for e in store.history()] == [("a", "APPROVED"), ("b", "PENDING")]
+
+
+def test_resolved_ids_are_not_queued_again():
+    store = PendingStore(history_limit=1)
+    store.add(_event("a", "2026-03-01T09:00:00"))
+    store.add(_event("b", "2026-03-02T09:00:00"))
+    store.resolve("a", "APPROVED")
+    store.resolve("b", "REJECTED")
+    store.add(_event("c", "2026-03-03T09:00:00"))  # pushes a and b out of the history
+    assert [e.id for e in store.history()] == ["c"]
+    assert not store.add(_event("a", "2026-03-01T09:00:00"))
+    assert not store.add(_event("b", "2026-03-02T09:00:00"))
+    assert store.status("a") == "APPROVED"
+    assert store.status("b") == "REJECTED"
+    assert [e.id for e in store.pending()] == ["c"]
+
+
+def test_resolved_ids_are_bounded():
+    store = PendingStore(resolved_limit=2)
+    for event_id in "abc":
+        store.add(_event(event_id, "2026-03-01T09:00:00"))
+        store.resolve(event_id, "REJECTED")
+    assert store.add(_event("a", "2026-03-01T09:00:00"))
+    assert not store.add(_event("c", "2026-03-01T09:00:00"))
+
+
+def test_concurrent_resolve_hands_the_event_out_once():
+    store = PendingStore()
+    store.add(_event("a", "2026-03-01T09:00:00"))
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(store.resolve("a", "APPROVED"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(1 for r in results if r is not None) == 1
@@ -0,0 +1,69 @@
+import os
+import re
+
+from portal_extractors import extract_known_layout, parse_portal_datetime
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "portal")
+WEDUC_URL = "https://app.weduc.co.uk/calendar/event"
+SCHOOLCLOUD_URL = "https://bishopgilpin.schoolcloud.co.uk/Parent"
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+def test_weduc_calendar_fixture():
+    events = extract_known_layout(WEDUC_URL, _fixture("weduc_calendar.html"))
+    assert [e["event_title"] for e in events] == [
+        "Year 5 Trip to the Science Museum", "FOBG Krispy Kreme Sale", "Year 3 Parents' Evening", "World Book Day"]
+    trip, sale, evening, book_day = events
+    assert trip["start_time"] == "2026-03-05T08:45:00"
+    assert trip["location"] == "Science Museum, Exhibition Road"
+    assert (sale["start_time"], sale["end_time"]) == ("2026-03-06T15:15:00", "2026-03-06T16:00:00")
+    assert (evening["start_time"], evening["end_time"]) == ("2026-03-17T15:30:00", "2026-03-17T19:00:00")
+    assert book_day["start_time"] == "2026-03-05T09:00:00"
+    assert all(e["extractor"] == "weduc_calendar" and e["source_url"] == WEDUC_URL for e in events)
+
+def test_schoolcloud_fixture():
+    events = extract_known_layout(SCHOOLCLOUD_URL, _fixture("schoolcloud_parent.html"))
+    assert [(e["event_title"], e["start_time"], e["end_time"], e["location"]) for e in events] == [
+        ("Year 5 Parents' Evening - Mrs Patel", "2026-03-12T16:40:00", "2026-03-12T16:50:00", "Classroom 5P"),
+        ("Year 3 Parents' Evening - Mr Jones", "2026-03-17T17:20:00", "2026-03-17T17:30:00", "Video call"),
+    ]
+
+def test_drifted_markup_falls_back_to_agent():
+    # Container still there, items renamed: nothing parses, so the LLM agent must see the page
+    html = _fixture("weduc_calendar.html").replace('class="calendar-event"', 'class="cal-entry"')
+    assert extract_known_layout(WEDUC_URL, html) is None
+
+def test_dates_unreadable_falls_back_to_agent():
+    html = re.sub(r'(class="event-date">)[^<]+', r'\1Date to be confirmed', _fixture("schoolcloud_parent.html"))
+    assert extract_known_layout(SCHOOLCLOUD_URL, html) is None
+
+def test_empty_list_is_no_events():
+    html = '<html><body><ul class="calendar-events"></ul></body></html>'
+    assert extract_known_layout(WEDUC_URL, html) == []
+
+def test_missing_container_or_unknown_page():
+    assert extract_known_layout(WEDUC_URL, "<html><body><p>Session expired</p></body></html>") is None
+    assert extract_known_layout("https://example.com/", _fixture("weduc_calendar.html")) is None
+
+def test_late_start_without_end_lasts_an_hour():
+    assert parse_portal_datetime("2026-03-05T23:15") == ("2026-03-05T23:15:00", "2026-03-06T00:15:00")
+    assert parse_portal_datetime("Fri 6 Mar 2026 23:30") == ("2026-03-06T23:30:00", "2026-03-07T00:30:00")
+
+def test_end_past_midnight():
+    assert parse_portal_datetime("Fri 6 Mar 2026 22:00 - 00:30") == ("2026-03-06T22:00:00", "2026-03-07T00:30:00")
+
+def test_one_unparseable_item_falls_back_to_agent():
+    # A partial result would commit the page's fingerprint and lose the unparsed item for good
+    html = _fixture("weduc_calendar.html").replace("Thu 5th March 2026", "Date to follow")
+    assert extract_known_layout(WEDUC_URL, html) is None
+
+def test_item_without_date_falls_back_to_agent():
+    html = _fixture("weduc_calendar.html").replace('<p class="event-date">Thu 5th March 2026</p>', "")
+    assert extract_known_layout(WEDUC_URL, html) is None
+
+def test_notice_and_newsfeed_pages_go_to_agent():
+    html = '<div class="notices"><div class="notice"><h3>Trip</h3><time>2026-03-01</time></div></div>'
+    assert extract_known_layout("https://app.weduc.co.uk/notice/daily/index", html) is None
+    assert extract_known_layout("https://app.weduc.co.uk/dashboard/newsfeed/list/user/1", html) is None
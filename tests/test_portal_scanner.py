@@ -0,0 +1,56 @@
+import asyncio
+import os
+
+import portal_scanner
+from portal_scanner import compute_fingerprint, looks_like_login_page
+from state_manager import load_portal_fingerprints
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "portal")
+CALENDAR_URL = "https://app.weduc.co.uk/calendar/event/index"
+MESSAGES_URL = "https://app.weduc.co.uk/message/message/index/folder/1"
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+def _scan(monkeypatch, pages):
+    async def fetch(urls, username, password):
+        return {url: pages.get(url) for url in urls}
+    monkeypatch.setattr(portal_scanner, "PORTAL_URLS", list(pages))
+    monkeypatch.setattr(portal_scanner, "fetch_portal_pages", fetch)
+    monkeypatch.setenv("SCHOOL_USERNAME", "parent")
+    monkeypatch.setenv("SCHOOL_PASSWORD", "secret")
+    monkeypatch.delenv("SCHOOL_PORTAL_URL", raising=False)
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)  # pages needing the agent stay unextracted
+    events = asyncio.run(portal_scanner.scan_school_portal(log_callback=lambda msg: None))
+    return events, portal_scanner.last_scan_report
+
+def test_volatile_text_does_not_change_the_fingerprint():
+    page = "<html><body><nav>Menu</nav><main><p>Trip on Friday</p><p>Posted {} ago</p></main></body></html>"
+    assert compute_fingerprint(page.format("5 minutes"))[0] == compute_fingerprint(page.format("2 hours"))[0]
+    assert compute_fingerprint(page.format("5 minutes"))[0] != compute_fingerprint(page.replace("Friday", "Monday").format("5 minutes"))[0]
+
+def test_login_page_is_detected():
+    assert looks_like_login_page('<form><input type="password" name="p"></form>')
+    assert not looks_like_login_page(_fixture("weduc_calendar.html"))
+
+def test_parsed_pages_are_committed_and_then_skipped(data_dir, monkeypatch):
+    pages = {CALENDAR_URL: _fixture("weduc_calendar.html"), MESSAGES_URL: "<html><body><main>New message</main></body></html>"}
+    events, report = _scan(monkeypatch, pages)
+    assert len(events) == 4
+    assert report["parsed_pages"] == [CALENDAR_URL]
+    assert report["llm_pages"] == [MESSAGES_URL]
+    # Only the page that was actually extracted gets its fingerprint stored
+    assert set(load_portal_fingerprints()) == {CALENDAR_URL}
+
+    events, report = _scan(monkeypatch, pages)
+    assert events == []
+    assert report["skipped_pages"] == [CALENDAR_URL]
+    assert report["changed_pages"] == [MESSAGES_URL]
+    assert report["estimated_tokens_saved"] > 0
+
+def test_unfetched_page_is_treated_as_changed(data_dir, monkeypatch):
+    events, report = _scan(monkeypatch, {CALENDAR_URL: None})
+    assert report["changed_pages"] == [CALENDAR_URL]
+    assert report["llm_pages"] == [CALENDAR_URL]
+    assert load_portal_fingerprints() == {}
@@ -0,0 +1,90 @@
+import time
+from datetime import date, datetime, timedelta
+
+import etl_pipeline
+import priority
+from fake_services import FakeCalendarService
+from priority import can_defer, load_carry_over, prioritize, update_carry_over
+from records import CandidateEvent, Message
+
+TODAY = date(2026, 10, 19)
+
+def _prepared(start=None, ignore=False):
+    event = CandidateEvent(start_time=f"{start}T10:00:00") if start else None
+    return ("IGNORE" if ignore else [], event, [])
+
+def test_near_term_first_then_by_score():
+    emails = [Message("18a0", "Newsletter", "news@example.com", "Autumn news"),
+              Message("18a1", "Trip", "office@example.com", "Trip"),
+              Message("18a2", "Cake sale", "office@example.com", "Cake sale"),
+              Message("18a3", "Unsubscribe", "spam@example.com", "Buy now")]
+    prepared = [_prepared(), _prepared("2026-12-01"), _prepared("2026-10-22"), _prepared(ignore=True)]
+    order = prioritize(emails, prepared, {}, today=TODAY)
+    assert [index for index, _, _ in order] == [2, 1, 0, 3]
+    assert [near_term for _, _, near_term in order] == [True, False, False, False]
+    assert order[-1][1] is None
+
+def test_trusted_sender_and_child_raise_the_score(config, monkeypatch):
+    monkeypatch.setattr(priority, "TRUSTED_SENDERS", ["bishopgilpin.org"])
+    emails = [Message("18a0", "Notice", "office@elsewhere.com", "A notice"),
+              Message("18a1", "Notice", "office@bishopgilpin.org", "A notice"),
+              Message("18a2", "Notice", "office@elsewhere.com", "A notice for Tristan Dewsbery")]
+    scores = {index: score for index, score, _ in prioritize(emails, [_prepared()] * 3, config, today=TODAY)}
+    assert scores[1] > scores[0] and scores[2] > scores[0]
+
+def test_carried_over_mail_gets_a_bonus():
+    emails = [Message("18a1", "Notice", body="A"), Message("18a0", "Notice", body="A")]
+    carried = {"18a0": {"runs": 2, "first_deferred": time.time()}}
+    order = prioritize(emails, [_prepared()] * 2, {}, carried, today=TODAY)
+    assert order[0][0] == 1
+
+def test_an_email_is_deferred_at_most_defer_max_runs_times(monkeypatch):
+    monkeypatch.setattr(priority, "DEFER_MAX_RUNS", 2)
+    assert can_defer("a", False, {})
+    assert can_defer("a", False, {"a": {"runs": 1}})
+    assert not can_defer("a", False, {"a": {"runs": 2}})
+    assert not can_defer("a", True, {})
+
+def test_carry_over_store(data_dir):
+    now = time.time()
+    store = update_carry_over({}, set(), {"a": ("quota", 0.4), "b": ("llm_budget", 0.3)}, now=now)
+    assert store["a"]["runs"] == 1 and store["b"]["reason"] == "llm_budget"
+
+    store = update_carry_over(load_carry_over(now), {"b"}, {"a": ("quota", 0.5)}, now=now + 60)
+    assert set(store) == {"a"}
+    assert store["a"]["runs"] == 2 and store["a"]["first_deferred"] == now
+    assert load_carry_over(now + (priority.DEFER_MAX_DAYS + 1) * 86400) == {}
+
+def _notice(msg_id, days, subject="Year 2 trip to the Science Museum"):
+    day = datetime.now() + timedelta(days=days)
+    body = (f"Dear parents, the Year 2 trip to the Science Museum is on {day:%A} {day.day} {day:%B %Y} at 9:15am. "
+            "Children need a packed lunch and a waterproof coat. Please return the consent slip to the office.")
+    return Message(msg_id, subject, "office@example.com", body)
+
+def _run(emails, config):
+    queued = []
+    etl_pipeline.process_emails(emails, config, FakeCalendarService(), log_callback=lambda msg: None,
+                                event_callback=queued.append)
+    return queued
+
+def _defer_trip_notice(config, monkeypatch):
+    """Runs a quota-1 run in which the trip notice (a reminder standing for the original) is deferred."""
+    monkeypatch.setattr(etl_pipeline, "RUN_EMAIL_QUOTA", 1)
+    soon = _notice("18b9", 14, "Cake sale")
+    soon.body = soon.body.replace("Year 2 trip to the Science Museum", "cake sale in the hall")
+    reminder, trip = _notice("18b2", 60, "Reminder: Year 2 trip to the Science Museum"), _notice("18b1", 60)
+    assert len(_run([soon, reminder, trip], config)) == 1
+    assert set(load_carry_over()) == {"18b2"}
+    monkeypatch.setattr(etl_pipeline, "RUN_EMAIL_QUOTA", 0)
+    return reminder, trip
+
+def test_deferred_email_is_processed_next_run_with_near_duplicates_on(config, monkeypatch):
+    reminder, trip = _defer_trip_notice(config, monkeypatch)
+    [queued] = _run([reminder, trip], config)
+    assert queued.duplicate_ids == ["18b1"]
+    assert load_carry_over() == {}
+
+def test_copies_of_a_deferred_notice_are_not_skipped_as_seen(config, monkeypatch):
+    _, trip = _defer_trip_notice(config, monkeypatch)
+    # The reminder is gone by the next run: the original must stand in for it, not count as handled
+    assert len(_run([trip], config)) == 1
@@ -0,0 +1,58 @@
+import os
+import time
+
+import pytest
+
+import profiling
+
+@pytest.fixture
+def profiles_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILES_DIR", str(tmp_path))
+    return tmp_path
+
+def _busy():
+    return sum(i * i for i in range(20000))
+
+def test_cprofile_run_saves_artifact_and_summary(profiles_dir):
+    with profiling.profile_run("cprofile", "manual", log_callback=lambda msg: None):
+        _busy()
+    [summary] = profiling.list_profiles()
+    assert summary["mode"] == "cprofile" and summary["label"] == "manual"
+    assert summary["artifact"].endswith(".prof") and summary["top"]
+    assert profiling.profile_path(summary["artifact"]) == os.path.join(str(profiles_dir), summary["artifact"])
+
+def test_sampling_run_sees_the_job_thread(profiles_dir, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_INTERVAL", 0.001)
+    with profiling.profile_run("sampling", "manual", log_callback=lambda msg: None):
+        deadline = time.time() + 0.2
+        while time.time() < deadline:
+            _busy()
+    [summary] = profiling.list_profiles()
+    assert summary["samples"] > 0
+    assert any("_busy" in row["function"] or "genexpr" in row["function"] for row in summary["top"])
+
+def test_no_mode_is_a_no_op_and_unknown_modes_are_refused(profiles_dir):
+    with profiling.profile_run(None) as profiler:
+        assert profiler is None
+    assert profiling.list_profiles() == []
+    with pytest.raises(ValueError):
+        with profiling.profile_run("perf"):
+            pass
+
+def test_only_the_newest_profiles_are_kept(profiles_dir, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_KEEP", 2)
+    base = time.time() - 3600
+    for minute in range(4):
+        profiler = profiling.SamplingProfiler()
+        profiling.save_profile(profiler, "sampling", f"run{minute}", base + 60 * minute, 0.1,
+                               log_callback=lambda msg: None)
+    assert [p["label"] for p in profiling.list_profiles()] == ["run3", "run2"]
+    # The pruned runs' artifacts go with their summaries
+    assert len(os.listdir(profiles_dir)) == 4
+
+def test_profile_path_only_serves_plain_names_in_the_profiles_dir(profiles_dir):
+    (profiles_dir / "20260101-000000_manual_cprofile.prof").write_text("x")
+    (profiles_dir / ".hidden").write_text("x")
+    assert profiling.profile_path("20260101-000000_manual_cprofile.prof")
+    for name in ("../state.json", "..", ".hidden", "a/b.prof", "missing.prof", "", None):
+        assert profiling.profile_path(name) is None
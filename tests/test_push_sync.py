@@ -0,0 +1,45 @@
+import time
+
+import push_sync
+from fake_services import FakeCalendarService, FakeGmailService, generate_mailbox
+from state_manager import get_gmail_history_id, get_last_successful_run, update_last_successful_run
+
+def _batch(history_id):
+    return {"notices": 1, "history_id": history_id, "first_at": time.time()}
+
+def test_fallback_scan_leaves_the_sweep_lookback_alone(config):
+    update_last_successful_run()
+    marker = get_last_successful_run()
+    queued = []
+    services = {"gmail": FakeGmailService(generate_mailbox(30)), "calendar": FakeCalendarService()}
+    # No stored historyId: the batch falls back to a 24 hour scan
+    report = push_sync.run_push_batch(_batch(1000), log_callback=lambda msg: None,
+                                      event_callback=queued.append, services=services)
+    assert report["outcome"] == "full_scan"
+    assert get_last_successful_run() == marker
+    assert get_gmail_history_id() == "1000"
+
+def test_push_is_refused_without_a_configured_token(monkeypatch):
+    monkeypatch.setattr(push_sync, "PUSH_VERIFICATION_TOKEN", None)
+    assert not push_sync.push_authorized(None)
+    assert not push_sync.push_authorized("")
+    assert not push_sync.push_authorized("anything")
+
+def test_push_needs_the_matching_token(monkeypatch):
+    monkeypatch.setattr(push_sync, "PUSH_VERIFICATION_TOKEN", "s3cret")
+    assert push_sync.push_authorized("s3cret")
+    assert not push_sync.push_authorized("s3cre")
+    assert not push_sync.push_authorized(None)
+
+def test_no_watch_is_registered_without_a_token(config, monkeypatch):
+    monkeypatch.setattr(push_sync, "GMAIL_PUSH_TOPIC", "projects/p/topics/gmail")
+    monkeypatch.setattr(push_sync, "PUSH_VERIFICATION_TOKEN", None)
+    gmail = FakeGmailService(generate_mailbox(3))
+    logged = []
+    assert push_sync.renew_watch({"gmail": gmail, "calendar": FakeCalendarService()}, log_callback=logged.append) is None
+    assert "watch" not in gmail.stats
+    assert "PUSH_VERIFICATION_TOKEN" in logged[0]
+
+    monkeypatch.setattr(push_sync, "PUSH_VERIFICATION_TOKEN", "s3cret")
+    assert push_sync.renew_watch({"gmail": gmail, "calendar": FakeCalendarService()}, log_callback=logged.append)
+    assert gmail.stats["watch"] == 1
@@ -0,0 +1,47 @@
+import pytest
+
+from records import CandidateEvent, Message, PendingEvent
+
+
+@pytest.mark.parametrize("record", [
+    Message("m1"),
+    CandidateEvent("Sports Day"),
+    PendingEvent("abc", "Sports Day", "2026-06-10T09:00:00", "2026-06-10T10:00:00"),
+])
+def test_records_have_no_instance_dict(record):
+    assert not hasattr(record, "__dict__")
+    # A misspelt field fails loudly instead of silently adding an attribute
+    with pytest.raises(AttributeError):
+        record.stat_time = "2026-06-10"
+
+
+def test_message_round_trip():
+    message = Message("m1", "Trip", "office@school.org", "Body text", ("BEGIN:VCALENDAR",))
+    again = Message.from_dict(message.to_dict())
+    assert again.to_dict() == message.to_dict()
+    assert again.calendar == ("BEGIN:VCALENDAR",)
+    assert "calendar" not in Message("m2").to_dict()
+
+
+def test_candidate_event_keeps_a_reference_not_a_copy():
+    message = Message("m1", body="x" * 10000)
+    event = CandidateEvent("Trip", "2026-05-14T09:00:00", source_id="m1", message=message)
+    assert event.message is message
+    assert "message" not in event.to_dict()
+    assert CandidateEvent.from_dict({"summary": "Trip", "unknown": 1, "start_time": "2026-05-14"}).event_title == "Trip"
+
+
+def test_pending_event_round_trip_with_status():
+    event = PendingEvent("abc", "Sports Day", "2026-06-10T09:00:00", "2026-06-10T10:00:00", location="Field",
+                         tenant_id="t1", discovered_at="2026-06-01 08:00:00", status_tag="PENDING",
+                         recurrence=["RRULE:FREQ=WEEKLY"], duplicate_ids=["m2"], labels=["Tristan"])
+    again = PendingEvent.from_dict(event.to_dict(with_status=True))
+    assert again.to_dict(with_status=True) == event.to_dict(with_status=True)
+
+
+def test_all_day_events_use_date_bodies():
+    event = PendingEvent("abc", "INSET day", "2026-06-10", "2026-06-11")
+    body = event.calendar_body()
+    assert body["start"] == {"date": "2026-06-10"}
+    assert body["end"] == {"date": "2026-06-11"}
+    assert PendingEvent.from_dict(event.to_dict()).start_time == "2026-06-10"
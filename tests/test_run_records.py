@@ -0,0 +1,38 @@
+import pytest
+
+import etl_pipeline
+import metrics
+from fake_services import FakeCalendarService, FakeGmailService, generate_mailbox
+from state_manager import load_run_history
+
+def _services(size=20):
+    return {"gmail": FakeGmailService(generate_mailbox(size)), "calendar": FakeCalendarService()}
+
+def _failing_fetch(*args, **kwargs):
+    raise ConnectionError("Gmail went away")
+
+def test_failed_sweep_is_recorded(config, monkeypatch):
+    monkeypatch.setattr(etl_pipeline, "fetch_email", _failing_fetch)
+    with pytest.raises(ConnectionError):
+        etl_pipeline.run_pipeline(log_callback=lambda msg: None, services=_services())
+    record = load_run_history()[0]
+    assert record["status"] == "failed"
+    assert record["error"] == "ConnectionError: Gmail went away"
+    assert metrics.current_run() is None
+
+def test_failed_incremental_sync_is_recorded(config, monkeypatch):
+    monkeypatch.setattr(etl_pipeline, "process_emails", lambda *args, **kwargs: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        etl_pipeline.run_incremental_sync(["18c2f0a1b2c3d4e5"], log_callback=lambda msg: None, services=_services())
+    record = load_run_history()[0]
+    assert record["status"] == "failed"
+    assert record["error"].startswith("ZeroDivisionError")
+    assert metrics.current_run() is None
+
+def test_successful_sweep_is_recorded(config):
+    queued = []
+    etl_pipeline.run_pipeline(log_callback=lambda msg: None, event_callback=queued.append, services=_services())
+    record = load_run_history()[0]
+    assert record["status"] == "success"
+    assert "error" not in record
+    assert queued
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+
+import pytest
+
+import tenants
+from fake_services import FakeCalendarService, FakeGmailService, generate_mailbox
+
+
+@pytest.fixture
+def households(data_dir, monkeypatch):
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    monkeypatch.setattr(tenants, "_last_started", {})
+    with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.template.json")) as f:
+        config = json.load(f)
+    made = []
+    for i in range(3):
+        tenant = tenants.Tenant(f"t{i}", data_dir=os.path.join(data_dir, f"t{i}"), calls_per_minute=6000)
+        tenant.config = config
+        made.append(tenant)
+    return made
+
+
+def _services(tenant):
+    return {"gmail": FakeGmailService(generate_mailbox(15, seed=int(tenant.id[1:]))), "calendar": FakeCalendarService()}
+
+
+def test_each_tenant_runs_with_its_own_state(households):
+    events = []
+    report = tenants.run_all_tenants(households, log_callback=lambda msg: None, event_callback=events.append,
+                                     max_workers=2, build_services=_services)
+    assert {tid: entry["status"] for tid, entry in report.items()} == {"t0": "SUCCESS", "t1": "SUCCESS", "t2": "SUCCESS"}
+    assert {event.tenant_id for event in events} == {"t0", "t1", "t2"}
+    for tenant in households:
+        assert os.path.exists(os.path.join(tenant.data_dir, "pipeline_state.json"))
+
+
+def test_least_recently_served_goes_first(households, monkeypatch):
+    monkeypatch.setattr(tenants, "_last_started", {"t0": 300.0, "t1": 100.0, "t2": 200.0})
+    order = []
+
+    def services(tenant):
+        order.append(tenant.id)
+        return _services(tenant)
+
+    tenants.run_all_tenants(households, log_callback=lambda msg: None, max_workers=1, build_services=services)
+    assert order == ["t1", "t2", "t0"]
+
+
+def test_running_tenant_is_not_queued_twice(households, monkeypatch):
+    monkeypatch.setattr(tenants, "_running", {"t1"})
+    report = tenants.run_all_tenants(households, log_callback=lambda msg: None, max_workers=2, build_services=_services)
+    assert set(report) == {"t0", "t2"}
+
+
+def test_failed_tenant_does_not_stop_the_others(households):
+    def services(tenant):
+        if tenant.id == "t1":
+            raise RuntimeError("token expired")
+        return _services(tenant)
+
+    report = tenants.run_all_tenants(households, log_callback=lambda msg: None, max_workers=2, build_services=services)
+    assert report["t1"]["status"] == "FAILED: token expired"
+    assert report["t0"]["status"] == report["t2"]["status"] == "SUCCESS"
+    assert tenants._running == set()
+
+
+def test_quota_service_takes_a_token_per_call():
+    limiter = tenants.QuotaLimiter(calls_per_minute=60)
+    gmail = tenants.QuotaService(FakeGmailService(generate_mailbox(3)), limiter)
+    gmail.users().messages().list(userId="me", q="").execute()
+    gmail.users().messages().list(userId="me", q="").execute()
+    assert 57.9 < limiter.tokens <= 58.1
+
+
+def test_quota_limiter_waits_when_the_bucket_is_empty():
+    limiter = tenants.QuotaLimiter(calls_per_minute=600)
+    limiter.tokens = 0
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert limiter.waited > 0